@@ -0,0 +1,337 @@
+"""
+Компактное игровое поле: один байт на ячейку.
+
+В бд поле хранится как BSON binary, в список списков строк
+разворачивается только на границе API. Открытые ячейки пишутся в бд
+битами блоками по OPENED_BLOCK ячеек, ход перезаписывает только блоки,
+где открылись ячейки.
+"""
+from typing import Any, Dict, List
+
+import numpy as np
+from bson import Binary
+from pydantic_core import core_schema
+
+# Закрытая ячейка на поле игрока и мина на поле data_field
+CLOSED = ' '
+MINE = ' '
+# Флаг игрока на закрытой ячейке в ответах API
+FLAG = 'F'
+# Ячеек в одном блоке битов открытых ячеек, 512 байт на блок
+OPENED_BLOCK = 4096
+
+
+class Board:
+    """
+    Поле width x height, ячейка (x, y) лежит в cells[x * height + y],
+    так же как field[x][y] в списке списков.
+    """
+    __slots__ = ('width', 'height', 'cells')
+
+    def __init__(
+            self, width: int, height: int,
+            cells: bytes | bytearray | None = None, fill: str = CLOSED
+    ):
+        self.width = width
+        self.height = height
+        if cells is None:
+            cells = fill.encode() * (width * height)
+        self.cells = bytearray(cells)
+
+    def index(self, x: int, y: int) -> int:
+        return x * self.height + y
+
+    def __getitem__(self, xy: tuple[int, int]) -> str:
+        return chr(self.cells[xy[0] * self.height + xy[1]])
+
+    def __setitem__(self, xy: tuple[int, int], value: str):
+        self.cells[xy[0] * self.height + xy[1]] = ord(value)
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, Board):
+            return (self.width, self.height, self.cells) == (
+                other.width, other.height, other.cells
+            )
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f'Board({self.width}x{self.height})'
+
+    def copy(self) -> 'Board':
+        return Board(self.width, self.height, self.cells)
+
+    def replace(self, old: str, new: str) -> 'Board':
+        """
+        Копия поля, где все ячейки old заменены на new.
+        """
+        return Board(
+            self.width, self.height,
+            self.cells.replace(old.encode(), new.encode())
+        )
+
+    def opened_mask(self) -> np.ndarray:
+        return np.frombuffer(self.cells, dtype=np.uint8) != ord(CLOSED)
+
+    def opened_indices(self) -> List[int]:
+        return np.flatnonzero(self.opened_mask()).tolist()
+
+    def opened_bits(
+            self, indices: List[int] | np.ndarray | None = None
+    ) -> Dict[str, bytes]:
+        """
+        Биты открытых ячеек по блокам: номер блока и его биты. Только
+        блоки с ячейками indices, без indices - все блоки с открытыми
+        ячейками.
+        """
+        opened = self.opened_mask()
+        if indices is None:
+            indices = np.flatnonzero(opened)
+        blocks = np.unique(
+            np.asarray(indices, dtype=np.int64) // OPENED_BLOCK
+        )
+        return {
+            str(block): np.packbits(
+                opened[block * OPENED_BLOCK:(block + 1) * OPENED_BLOCK]
+            ).tobytes()
+            for block in blocks.tolist()
+        }
+
+    def apply_opened_bits(self, data_field: 'Board', bits: Dict[str, bytes]):
+        """
+        Открывает ячейки из блоков битов значениями data_field.
+        """
+        field = np.frombuffer(self.cells, dtype=np.uint8)
+        data = np.frombuffer(data_field.cells, dtype=np.uint8)
+        for block, block_bits in bits.items():
+            start = int(block) * OPENED_BLOCK
+            cells = field[start:start + OPENED_BLOCK]
+            mask = np.unpackbits(
+                np.frombuffer(block_bits, dtype=np.uint8), count=len(cells)
+            ).view(bool)
+            cells[mask] = data[start:start + len(cells)][mask]
+
+    def to_lists(self) -> List[List[str]]:
+        row = self.height
+        cells = self.cells.decode('ascii')
+        return [list(cells[i:i + row]) for i in range(0, len(cells), row)]
+
+    @classmethod
+    def from_lists(cls, lists: List[List[str]]) -> 'Board':
+        height = len(lists[0]) if lists else 0
+        if any(len(row) != height for row in lists):
+            raise ValueError('Строки поля разной длины')
+        try:
+            cells = ''.join(''.join(row) for row in lists)
+        except TypeError as exc:
+            raise ValueError('Ячейка поля должна быть строкой') from exc
+        if len(cells) != len(lists) * height:
+            raise ValueError('Ячейка поля должна быть одним символом')
+        return cls(len(lists), height, cells.encode('ascii'))
+
+    def to_bson(self) -> Binary:
+        return Binary(bytes(self.cells))
+
+    @classmethod
+    def from_bson(cls, width: int, height: int, data: bytes) -> 'Board':
+        if len(data) != width * height:
+            raise ValueError('Размер поля не совпадает с шириной и высотой')
+        return cls(width, height, data)
+
+    @classmethod
+    def from_document(cls, width: int, height: int, value: Any) -> 'Board':
+        """
+        Поле из документа бд: BSON или, в документах, записанных до
+        хранения полей в BSON, список списков строк.
+        """
+        if isinstance(value, list):
+            board = cls.from_lists(value)
+            if (board.width, board.height) != (width, height):
+                raise ValueError(
+                    'Размер поля не совпадает с шириной и высотой'
+                )
+            return board
+        return cls.from_bson(width, height, value)
+
+    @classmethod
+    def validate(cls, value: Any) -> 'Board':
+        if isinstance(value, Board):
+            return value
+        if isinstance(value, list):
+            return cls.from_lists(value)
+        raise ValueError('Поле должно быть списком списков строк')
+
+    @classmethod
+    def __get_pydantic_core_schema__(cls, source, handler):
+        return core_schema.no_info_plain_validator_function(
+            cls.validate,
+            serialization=core_schema.plain_serializer_function_ser_schema(
+                lambda board: board.to_lists(), when_used='json'
+            ),
+        )
+
+    @classmethod
+    def __get_pydantic_json_schema__(cls, schema, handler):
+        return {
+            'type': 'array',
+            'items': {'type': 'array', 'items': {'type': 'string'}},
+        }
+
+
+def generate_data_field(
+        width: int, height: int, mines_count: int,
+        first_x: int, first_y: int, seed: Any = None
+) -> Board:
+    """
+    Поле с минами без мины в первой открытой ячейке. Мины выбираются
+    одной выборкой, цифры считаются суммой соседей 3x3 по всему полю.
+    :param seed: зерно генератора, с одним зерном поле всегда одинаковое
+    """
+    rng = np.random.default_rng(seed)
+    first = first_x * height + first_y
+    # Выбираем из всех ячеек кроме первой и сдвигаем номера за ней
+    positions = rng.choice(width * height - 1, size=mines_count, replace=False)
+    positions[positions >= first] += 1
+
+    mines = np.zeros(width * height, dtype=np.uint8)
+    mines[positions] = 1
+    mines = mines.reshape(width, height)
+
+    padded = np.pad(mines, 1)
+    counts = np.zeros((width, height), dtype=np.uint8)
+    for dx in range(3):
+        for dy in range(3):
+            counts += padded[dx:dx + width, dy:dy + height]
+
+    cells = counts + ord('0')
+    cells[mines == 1] = ord(MINE)
+    return Board(width, height, cells.tobytes())
+
+
+class ZeroRegions:
+    """
+    Связные области нулевых ячеек поля с минами и их граница из цифр.
+    Строятся один раз при создании поля, открытие нуля сразу открывает
+    всю его область без обхода в ширину.
+
+    labels - номер области для каждой ячейки (-1 у ненулевых),
+    ячейки области r лежат в members[offsets[r]:offsets[r + 1]].
+    """
+    __slots__ = ('labels', 'offsets', 'members')
+
+    def __init__(
+            self, labels: np.ndarray, offsets: np.ndarray, members: np.ndarray
+    ):
+        self.labels = labels
+        self.offsets = offsets
+        self.members = members
+
+    def region(self, index: int) -> np.ndarray | None:
+        """
+        Ячейки, которые открывает нулевая ячейка index.
+        """
+        label = self.labels[index]
+        if label < 0:
+            return None
+        return self.members[self.offsets[label]:self.offsets[label + 1]]
+
+    @classmethod
+    def build(cls, data_field: Board) -> 'ZeroRegions':
+        width, height = data_field.width, data_field.height
+        cells = np.frombuffer(data_field.cells, dtype=np.uint8)
+        zero = (cells == ord('0')).reshape(width, height)
+        n = width * height
+
+        # Система непересекающихся множеств на массивах: соседние нули
+        # подвешиваем к меньшему корню и сжимаем пути до неподвижной точки
+        index = np.arange(n).reshape(width, height)
+        pairs = []
+        for dx, dy in ((0, 1), (1, -1), (1, 0), (1, 1)):
+            xs = slice(0, width - dx)
+            ys = slice(max(0, -dy), height - max(0, dy))
+            nxs = slice(dx, width)
+            nys = slice(max(0, dy), height - max(0, -dy))
+            both = zero[xs, ys] & zero[nxs, nys]
+            pairs.append((index[xs, ys][both], index[nxs, nys][both]))
+        u = np.concatenate([a for a, _ in pairs])
+        v = np.concatenate([b for _, b in pairs])
+
+        parent = np.arange(n)
+        while True:
+            pu, pv = parent[u], parent[v]
+            differ = pu != pv
+            if not differ.any():
+                break
+            np.minimum.at(
+                parent,
+                np.maximum(pu[differ], pv[differ]),
+                np.minimum(pu[differ], pv[differ])
+            )
+            while True:
+                grand = parent[parent]
+                if np.array_equal(grand, parent):
+                    break
+                parent = grand
+        zero_flat = zero.ravel()
+        roots = zero_flat & (parent == np.arange(n))
+        region_labels = np.full(n, -1, dtype=np.int32)
+        region_labels[zero_flat] = (np.cumsum(roots) - 1)[parent[zero_flat]]
+
+        # Область вместе с границей: нулевые ячейки и все их соседи
+        xs, ys = np.nonzero(zero)
+        owners, neighbours = [], []
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                nx, ny = xs + dx, ys + dy
+                inside = (0 <= nx) & (nx < width) & (0 <= ny) & (ny < height)
+                owners.append(region_labels[xs[inside] * height + ys[inside]])
+                neighbours.append(nx[inside] * height + ny[inside])
+        keys = np.sort(
+            np.concatenate(owners).astype(np.int64) * n +
+            np.concatenate(neighbours)
+        )
+        if keys.size:
+            keys = keys[np.concatenate(([True], keys[1:] != keys[:-1]))]
+        members = (keys % n).astype(np.int32)
+        offsets = np.searchsorted(
+            keys // n, np.arange(roots.sum() + 1)
+        ).astype(np.int32)
+        return cls(region_labels, offsets, members)
+
+    def to_bson(self) -> dict:
+        """
+        Массивы в самом узком беззнаковом типе, в который влезают их
+        значения, номера областей сдвинуты на один (0 - ненулевая ячейка).
+        """
+        arrays = {
+            'labels': self.labels + 1,
+            'offsets': self.offsets,
+            'members': self.members,
+        }
+        data = {'dtypes': {}}
+        for key, array in arrays.items():
+            dtype = _unsigned_dtype(int(array.max(initial=0)))
+            data[key] = Binary(array.astype(dtype).tobytes())
+            data['dtypes'][key] = dtype.str
+        return data
+
+    @classmethod
+    def from_bson(cls, data: dict) -> 'ZeroRegions':
+        # Без dtypes - прежний формат, все массивы int32
+        dtypes = data.get('dtypes')
+        if dtypes is None:
+            return cls(*(
+                np.frombuffer(data[key], dtype=np.int32)
+                for key in ('labels', 'offsets', 'members')
+            ))
+        labels, offsets, members = (
+            np.frombuffer(data[key], dtype=dtypes[key]).astype(np.int32)
+            for key in ('labels', 'offsets', 'members')
+        )
+        return cls(labels - 1, offsets, members)
+
+
+def _unsigned_dtype(max_value: int) -> np.dtype:
+    for dtype in (np.uint8, np.uint16):
+        if max_value <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.uint32)
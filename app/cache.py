@@ -0,0 +1,268 @@
+"""
+Кеши в памяти процесса
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache:
+    """
+    Кеш на maxsize элементов, при переполнении вытесняется элемент,
+    к которому дольше всего не обращались.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: OrderedDict[Hashable, Any] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        try:
+            self._data.move_to_end(key)
+        except KeyError:
+            return default
+        return self._data[key]
+
+    def put(self, key: Hashable, value: Any):
+        if self.maxsize <= 0:
+            return
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        return self._data.pop(key, default)
+
+    def clear(self):
+        self._data.clear()
+
+
+class TTLCache:
+    """
+    Значения на ttl секунд с момента записи, при ttl <= 0 не хранит
+    ничего. Для немногих ключей: устаревшее значение заменяется следующей
+    записью.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._data: dict[Hashable, tuple[float, Any]] = {}
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key)
+        if entry is None or time.monotonic() - entry[0] >= self.ttl:
+            return default
+        return entry[1]
+
+    def put(self, key: Hashable, value: Any):
+        if self.ttl <= 0:
+            return
+        self._data[key] = (time.monotonic(), value)
+
+    def clear(self):
+        self._data.clear()
+
+
+class GameCache:
+    """
+    Активные игры в памяти процесса: LRU на maxsize игр с вытеснением по
+    ttl секунд без ходов. Изменения пишутся в бд отложенно: по таймеру
+    раз в flush_interval секунд и при вытеснении игры из кеша.
+
+    У игры должны быть game_id и асинхронный save(db), который пишет
+    накопленные изменения. Если save выбросил исключение из discard_on,
+    игра выкидывается из кеша без повторной записи.
+    """
+
+    def __init__(
+            self, maxsize: int, ttl: float, flush_interval: float,
+            discard_on: tuple[type[Exception], ...] = ()
+    ):
+        self.maxsize = maxsize
+        self.discard_on = discard_on
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self._games: OrderedDict[str, _CacheEntry] = OrderedDict()
+        # Загрузки игр из бд после промаха, по одной на игру
+        self._loading: dict[str, asyncio.Future] = {}
+        self._task: asyncio.Task | None = None
+
+        self.hits = 0
+        self.misses = 0
+        self.flushes = 0
+        self.discarded = 0
+        self.last_flush_seconds = 0.0
+
+    def __len__(self) -> int:
+        return len(self._games)
+
+    async def get(self, game_id: str) -> Any:
+        entry = self._games.get(game_id)
+        if entry is None or entry.expires_at < time.monotonic():
+            # Просроченную игру сначала пишем, чтобы из бд прочитать свежую
+            self.misses += 1
+            await self.pop(game_id)
+            return None
+        self.hits += 1
+        self._games.move_to_end(game_id)
+        entry.expires_at = time.monotonic() + self.ttl
+        return entry.game
+
+    async def get_or_load(
+            self, game_id: str, load: Callable[[], Awaitable[Any]], db: Any
+    ) -> Any:
+        """
+        Игра из кеша, при промахе - из load(). Одновременные промахи по
+        одной игре ждут одну загрузку: иначе каждый запрос положил бы в
+        кеш свой объект игры и ходы всех, кроме последнего, потерялись бы.
+        """
+        game = await self.get(game_id)
+        if game is not None:
+            return game
+        loading = self._loading.get(game_id)
+        if loading is None:
+            loading = asyncio.ensure_future(self._load(game_id, load, db))
+            self._loading[game_id] = loading
+        return await asyncio.shield(loading)
+
+    async def _load(
+            self, game_id: str, load: Callable[[], Awaitable[Any]], db: Any
+    ) -> Any:
+        try:
+            game = await load()
+            # Пока шла загрузка, игру мог положить в кеш другой запрос
+            entry = self._games.get(game_id)
+            if entry is not None:
+                return entry.game
+            await self.put(game, db)
+            return game
+        finally:
+            self._loading.pop(game_id, None)
+
+    async def put(self, game: Any, db: Any):
+        self._games[game.game_id] = _CacheEntry(
+            game, db, time.monotonic() + self.ttl
+        )
+        self._games.move_to_end(game.game_id)
+        while len(self._games) > self.maxsize:
+            _, entry = self._games.popitem(last=False)
+            await self._flush_entry(entry)
+
+    def mark_dirty(self, game_id: str):
+        entry = self._games.get(game_id)
+        if entry is not None and entry.dirty_since is None:
+            entry.dirty_since = time.monotonic()
+
+    async def pop(self, game_id: str, flush: bool = True):
+        entry = self._games.pop(game_id, None)
+        if entry is not None and flush:
+            await self._flush_entry(entry)
+
+    async def flush(self):
+        """
+        Пишет в бд все измененные игры и вытесняет просроченные.
+        """
+        start = time.monotonic()
+        for game_id, entry in list(self._games.items()):
+            if entry.expires_at < start:
+                self._games.pop(game_id, None)
+            # Ошибка одной игры не останавливает запись остальных, игра
+            # с ошибкой остается в кеше до следующего сброса
+            try:
+                await self._flush_entry(entry)
+            except Exception:
+                logger.exception(
+                    'Не удалось записать игру %s из кеша', game_id
+                )
+        self.last_flush_seconds = time.monotonic() - start
+
+    async def _flush_entry(self, entry: '_CacheEntry'):
+        if entry.dirty_since is None:
+            return
+        entry.dirty_since = None
+        try:
+            await entry.game.save(entry.db)
+        except self.discard_on:
+            self._games.pop(entry.game.game_id, None)
+            self.discarded += 1
+            logger.warning(
+                'Игра %s изменена другим процессом, изменения из кеша '
+                'отброшены', entry.game.game_id
+            )
+            return
+        except Exception:
+            # Изменения остаются в игре, запишем их на следующем сбросе
+            if entry.dirty_since is None:
+                entry.dirty_since = time.monotonic()
+            if entry.game.game_id not in self._games:
+                self._games[entry.game.game_id] = entry
+            raise
+        self.flushes += 1
+
+    def flush_lag(self) -> float:
+        """
+        Сколько секунд лежит в памяти самое старое незаписанное изменение.
+        """
+        dirty = [
+            entry.dirty_since for entry in self._games.values()
+            if entry.dirty_since is not None
+        ]
+        return time.monotonic() - min(dirty) if dirty else 0.0
+
+    def stats(self) -> dict:
+        requests = self.hits + self.misses
+        return {
+            'size': len(self._games),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / requests if requests else 0.0,
+            'dirty': sum(
+                entry.dirty_since is not None
+                for entry in self._games.values()
+            ),
+            'flushes': self.flushes,
+            'discarded': self.discarded,
+            'flush_lag': self.flush_lag(),
+            'last_flush_seconds': self.last_flush_seconds,
+        }
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception('Не удалось записать игры из кеша')
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+        self._games.clear()
+
+
+class _CacheEntry:
+    __slots__ = ('game', 'db', 'expires_at', 'dirty_since')
+
+    def __init__(self, game: Any, db: Any, expires_at: float):
+        self.game = game
+        self.db = db
+        self.expires_at = expires_at
+        self.dirty_since: float | None = None
@@ -0,0 +1,389 @@
+"""
+Большие поля, которые не создаются целиком.
+
+Поле делится на куски chunk_size x chunk_size. Сколько мин в каждом куске
+определяется один раз по зерну игры, а сами мины и цифры куска
+генерируются только при первом обращении к нему. Память и место в бд
+расходуются только на открытую часть поля: открытые ячейки пишутся
+битами по кускам.
+
+Область нулей открывается целыми кусками на массивах (flood_fill), за
+один ход не больше FLOOD_MAX_CELLS ячеек.
+"""
+from collections import deque
+from typing import Any, Deque, Dict, List, Tuple
+
+import numpy as np
+from pydantic_core import core_schema
+
+from app.board import CLOSED, MINE
+from app.config import CHUNK_SIZE, FLOOD_MAX_CELLS
+
+
+def _border(d: int, size: int) -> Tuple[slice, slice]:
+    """
+    Какая полоса соседнего куска попадает в рамку вокруг текущего.
+    :return: срез в рамке и срез в соседнем куске
+    """
+    if d < 0:
+        return slice(0, 1), slice(-1, None)
+    if d == 0:
+        return slice(1, size + 1), slice(None)
+    return slice(size + 1, size + 2), slice(0, 1)
+
+
+class ChunkedMineField:
+    """
+    data_field для большого поля, детерминированно выводится из зерна.
+    Мина никогда не попадает в первую открытую ячейку.
+    """
+
+    def __init__(
+            self, width: int, height: int, mines_count: int, seed: int,
+            first_x: int, first_y: int, chunk_size: int = CHUNK_SIZE
+    ):
+        self.width = width
+        self.height = height
+        self.mines_count = mines_count
+        self.seed = seed
+        self.first_x = first_x
+        self.first_y = first_y
+        self.chunk_size = chunk_size
+        self.chunks_x = -(-width // chunk_size)
+        self.chunks_y = -(-height // chunk_size)
+
+        self._mines_per_chunk: np.ndarray | None = None
+        self._mines: Dict[Tuple[int, int], np.ndarray] = {}
+        self._values: Dict[Tuple[int, int], np.ndarray] = {}
+
+    def chunk_shape(self, cx: int, cy: int) -> Tuple[int, int]:
+        size = self.chunk_size
+        return (
+            min(size, self.width - cx * size),
+            min(size, self.height - cy * size)
+        )
+
+    def mines_per_chunk(self) -> np.ndarray:
+        """
+        Раскладывает mines_count по кускам так, будто мины ставились
+        равномерно по всему полю (многомерное гипергеометрическое).
+        """
+        if self._mines_per_chunk is None:
+            size = self.chunk_size
+            widths = np.minimum(
+                size, self.width - np.arange(self.chunks_x) * size
+            )
+            heights = np.minimum(
+                size, self.height - np.arange(self.chunks_y) * size
+            )
+            capacity = np.outer(widths, heights).astype(np.int64)
+            # В первую открытую ячейку мину не ставим
+            capacity[self.first_x // size, self.first_y // size] -= 1
+
+            rng = np.random.default_rng([self.seed, 0])
+            self._mines_per_chunk = rng.multivariate_hypergeometric(
+                capacity.ravel(), self.mines_count, method='marginals'
+            ).reshape(capacity.shape)
+        return self._mines_per_chunk
+
+    def chunk_mines(self, cx: int, cy: int) -> np.ndarray:
+        if (mines := self._mines.get((cx, cy))) is not None:
+            return mines
+
+        cw, ch = self.chunk_shape(cx, cy)
+        count = self.mines_per_chunk()[cx, cy]
+        rng = np.random.default_rng([self.seed, 1, cx, cy])
+        size = self.chunk_size
+        if (cx, cy) == (self.first_x // size, self.first_y // size):
+            first = (self.first_x - cx * size) * ch + self.first_y - cy * size
+            positions = rng.choice(cw * ch - 1, size=count, replace=False)
+            positions[positions >= first] += 1
+        else:
+            positions = rng.choice(cw * ch, size=count, replace=False)
+
+        mines = np.zeros(cw * ch, dtype=np.uint8)
+        mines[positions] = 1
+        mines = mines.reshape(cw, ch)
+        self._mines[(cx, cy)] = mines
+        return mines
+
+    def chunk_values(self, cx: int, cy: int) -> np.ndarray:
+        """
+        Ячейки куска как в data_field. Для цифр на краях генерируются
+        соседние куски.
+        """
+        if (values := self._values.get((cx, cy))) is not None:
+            return values
+
+        cw, ch = self.chunk_shape(cx, cy)
+        mines = self.chunk_mines(cx, cy)
+        window = np.zeros((cw + 2, ch + 2), dtype=np.uint8)
+        window[1:-1, 1:-1] = mines
+        for dcx in (-1, 0, 1):
+            for dcy in (-1, 0, 1):
+                ncx, ncy = cx + dcx, cy + dcy
+                if (dcx, dcy) == (0, 0) or not (
+                        0 <= ncx < self.chunks_x and 0 <= ncy < self.chunks_y
+                ):
+                    continue
+                wx, nx = _border(dcx, cw)
+                wy, ny = _border(dcy, ch)
+                window[wx, wy] = self.chunk_mines(ncx, ncy)[nx, ny]
+
+        counts = np.zeros((cw, ch), dtype=np.uint8)
+        for dx in range(3):
+            for dy in range(3):
+                counts += window[dx:dx + cw, dy:dy + ch]
+
+        values = counts + ord('0')
+        values[mines == 1] = ord(MINE)
+        self._values[(cx, cy)] = values
+        return values
+
+    def __getitem__(self, xy: Tuple[int, int]) -> str:
+        x, y = xy
+        cx, cy = x // self.chunk_size, y // self.chunk_size
+        values = self.chunk_values(cx, cy)
+        return chr(
+            values[x - cx * self.chunk_size, y - cy * self.chunk_size]
+        )
+
+    @classmethod
+    def __get_pydantic_core_schema__(cls, source, handler):
+        return core_schema.is_instance_schema(
+            cls,
+            serialization=core_schema.plain_serializer_function_ser_schema(
+                lambda value: None, when_used='json'
+            ),
+        )
+
+    @classmethod
+    def __get_pydantic_json_schema__(cls, schema, handler):
+        return {'type': 'null'}
+
+
+class ChunkedBoard:
+    """
+    Поле игрока для большого поля, хранит только куски с открытыми
+    ячейками. Не наследует Board: целиком поле не существует, поэтому
+    здесь только то, что можно сделать по кускам - доступ к ячейке,
+    биты открытых ячеек и копия. Целиком в список списков и BSON не
+    разворачивается.
+    """
+    __slots__ = ('width', 'height', 'chunk_size', 'chunks')
+
+    def __init__(self, width: int, height: int, chunk_size: int = CHUNK_SIZE):
+        self.width = width
+        self.height = height
+        self.chunk_size = chunk_size
+        self.chunks: Dict[Tuple[int, int], bytearray] = {}
+
+    def __getitem__(self, xy: Tuple[int, int]) -> str:
+        x, y = xy
+        size = self.chunk_size
+        chunk = self.chunks.get((x // size, y // size))
+        if chunk is None:
+            return CLOSED
+        return chr(chunk[(x % size) * size + y % size])
+
+    def chunk_array(self, cx: int, cy: int) -> np.ndarray:
+        """
+        Кусок chunk_size x chunk_size для записи, создается закрытым.
+        """
+        chunk = self.chunks.get((cx, cy))
+        if chunk is None:
+            size = self.chunk_size
+            chunk = self.chunks[(cx, cy)] = bytearray(
+                CLOSED.encode() * (size * size)
+            )
+        return np.frombuffer(chunk, dtype=np.uint8).reshape(
+            self.chunk_size, self.chunk_size
+        )
+
+    def __setitem__(self, xy: Tuple[int, int], value: str):
+        x, y = xy
+        size = self.chunk_size
+        chunk = self.chunks.get((x // size, y // size))
+        if chunk is None:
+            chunk = self.chunks[(x // size, y // size)] = bytearray(
+                CLOSED.encode() * (size * size)
+            )
+        chunk[(x % size) * size + y % size] = ord(value)
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, ChunkedBoard):
+            return (self.width, self.height, self.chunks) == (
+                other.width, other.height, other.chunks
+            )
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f'ChunkedBoard({self.width}x{self.height})'
+
+    def opened_indices(self) -> List[int]:
+        size = self.chunk_size
+        indices = []
+        for (cx, cy), chunk in self.chunks.items():
+            xs, ys = np.nonzero(
+                np.frombuffer(chunk, dtype=np.uint8).reshape(size, size) !=
+                ord(CLOSED)
+            )
+            indices.extend(
+                ((cx * size + xs) * self.height + cy * size + ys).tolist()
+            )
+        return indices
+
+    def opened_bits(
+            self, indices: List[int] | np.ndarray | None = None
+    ) -> Dict[str, bytes]:
+        """
+        Биты открытых ячеек по кускам, ключ куска "cx_cy".
+        """
+        size = self.chunk_size
+        if indices is None:
+            keys = self.chunks.keys()
+        else:
+            xs, ys = np.divmod(np.asarray(indices, dtype=np.int64),
+                               self.height)
+            keys = set(zip((xs // size).tolist(), (ys // size).tolist()))
+        return {
+            f'{cx}_{cy}': np.packbits(
+                np.frombuffer(self.chunks[(cx, cy)], dtype=np.uint8) !=
+                ord(CLOSED)
+            ).tobytes()
+            for cx, cy in keys
+        }
+
+    def apply_opened_bits(
+            self, data_field: ChunkedMineField, bits: Dict[str, bytes]
+    ):
+        size = self.chunk_size
+        for key, chunk_bits in bits.items():
+            cx, cy = (int(value) for value in key.split('_'))
+            cw, ch = data_field.chunk_shape(cx, cy)
+            mask = np.unpackbits(
+                np.frombuffer(chunk_bits, dtype=np.uint8), count=size * size
+            ).view(bool).reshape(size, size)[:cw, :ch]
+            cells = self.chunk_array(cx, cy)[:cw, :ch]
+            cells[mask] = data_field.chunk_values(cx, cy)[mask]
+
+    def to_lists(self) -> None:
+        return None
+
+    def copy(self) -> 'ChunkedBoard':
+        board = ChunkedBoard(self.width, self.height, self.chunk_size)
+        board.chunks = {
+            key: bytearray(chunk) for key, chunk in self.chunks.items()
+        }
+        return board
+
+    @classmethod
+    def __get_pydantic_core_schema__(cls, source, handler):
+        return core_schema.is_instance_schema(
+            cls,
+            serialization=core_schema.plain_serializer_function_ser_schema(
+                lambda board: board.to_lists(), when_used='json'
+            ),
+        )
+
+    @classmethod
+    def __get_pydantic_json_schema__(cls, schema, handler):
+        return {'type': 'null'}
+
+
+def _dilate(mask: np.ndarray) -> np.ndarray:
+    """
+    Ячейки mask и их соседи, в рамке на одну ячейку шире mask.
+    """
+    w, h = mask.shape
+    # Квадрат 3x3 раскладывается на сдвиги по x, а затем по y
+    rows = np.zeros((w + 2, h), dtype=bool)
+    for dx in range(3):
+        rows[dx:dx + w] |= mask
+    grown = np.zeros((w + 2, h + 2), dtype=bool)
+    for dy in range(3):
+        grown[:, dy:dy + h] |= rows
+    return grown
+
+
+def flood_fill(
+        field: ChunkedBoard, data_field: ChunkedMineField, x: int, y: int,
+        max_cells: int = FLOOD_MAX_CELLS
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Открывает ячейку (x, y), а если это ноль - его область с границей из
+    цифр, как обход в ширину по ячейкам, но по кускам целиком: внутри
+    куска область растет по закрытым нулям на массивах, соседи нулей на
+    краю куска продолжают обход в соседних кусках. Когда открыто не
+    меньше max_cells ячеек, новые куски не обходятся: нули на краю
+    остаются с закрытыми соседями, их откроют следующие ходы.
+    :return: координаты открытых ячеек
+    """
+    size = field.chunk_size
+    queue: Deque[Tuple[int, int]] = deque()
+    seeds: Dict[Tuple[int, int], np.ndarray] = {}
+
+    def add_seeds(cx: int, cy: int, mask: np.ndarray):
+        if (cx, cy) not in seeds:
+            seeds[(cx, cy)] = mask
+            queue.append((cx, cy))
+        else:
+            seeds[(cx, cy)] |= mask
+
+    start = np.zeros(data_field.chunk_shape(x // size, y // size), bool)
+    start[x % size, y % size] = True
+    add_seeds(x // size, y // size, start)
+
+    opened_x, opened_y = [], []
+    opened = 0
+    while queue and opened < max_cells:
+        cx, cy = queue.popleft()
+        to_open = seeds.pop((cx, cy))
+        values = data_field.chunk_values(cx, cy)
+        cells = field.chunk_array(cx, cy)[:values.shape[0], :values.shape[1]]
+        closed = cells == ord(CLOSED)
+        to_open &= closed
+        zeros = to_open & (values == ord('0'))
+        grown = None
+        if zeros.any():
+            # Область растет, пока находятся закрытые нули рядом с ней
+            while True:
+                grown = _dilate(zeros)
+                new_zeros = (
+                    grown[1:-1, 1:-1] & closed & (values == ord('0')) & ~zeros
+                )
+                if not new_zeros.any():
+                    break
+                zeros |= new_zeros
+            to_open |= grown[1:-1, 1:-1] & closed
+
+        cells[to_open] = values[to_open]
+        xs, ys = np.nonzero(to_open)
+        opened_x.append(xs + cx * size)
+        opened_y.append(ys + cy * size)
+        opened += len(xs)
+        if grown is None:
+            continue
+
+        # Соседи нулей за краем куска
+        cw, ch = values.shape
+        for dcx in (-1, 0, 1):
+            for dcy in (-1, 0, 1):
+                ncx, ncy = cx + dcx, cy + dcy
+                if (dcx, dcy) == (0, 0) or not (
+                        0 <= ncx < data_field.chunks_x and
+                        0 <= ncy < data_field.chunks_y
+                ):
+                    continue
+                wx, nx = _border(dcx, cw)
+                wy, ny = _border(dcy, ch)
+                edge = grown[wx, wy]
+                if not edge.any():
+                    continue
+                mask = np.zeros(data_field.chunk_shape(ncx, ncy), bool)
+                mask[nx, ny] = edge
+                add_seeds(ncx, ncy, mask)
+
+    if not opened_x:
+        return np.empty(0, np.int64), np.empty(0, np.int64)
+    return np.concatenate(opened_x), np.concatenate(opened_y)
@@ -0,0 +1,149 @@
+"""
+Настройки игры из переменных окружения
+"""
+import os
+
+# Предел размера поля, который можно задать через MAX_WIDTH и MAX_HEIGHT
+GIANT_MAX_SIDE = 10000
+
+# По умолчанию максимальные поля 30х30, но можно увеличить их размер
+MAX_WIDTH = min(int(os.environ.get("MAX_WIDTH", default=30)), GIANT_MAX_SIDE)
+MAX_HEIGHT = min(
+    int(os.environ.get("MAX_HEIGHT", default=30)), GIANT_MAX_SIDE
+)
+
+"""
+Поля больше DENSE_MAX_CELLS ячеек не создаются целиком, а генерируются
+по зерну игры кусками CHUNK_SIZE x CHUNK_SIZE по мере открытия. Документ
+целого поля - поле с минами, его области нулей, снимок поля игрока и
+биты открытых ячеек и флагов, около 10 байт на ячейку, при 250000
+ячейках заведомо меньше предела документа Mongo в 16 МБ. Один ход на
+большом поле открывает не больше FLOOD_MAX_CELLS ячеек
+"""
+DENSE_MAX_CELLS = int(os.environ.get("DENSE_MAX_CELLS", default=250_000))
+CHUNK_SIZE = int(os.environ.get("CHUNK_SIZE", default=64))
+FLOOD_MAX_CELLS = int(os.environ.get("FLOOD_MAX_CELLS", default=100_000))
+
+"""
+Как хранить поле с минами обычных игр:
+full - поле data_field целиком,
+seed - только зерно и первую ячейку, поле строится заново при загрузке
+"""
+BOARD_STORAGE = os.environ.get("BOARD_STORAGE", default="full")
+# Сколько построенных по зерну полей держать в памяти процесса
+BOARD_CACHE_SIZE = int(os.environ.get("BOARD_CACHE_SIZE", default=10000))
+
+"""
+Кеш активных игр:
+write-through - каждый ход читается из бд и сразу пишется в бд,
+write-behind - игры держатся в памяти, ходы пишутся в бд пачками
+"""
+GAME_CACHE_MODE = os.environ.get("GAME_CACHE_MODE", default="write-through")
+GAME_CACHE_SIZE = int(os.environ.get("GAME_CACHE_SIZE", default=10000))
+# Через сколько секунд без ходов игра вытесняется из кеша
+GAME_CACHE_TTL = float(os.environ.get("GAME_CACHE_TTL", default=300))
+# Как часто накопленные ходы пишутся в бд, в секундах
+GAME_CACHE_FLUSH_INTERVAL = float(
+    os.environ.get("GAME_CACHE_FLUSH_INTERVAL", default=1)
+)
+
+# Сколько ходов можно передать в /api/turns за один запрос
+MAX_BATCH_MOVES = int(os.environ.get("MAX_BATCH_MOVES", default=10000))
+# Сколько игр можно создать в /api/new/batch за один запрос
+MAX_BATCH_GAMES = int(os.environ.get("MAX_BATCH_GAMES", default=10000))
+
+# Игра по WebSocket пишется в бд раз в WS_PERSIST_MOVES ходов или
+# WS_PERSIST_INTERVAL секунд, а также при отключении
+WS_PERSIST_MOVES = int(os.environ.get("WS_PERSIST_MOVES", default=20))
+WS_PERSIST_INTERVAL = float(
+    os.environ.get("WS_PERSIST_INTERVAL", default=5)
+)
+
+# Сколько раз повторять ход, если игру одновременно изменил другой процесс
+CONFLICT_RETRIES = int(os.environ.get("CONFLICT_RETRIES", default=3))
+
+"""
+Брошенные игры удаляются через GAME_TTL секунд после последнего хода
+(0 - не удалять). В Mongo это TTL индекс по last_move_at, остальные
+хранилища чистят игры раз в GAME_EXPIRE_INTERVAL секунд
+"""
+GAME_TTL = int(os.environ.get("GAME_TTL", default=7 * 24 * 3600))
+GAME_EXPIRE_INTERVAL = float(
+    os.environ.get("GAME_EXPIRE_INTERVAL", default=60)
+)
+# Переносить завершенные игры из games в архив с итогом игры
+ARCHIVE_COMPLETED = os.environ.get(
+    "ARCHIVE_COMPLETED", default="false"
+).lower() in ("1", "true", "yes")
+
+# Писать журнал ходов каждой игры для повтора и аудита
+MOVE_LOG = os.environ.get("MOVE_LOG", default="true").lower() in (
+    "1", "true", "yes"
+)
+"""
+Подсказки /api/hint: поля до HINT_INLINE_CELLS ячеек решаются сразу,
+перебор ограничен HINT_TIME_BUDGET секунд. Разбор поля до перебора
+бюджетом не ограничен и растет с числом ячеек, поэтому сразу решаются
+только поля до 30x30. Большие поля и позиции, где бюджета не хватило,
+решаются в пуле из HINT_WORKERS процессов с бюджетом
+HINT_POOL_TIME_BUDGET (0 процессов - без пула)
+"""
+HINT_INLINE_CELLS = int(os.environ.get("HINT_INLINE_CELLS", default=900))
+HINT_TIME_BUDGET = float(os.environ.get("HINT_TIME_BUDGET", default=0.005))
+HINT_POOL_TIME_BUDGET = float(
+    os.environ.get("HINT_POOL_TIME_BUDGET", default=1)
+)
+HINT_WORKERS = int(os.environ.get("HINT_WORKERS", default=2))
+
+"""
+Поля без угадывания: для конфигураций NO_GUESS_CONFIGS (ширина x высота x
+мины через запятую) пул из NO_GUESS_WORKERS процессов держит до
+NO_GUESS_POOL_SIZE проверенных полей, пул запускается при первой игре
+без угадывания. Если подходящего поля в пуле нет, поле ищется прямо в
+запросе не дольше NO_GUESS_BUDGET секунд
+"""
+NO_GUESS_CONFIGS = [
+    tuple(int(value) for value in config.split('x'))
+    for config in os.environ.get(
+        "NO_GUESS_CONFIGS", default="9x9x10,16x16x40,16x30x99"
+    ).split(',') if config
+]
+NO_GUESS_POOL_SIZE = int(os.environ.get("NO_GUESS_POOL_SIZE", default=50))
+NO_GUESS_WORKERS = int(os.environ.get("NO_GUESS_WORKERS", default=1))
+NO_GUESS_BUDGET = float(os.environ.get("NO_GUESS_BUDGET", default=0.05))
+
+"""
+Профилирование запросов: доля запросов PROFILE_RATE (0 - выключено) и
+запросы с заголовком X-Profile, равным PROFILE_TOKEN, пишутся через
+cProfile в PROFILE_DIR вместе с разбивкой времени по этапам. Хранится не
+больше PROFILE_MAX_FILES профилей и PROFILE_MAX_BYTES байт, старые
+удаляются. Без обеих настроек middleware не подключается
+"""
+PROFILE_RATE = float(os.environ.get("PROFILE_RATE", default=0))
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN", default="")
+PROFILE_DIR = os.environ.get("PROFILE_DIR", default="profiles")
+PROFILE_MAX_FILES = int(os.environ.get("PROFILE_MAX_FILES", default=200))
+PROFILE_MAX_BYTES = int(
+    os.environ.get("PROFILE_MAX_BYTES", default=100 * 1024 * 1024)
+)
+
+"""
+Статистика по конфигурациям (ширина, высота, мины): при завершении игры
+счетчики сыгранных игр, побед, поражений и корзин длительности
+STATS_DURATION_BUCKETS (секунды через запятую) растут одной атомарной
+записью, победа попадает в таблицу STATS_LEADERBOARD_SIZE самых быстрых.
+GET /api/stats читает только эти записи и кешируется на STATS_CACHE_TTL
+секунд
+"""
+GAME_STATS = os.environ.get("GAME_STATS", default="true").lower() in (
+    "1", "true", "yes"
+)
+STATS_DURATION_BUCKETS = tuple(
+    float(bound) for bound in os.environ.get(
+        "STATS_DURATION_BUCKETS", default="10,30,60,120,300,600,1800"
+    ).split(',') if bound
+)
+STATS_LEADERBOARD_SIZE = int(
+    os.environ.get("STATS_LEADERBOARD_SIZE", default=10)
+)
+STATS_CACHE_TTL = float(os.environ.get("STATS_CACHE_TTL", default=5))
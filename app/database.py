@@ -1,16 +1,25 @@
 """
 Настройки подключения к БД
 """
+import asyncio
 import os
+import uuid
+from typing import List, Tuple
 
-from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from bson import Binary
+from motor.motor_asyncio import (
+    AsyncIOMotorClient, AsyncIOMotorCollection, AsyncIOMotorDatabase
+)
+from pymongo.errors import OperationFailure
+
+from app.config import GAME_TTL
 
 
 USER_ROOT = os.environ.get("MONGO_INITDB_ROOT_USERNAME", default="root")
 USER_PASSWORD = os.environ.get("MONGO_INITDB_ROOT_PASSWORD", default="example")
 
 """
-Если проект запущен в docker, то возьмем настройки из env 
+Если проект запущен в docker, то возьмем настройки из env
 там название контейнера, в остальном локальная база
 """
 if os.getenv('PYTEST_ENV') == 'docker':
@@ -24,9 +33,164 @@ DEBUG = os.environ.get("DEBUG", default=False)
 MONGODB_URL = (f"mongodb://{USER_ROOT}:{USER_PASSWORD}@"
                f"{MONGO_HOST}:{MONGO_PORT}?retryWrites=true&w=majority")
 
+# Настройки пула соединений, один пул на процесс
+MONGO_MAX_POOL_SIZE = int(os.environ.get("MONGO_MAX_POOL_SIZE", default=100))
+MONGO_MIN_POOL_SIZE = int(os.environ.get("MONGO_MIN_POOL_SIZE", default=0))
+MONGO_MAX_IDLE_TIME_MS = int(
+    os.environ.get("MONGO_MAX_IDLE_TIME_MS", default=60000)
+)
+MONGO_CONNECT_TIMEOUT_MS = int(
+    os.environ.get("MONGO_CONNECT_TIMEOUT_MS", default=5000)
+)
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(
+    os.environ.get("MONGO_SERVER_SELECTION_TIMEOUT_MS", default=5000)
+)
+MONGO_SOCKET_TIMEOUT_MS = int(
+    os.environ.get("MONGO_SOCKET_TIMEOUT_MS", default=10000)
+)
+
+"""
+Хранить game_id как _id (UUID в бинарном виде), тогда поиск идет по
+встроенному первичному индексу и документ не тянет лишнюю строку
+"""
+GAME_ID_AS_PRIMARY_KEY = os.environ.get(
+    "GAME_ID_AS_PRIMARY_KEY", default="false"
+).lower() in ("1", "true", "yes")
+
+
+TTL_INDEX = 'last_move_at_ttl'
+MOVES_TTL_INDEX = 'at_ttl'
+INDEX_OPTIONS_CONFLICT = 85
+
+
+class DataBase:
+    """
+    Общий на процесс клиент Motor. Создается в lifespan приложения и
+    закрывается при остановке, запросы только берут из него базу.
+    """
+    client: AsyncIOMotorClient | None = None
+    loop: asyncio.AbstractEventLoop | None = None
+    # Клиенты других event loop: закрываются, когда закрыт их loop, и
+    # при остановке
+    previous: List[
+        Tuple[asyncio.AbstractEventLoop, AsyncIOMotorClient]
+    ] = []
+
+
+mongo = DataBase()
+
+
+def create_client(**kwargs) -> AsyncIOMotorClient:
+    return AsyncIOMotorClient(
+        MONGODB_URL,
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+        connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+        serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+        **kwargs
+    )
+
+
+async def connect_db():
+    if mongo.client is not None:
+        return
+    mongo.client = create_client()
+    mongo.loop = asyncio.get_running_loop()
+
+
+def close_previous_clients(everything: bool = False):
+    still_open = []
+    for loop, client in mongo.previous:
+        if everything or loop.is_closed():
+            client.close()
+        else:
+            still_open.append((loop, client))
+    mongo.previous = still_open
+
+
+async def close_db():
+    close_previous_clients(everything=True)
+    if mongo.client is None:
+        return
+    mongo.client.close()
+    mongo.client = None
+    mongo.loop = None
+
 
 async def get_db() -> AsyncIOMotorDatabase:
-    client = AsyncIOMotorClient(MONGODB_URL)
+    """
+    Отдает базу из общего клиента. Если lifespan не запускался (тесты,
+    скрипты) клиент создается при первом обращении. Клиент Motor привязан
+    к event loop, поэтому при смене loop он пересоздается. Старый клиент
+    еще может работать в своем loop, он закрывается вместе с пулом
+    соединений и потоками мониторинга, как только его loop закрыт.
+    """
+    if mongo.loop is not asyncio.get_running_loop():
+        if mongo.client is not None:
+            mongo.previous = [*mongo.previous, (mongo.loop, mongo.client)]
+            mongo.client = None
+        close_previous_clients()
+    await connect_db()
     if DEBUG:
-        return client.test_databse
-    return client["minesweeper"]
+        return mongo.client.test_databse
+    return mongo.client["minesweeper"]
+
+
+def game_key(game_id: str) -> dict:
+    """
+    Фильтр для поиска игры по идентификатору.
+    """
+    if GAME_ID_AS_PRIMARY_KEY:
+        return {'_id': Binary.from_uuid(uuid.UUID(game_id))}
+    return {'game_id': game_id}
+
+
+async def create_indexes(db: AsyncIOMotorDatabase):
+    """
+    Создает индексы, нужные сервису. create_index идемпотентен, поэтому
+    вызывается при каждом старте приложения.
+    """
+    games = db.mongodb["games"]
+    if not GAME_ID_AS_PRIMARY_KEY:
+        await games.create_index('game_id', unique=True, name='game_id')
+        await db.mongodb["archive"].create_index(
+            'game_id', unique=True, name='game_id'
+        )
+    await db.mongodb["moves"].create_index(
+        [('game_id', 1), ('version', 1)], name='game_id_version'
+    )
+    await create_ttl_index(db)
+
+
+async def create_ttl_index(db: AsyncIOMotorDatabase):
+    """
+    TTL индексы удаляют игры через GAME_TTL секунд после последнего хода
+    и записи журнала ходов через GAME_TTL секунд после записи. Если срок
+    изменился, индекс меняется через collMod, при GAME_TTL=0 удаляется.
+    """
+    await _ttl_index(db, db.mongodb["games"], 'last_move_at', TTL_INDEX)
+    await _ttl_index(db, db.mongodb["moves"], 'at', MOVES_TTL_INDEX)
+
+
+async def _ttl_index(
+        db: AsyncIOMotorDatabase, collection: AsyncIOMotorCollection,
+        field: str, name: str
+):
+    if not GAME_TTL:
+        if name in await collection.index_information():
+            await collection.drop_index(name)
+        return
+    try:
+        await collection.create_index(
+            field, expireAfterSeconds=GAME_TTL, name=name
+        )
+    except OperationFailure as exc:
+        # Индекс с другим expireAfterSeconds уже есть
+        if exc.code != INDEX_OPTIONS_CONFLICT:
+            raise
+        await db.command(
+            'collMod', collection.name,
+            index={'name': name, 'expireAfterSeconds': GAME_TTL}
+        )
@@ -0,0 +1,224 @@
+"""
+Метрики сервиса в текстовом формате Prometheus без внешних зависимостей.
+
+Метрики живут в памяти процесса и отдаются по GET /metrics. Запись
+значения - поиск корзины бинарным поиском и пара сложений, сервис
+однопоточный (asyncio), поэтому блокировок нет.
+"""
+import re
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Tuple
+
+from app.utils import MinesErrorText as Met
+
+# Корзины по умолчанию для длительностей, в секундах
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5
+)
+CELLS_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 10000, 100000)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Время по этапам текущего запроса, если запрос профилируется
+phases: ContextVar[Dict[str, float] | None] = ContextVar(
+    'phases', default=None
+)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...],
+            extra: str = '') -> str:
+    pairs = [
+        f'{name}="{_escape(value)}"' for name, value in zip(names, values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+
+    def __init__(self, name: str, documentation: str,
+                 labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.values: Dict[Tuple[str, ...], float] = {}
+        registry.append(self)
+
+    def inc(self, *labels: str, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> Iterator[str]:
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} counter'
+        for labels, value in self.values.items():
+            yield f'{self.name}{_labels(self.labelnames, labels)} {value}'
+
+
+class Histogram:
+
+    def __init__(self, name: str, documentation: str,
+                 labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # Для набора меток: счетчики по корзинам (последняя +Inf) и сумма
+        self.values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+        registry.append(self)
+
+    def observe(self, value: float, *labels: str):
+        series = self.values.get(labels)
+        if series is None:
+            series = self.values[labels] = (
+                [0] * (len(self.buckets) + 1), [0.0]
+            )
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1][0] += value
+
+    @contextmanager
+    def time(self, *labels: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.observe(elapsed, *labels)
+            current = phases.get()
+            if current is not None:
+                name = self.name.removeprefix('minesweeper_')
+                if labels:
+                    name = f"{name}:{','.join(labels)}"
+                current[name] = current.get(name, 0.0) + elapsed
+
+    def render(self) -> Iterator[str]:
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} histogram'
+        for labels, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += count
+                label = _labels(self.labelnames, labels, f'le="{bound}"')
+                yield f'{self.name}_bucket{label} {cumulative}'
+            label = _labels(self.labelnames, labels)
+            yield f'{self.name}_sum{label} {total[0]}'
+            yield f'{self.name}_count{label} {cumulative}'
+
+
+registry: List[Counter | Histogram] = []
+
+
+def render() -> str:
+    return '\n'.join(
+        line for metric in registry for line in metric.render()
+    ) + '\n'
+
+
+REQUESTS = Counter(
+    'minesweeper_http_requests_total', 'Запросы по маршруту и статусу',
+    ('method', 'route', 'status')
+)
+REQUEST_SECONDS = Histogram(
+    'minesweeper_http_request_duration_seconds', 'Время ответа на запрос',
+    ('method', 'route')
+)
+ERRORS = Counter(
+    'minesweeper_errors_total', 'Ошибки игры по типу',
+    ('route', 'error', 'status')
+)
+STORAGE_SECONDS = Histogram(
+    'minesweeper_storage_operation_seconds',
+    'Время операции с хранилищем игр', ('operation',)
+)
+GENERATION_SECONDS = Histogram(
+    'minesweeper_board_generation_seconds',
+    'Время создания поля с минами'
+)
+OPEN_CELLS_SECONDS = Histogram(
+    'minesweeper_open_cells_seconds', 'Время открытия ячеек за ход'
+)
+SERIALIZATION_SECONDS = Histogram(
+    'minesweeper_serialization_seconds',
+    'Время сборки игры из документа, документа из игры и ответа в JSON',
+    ('operation',)
+)
+MOVE_LOG_FAILURES = Counter(
+    'minesweeper_move_log_failures_total',
+    'Записи журнала ходов, которые не удалось записать'
+)
+CELLS_OPENED = Histogram(
+    'minesweeper_cells_opened', 'Сколько ячеек открыто за ход',
+    buckets=CELLS_BUCKETS
+)
+
+
+def _error_patterns() -> List[Tuple[str, re.Pattern]]:
+    patterns = []
+    for attr, text in vars(Met).items():
+        if attr.startswith('error_') and isinstance(text, str):
+            pattern = re.sub(r'\\\{\w*\\\}', '.*', re.escape(text))
+            patterns.append((attr.removeprefix('error_'), re.compile(pattern)))
+    return patterns
+
+
+ERROR_PATTERNS = _error_patterns()
+
+
+def error_type(detail: str) -> str:
+    """
+    Тип ошибки по ее тексту: имя текста в MinesErrorText без error_.
+    В тексте бывает game_id, поэтому как метку его не используем.
+    """
+    for name, pattern in ERROR_PATTERNS:
+        if pattern.fullmatch(detail):
+            return name
+    return 'other'
+
+
+def route_path(scope: dict) -> str:
+    """
+    Шаблон пути вместо самого пути, чтобы game_id не размножал метки.
+    """
+    route = scope.get('route')
+    return route.path if route is not None else 'unmatched'
+
+
+class MetricsMiddleware:
+    """
+    Считает запросы и время ответа по маршрутам. Чистый ASGI, без
+    BaseHTTPMiddleware, чтобы не добавлять задач и копий тела ответа.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = route_path(scope)
+            REQUEST_SECONDS.observe(
+                time.perf_counter() - start, scope['method'], route
+            )
+            REQUESTS.inc(scope['method'], route, str(status))
@@ -0,0 +1,289 @@
+"""
+Поля без угадывания: от первой ячейки до победы их проходит решатель
+подсказок, ни разу не выбирая наугад.
+
+Проверка поля - десятки вызовов решателя, поэтому готовые поля заранее
+ищет пул процессов. Поле из пула проверено от своей стартовой ячейки с
+нулем, и подходит для первого хода в любую нулевую ячейку ее области:
+такой ход открывает ту же область. Для поиска подходящего поля область
+еще отражается (и транспонируется на квадратных полях), каждое отражение
+поля - тоже поле без угадывания.
+
+Поле игры задается зерном, стартовой ячейкой и отражением, по ним его
+можно построить заново, как обычное поле по зерну и первому ходу.
+"""
+import asyncio
+import logging
+import random
+import secrets
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Deque, Dict, List, Tuple
+
+import numpy as np
+
+from app.board import Board, CLOSED, MINE, ZeroRegions, generate_data_field
+from app.config import (
+    NO_GUESS_BUDGET, NO_GUESS_CONFIGS, NO_GUESS_POOL_SIZE, NO_GUESS_WORKERS
+)
+from app.metrics import Counter
+from app.solver import solve
+
+logger = logging.getLogger(__name__)
+
+NO_GUESS_BOARDS = Counter(
+    'minesweeper_no_guess_boards_total',
+    'Поля без угадывания по источнику: pool, generated или random',
+    ('source',)
+)
+
+# Сколько секунд один процесс пула ищет поле, прежде чем вернуть ответ
+SEARCH_SECONDS = 1.0
+# Пауза пула, когда все конфигурации заполнены
+REFILL_INTERVAL = 1.0
+
+# Зерно, стартовая ячейка и отражение поля игры
+Layout = Tuple[int, int, int, int]
+Config = Tuple[int, int, int]
+
+
+def symmetries(width: int, height: int) -> range:
+    """
+    Биты отражения: 1 - по x, 2 - по y, 4 - транспонирование, только
+    для квадратных полей.
+    """
+    return range(8 if width == height else 4)
+
+
+def transform(board: Board, symmetry: int) -> Board:
+    cells = np.frombuffer(board.cells, dtype=np.uint8).reshape(
+        board.width, board.height
+    )
+    if symmetry & 4:
+        cells = cells.T
+    if symmetry & 1:
+        cells = cells[::-1]
+    if symmetry & 2:
+        cells = cells[:, ::-1]
+    return Board(board.width, board.height, cells.tobytes())
+
+
+def _source_index(x: int, y: int, symmetry: int,
+                  width: int, height: int) -> int:
+    """
+    Индекс ячейки исходного поля, которая после отражения стала (x, y).
+    """
+    if symmetry & 1:
+        x = width - 1 - x
+    if symmetry & 2:
+        y = height - 1 - y
+    if symmetry & 4:
+        x, y = y, x
+    return x * height + y
+
+
+def build(width: int, height: int, mines_count: int,
+          layout: Layout) -> Board:
+    """
+    Поле с минами игры без угадывания.
+    """
+    seed, x, y, symmetry = layout
+    return transform(
+        generate_data_field(width, height, mines_count, x, y, seed), symmetry
+    )
+
+
+def is_no_guess(data_field: Board, x: int, y: int, deadline: float) -> bool:
+    """
+    Проходит поле от ячейки (x, y), открывая только ячейки, безопасные
+    по решателю. Не успел до deadline - поле считается непроверенным.
+    """
+    width, height = data_field.width, data_field.height
+    mines_count = data_field.cells.count(ord(MINE))
+    regions = ZeroRegions.build(data_field)
+    field = Board(width, height)
+    left = width * height - mines_count
+    closed = ord(CLOSED)
+
+    to_open = [data_field.index(x, y)]
+    while True:
+        for i in to_open:
+            region = regions.region(i)
+            for j in ([i] if region is None else region.tolist()):
+                if field.cells[j] == closed:
+                    field.cells[j] = data_field.cells[j]
+                    left -= 1
+        if not left:
+            return True
+        budget = deadline - time.perf_counter()
+        if budget <= 0:
+            return False
+        to_open = solve(
+            bytes(field.cells), width, height, mines_count, budget
+        ).safe
+        if not to_open:
+            return False
+
+
+def start_zeros(data_field: Board, x: int, y: int) -> List[int]:
+    """
+    Нулевые ячейки области старта, первый ход в любую из них открывает
+    то же, что и ход в старт.
+    """
+    region = ZeroRegions.build(data_field).region(data_field.index(x, y))
+    return [i for i in region.tolist() if data_field.cells[i] == ord('0')]
+
+
+def find_board(width: int, height: int, mines_count: int,
+               seconds: float) -> Tuple[int, int, int, List[int]] | None:
+    """
+    Ищет поле без угадывания со случайным стартом в нулевой ячейке.
+    Запускается в процессе пула.
+    :return: зерно, старт и нулевые ячейки области старта
+    """
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        seed = secrets.randbits(63)
+        x, y = random.randrange(width), random.randrange(height)
+        data_field = generate_data_field(
+            width, height, mines_count, x, y, seed
+        )
+        if data_field[x, y] != '0':
+            continue
+        if is_no_guess(data_field, x, y, deadline):
+            return seed, x, y, start_zeros(data_field, x, y)
+    return None
+
+
+def generate(width: int, height: int, mines_count: int,
+             x: int, y: int, budget: float) -> Layout | None:
+    """
+    Поле без угадывания для первого хода (x, y) прямо в запросе, не
+    дольше budget секунд.
+    """
+    deadline = time.perf_counter() + budget
+    while time.perf_counter() < deadline:
+        seed = secrets.randbits(63)
+        data_field = generate_data_field(
+            width, height, mines_count, x, y, seed
+        )
+        if data_field[x, y] != '0':
+            continue
+        if is_no_guess(data_field, x, y, deadline):
+            return seed, x, y, 0
+    return None
+
+
+class BoardPool:
+    """
+    Проверенные поля по конфигурациям, не больше size на конфигурацию.
+    Каждое поле отдается одной игре.
+    """
+
+    def __init__(self, configs: List[Config], size: int, workers: int):
+        self.size = size
+        self.workers = workers
+        self.boards: Dict[Config, Deque[Tuple[int, int, int, frozenset]]] = {
+            config: deque() for config in configs
+        }
+        self._executor: ProcessPoolExecutor | None = None
+        self._task: asyncio.Task | None = None
+
+    def put(self, config: Config, seed: int, x: int, y: int,
+            zeros: List[int]):
+        boards = self.boards.setdefault(config, deque())
+        if len(boards) < self.size:
+            boards.append((seed, x, y, frozenset(zeros)))
+
+    def take(self, width: int, height: int, mines_count: int,
+             x: int, y: int) -> Layout | None:
+        """
+        Поле, где первый ход (x, y) попадает в нулевую область старта
+        после одного из отражений.
+        """
+        boards = self.boards.get((width, height, mines_count))
+        if not boards:
+            return None
+        for n, (seed, start_x, start_y, zeros) in enumerate(boards):
+            for symmetry in symmetries(width, height):
+                if _source_index(x, y, symmetry, width, height) in zeros:
+                    del boards[n]
+                    return seed, start_x, start_y, symmetry
+        return None
+
+    def stats(self) -> dict:
+        return {
+            f'{w}x{h}x{m}': len(boards)
+            for (w, h, m), boards in self.boards.items()
+        }
+
+    async def _fill(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            wanted = [
+                config for config, boards in self.boards.items()
+                if len(boards) < self.size
+            ]
+            if not wanted:
+                await asyncio.sleep(REFILL_INTERVAL)
+                continue
+            jobs = [
+                loop.run_in_executor(
+                    self._executor, find_board, *config, SEARCH_SECONDS
+                )
+                for config in wanted
+            ]
+            for config, job in zip(wanted, jobs):
+                try:
+                    found = await job
+                except Exception:
+                    logger.exception(
+                        'Не удалось найти поле без угадывания %s', config
+                    )
+                    await asyncio.sleep(REFILL_INTERVAL)
+                    continue
+                if found is not None:
+                    self.put(config, *found)
+
+    def start(self):
+        """
+        Запускает поиск полей при первой игре без угадывания: пока таких
+        игр нет, пул не занимает процессор. Вне event loop (повтор игр из
+        журнала) пул не запускается.
+        """
+        if self._task is not None or not self.boards or not self.workers:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._executor = ProcessPoolExecutor(self.workers)
+        self._task = loop.create_task(self._fill())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+
+board_pool = BoardPool(NO_GUESS_CONFIGS, NO_GUESS_POOL_SIZE, NO_GUESS_WORKERS)
+
+
+def pick_layout(width: int, height: int, mines_count: int,
+                x: int, y: int) -> Layout | None:
+    """
+    Поле без угадывания для первого хода: из пула, иначе поиск в запросе
+    с бюджетом NO_GUESS_BUDGET. None - не нашлось, игра будет обычной.
+    """
+    board_pool.start()
+    layout = board_pool.take(width, height, mines_count, x, y)
+    if layout is not None:
+        NO_GUESS_BOARDS.inc('pool')
+        return layout
+    layout = generate(width, height, mines_count, x, y, NO_GUESS_BUDGET)
+    NO_GUESS_BOARDS.inc('generated' if layout is not None else 'random')
+    return layout
@@ -0,0 +1,140 @@
+"""
+Профилирование отдельных запросов.
+
+Выбранный запрос (доля PROFILE_RATE или заголовок X-Profile с
+PROFILE_TOKEN) выполняется под cProfile, профиль пишется в PROFILE_DIR
+файлом .prof, рядом .json с маршрутом, статусом, временем ответа и
+разбивкой по этапам из гистограмм app.metrics: хранилище, сборка игры из
+документа, генерация поля, открытие ячеек, ответ в JSON.
+
+cProfile видит весь поток, поэтому профилируется не больше одного
+запроса за раз, а в профиль попадают и корутины соседних запросов.
+Разбивка по этапам считается по контексту запроса и от соседей не
+зависит.
+
+Сводка по записанным профилям: python -m benchmarks.profile_report
+"""
+import asyncio
+import cProfile
+import json
+import logging
+import os
+import random
+import re
+import secrets
+import time
+
+from app.config import (
+    PROFILE_DIR, PROFILE_MAX_BYTES, PROFILE_MAX_FILES, PROFILE_RATE,
+    PROFILE_TOKEN
+)
+from app.metrics import phases, route_path
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = b'x-profile'
+
+
+def enabled() -> bool:
+    return bool(PROFILE_RATE or PROFILE_TOKEN)
+
+
+def _requested(scope: dict) -> bool:
+    if PROFILE_TOKEN:
+        for name, value in scope['headers']:
+            if name == PROFILE_HEADER:
+                return secrets.compare_digest(value, PROFILE_TOKEN.encode())
+    return False
+
+
+def rotate(directory: str, max_files: int, max_bytes: int):
+    """
+    Удаляет самые старые профили, пока их не больше max_files и вместе
+    они занимают не больше max_bytes. Профиль и его .json удаляются парой.
+    """
+    profiles = []
+    for entry in os.scandir(directory):
+        if entry.name.endswith('.prof'):
+            size = entry.stat().st_size
+            summary = entry.path.removesuffix('.prof') + '.json'
+            if os.path.exists(summary):
+                size += os.path.getsize(summary)
+            profiles.append((entry.stat().st_mtime, entry.path, size))
+    profiles.sort()
+    total = sum(size for _, _, size in profiles)
+    while profiles and (len(profiles) > max_files or total > max_bytes):
+        _, path, size = profiles.pop(0)
+        total -= size
+        for name in (path, path.removesuffix('.prof') + '.json'):
+            try:
+                os.remove(name)
+            except FileNotFoundError:
+                pass
+
+
+def write_profile(profile: cProfile.Profile, summary: dict):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    route = re.sub(r'[^\w]+', '_', summary['route']).strip('_') or 'root'
+    name = os.path.join(
+        PROFILE_DIR,
+        f"{time.strftime('%Y%m%d-%H%M%S')}-{secrets.token_hex(3)}-"
+        f"{summary['method']}-{route}"
+    )
+    profile.dump_stats(name + '.prof')
+    with open(name + '.json', 'w', encoding='utf-8') as file:
+        json.dump(summary, file, ensure_ascii=False)
+    rotate(PROFILE_DIR, PROFILE_MAX_FILES, PROFILE_MAX_BYTES)
+
+
+class ProfilingMiddleware:
+    """
+    Подключается в main.py только если профилирование включено, иначе
+    запросы его не проходят совсем.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.active = False
+
+    async def __call__(self, scope, receive, send):
+        if (
+                scope['type'] != 'http' or self.active or
+                not (_requested(scope) or random.random() < PROFILE_RATE)
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        self.active = True
+        request_phases = {}
+        token = phases.set(request_phases)
+        profile = cProfile.Profile()
+        start = time.perf_counter()
+        profile.enable()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profile.disable()
+            elapsed = time.perf_counter() - start
+            phases.reset(token)
+            self.active = False
+            summary = {
+                'method': scope['method'],
+                'route': route_path(scope),
+                'path': scope['path'],
+                'status': status,
+                'seconds': elapsed,
+                'phases': request_phases,
+                'at': time.time(),
+            }
+            try:
+                await asyncio.to_thread(write_profile, profile, summary)
+            except OSError:
+                logger.exception('Не удалось записать профиль запроса')
@@ -1,10 +1,39 @@
-from typing import Annotated
+import asyncio
+import logging
+import time
+from typing import Annotated, Literal
+
+from fastapi import (
+    APIRouter, Depends, Header, Response, WebSocket, WebSocketDisconnect,
+    status
+)
+from pydantic import ValidationError
+
+from app.config import WS_PERSIST_INTERVAL, WS_PERSIST_MOVES
+from app.schemas import (
+    NewGameParams, NewGamesParams, NewGamesResult, GameService, GameIdParams,
+    HintResult, Move, StatsResult, TurnParams, TurnsParams, TurnsResult,
+    RESPONSE_EXCLUDE, game_cache
+)
+from app.storage import GameStorage, get_storage
+from app.utils import (
+    GameVersionConflict, MinesWeeperHTTPException, MinesErrorText as Met
+)
+
+logger = logging.getLogger(__name__)
+
+
+# Тип ответа на ход только с изменившимися ячейками
+DIFF_MEDIA_TYPE = 'application/vnd.minesweeper.diff+json'
 
-from fastapi import APIRouter, Depends
-from motor.motor_asyncio import AsyncIOMotorDatabase
 
-from app.database import get_db
-from app.schemas import NewGameParams, GameService, TurnParams
+def game_response(game: GameService) -> Response:
+    """
+    Игра в ответе уже в JSON, response_model остается только для схемы.
+    """
+    return Response(
+        content=game.response_json(), media_type='application/json'
+    )
 
 
 router_minesweeper = APIRouter(
@@ -16,24 +45,196 @@ router_minesweeper = APIRouter(
 @router_minesweeper.post(
     "/new",
     response_model=GameService,
-    response_model_exclude={'data_field', 'count_open_cells'}
+    response_model_exclude=RESPONSE_EXCLUDE
 )
 async def new_game(
         params: NewGameParams,
+        storage: Annotated[GameStorage, Depends(get_storage)]
 ):
 
-    return await GameService(**params.model_dump()).create_new_game()
+    game = await GameService(**params.model_dump()).create_new_game(storage)
+    return game_response(game)
+
+
+@router_minesweeper.post("/new/batch", response_model=NewGamesResult)
+async def new_games(
+        params: NewGamesParams,
+        storage: Annotated[GameStorage, Depends(get_storage)]
+):
+    """
+    Пачка игр одной записью в хранилище: count игр с общими параметрами
+    {"width": ..., "height": ..., "mines_count": ..., "count": ...} или
+    список {"games": [{"width": ..., ...}, ...]}. Возвращает game_id
+    созданных игр.
+    """
+    games = GameService.new_games(params.all_games())
+    return NewGamesResult(
+        game_ids=await GameService.create_new_games(games, storage)
+    )
 
 
 @router_minesweeper.post(
     "/turn",
     response_model=GameService,
-    response_model_exclude={'data_field', 'count_open_cells'}
+    response_model_exclude=RESPONSE_EXCLUDE
 )
 async def make_move(
         params: TurnParams,
-        db: Annotated[AsyncIOMotorDatabase, Depends(get_db)]
+        storage: Annotated[GameStorage, Depends(get_storage)],
+        mode: Literal['full', 'diff'] = 'full',
+        accept: Annotated[str | None, Header()] = None,
 ):
-    game: GameService = await GameService.game_from_db(params.game_id, db)
+    """
+    По умолчанию отдает все поле. С mode=diff или Accept
+    application/vnd.minesweeper.diff+json отдает только открытые ходом
+    ячейки [row, col, value], completed и version, по которому клиент
+    видит пропущенные ходы.
+    """
+    game: GameService = await GameService.apply_with_retry(
+        params.game_id, storage,
+        lambda game: game.user_opens_cells(
+            params.row, params.col, storage, params.action
+        )
+    )
+
+    if mode == 'diff' or (accept and DIFF_MEDIA_TYPE in accept):
+        return Response(
+            content=game.diff().model_dump_json(exclude_none=True),
+            media_type=DIFF_MEDIA_TYPE
+        )
+    return game_response(game)
+
+
+@router_minesweeper.post(
+    "/turns",
+    response_model=TurnsResult,
+    response_model_exclude={'game': RESPONSE_EXCLUDE}
+)
+async def make_moves(
+        params: TurnsParams,
+        storage: Annotated[GameStorage, Depends(get_storage)]
+):
+    async def apply(game: GameService) -> TurnsResult:
+        moves = await game.user_opens_many(params.moves, storage)
+        return TurnsResult(game=game, moves=moves)
+
+    return await GameService.apply_with_retry(params.game_id, storage, apply)
+
+
+@router_minesweeper.post("/hint", response_model=HintResult)
+async def hint(
+        params: GameIdParams,
+        storage: Annotated[GameStorage, Depends(get_storage)]
+):
+    """
+    Подсказка по текущему полю игрока, игра при этом не меняется.
+    Координаты [row, col] как в /turn.
+    """
+    game: GameService = await GameService.load(params.game_id, storage)
+    return await game.hint()
+
+
+@router_minesweeper.websocket("/ws/{game_id}")
+async def game_session(
+        websocket: WebSocket,
+        game_id: str,
+        storage: Annotated[GameStorage, Depends(get_storage)]
+):
+    """
+    Игра по WebSocket: клиент шлет {"row": ..., "col": ...}, в ответ
+    приходят только открытые ходом ячейки [row, col, value] и completed,
+    при завершении еще и все поле. Игра держится в памяти соединения и
+    пишется в бд раз в несколько ходов, при завершении и при отключении.
+    """
+    await websocket.accept()
+    try:
+        GameIdParams(game_id=game_id)
+        game: GameService = await GameService.load(game_id, storage)
+    except MinesWeeperHTTPException as exc:
+        await websocket.send_json({'error': exc.detail})
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    await websocket.send_json(
+        game.model_dump(mode='json', exclude=RESPONSE_EXCLUDE)
+    )
+    unsaved_moves = 0
+    saved_at = time.monotonic()
+    try:
+        while not game.completed:
+            # Несохраненные ходы пишем и без новых ходов, когда выйдет
+            # WS_PERSIST_INTERVAL с прошлой записи
+            timeout = (
+                max(0.0, saved_at + WS_PERSIST_INTERVAL - time.monotonic())
+                if unsaved_moves else None
+            )
+            try:
+                move = Move.model_validate(await asyncio.wait_for(
+                    websocket.receive_json(), timeout
+                ))
+                game.begin_turn()
+                game.open_cell(move.row, move.col, move.action)
+            except asyncio.TimeoutError:
+                unsaved_moves = 0
+                await game.persist(storage)
+                saved_at = time.monotonic()
+                continue
+            except (ValidationError, ValueError):
+                await websocket.send_json({'error': Met.error_move_format})
+                continue
+            except MinesWeeperHTTPException as exc:
+                await websocket.send_json({'error': exc.detail})
+                continue
+            unsaved_moves += 1
+
+            message = {
+                'cells': game.revealed_cells(),
+                'completed': game.completed,
+                'version': game.version,
+            }
+            if game.completed:
+                message['field'] = game.field.to_lists()
+            if (
+                    game.completed or
+                    unsaved_moves >= WS_PERSIST_MOVES or
+                    time.monotonic() - saved_at >= WS_PERSIST_INTERVAL
+            ):
+                unsaved_moves = 0
+                await game.persist(storage)
+                saved_at = time.monotonic()
+            await websocket.send_json(message)
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+    except GameVersionConflict as exc:
+        # Игру изменили в обход соединения, клиенту нужно переподключиться
+        await websocket.send_json({'error': exc.detail})
+        await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+    finally:
+        if unsaved_moves:
+            try:
+                await game.persist(storage)
+            except GameVersionConflict:
+                logger.warning(
+                    'Ходы игры %s по WebSocket не записаны, игра изменена '
+                    'другим запросом', game_id
+                )
+
+
+@router_minesweeper.get("/stats", response_model=StatsResult)
+async def stats(storage: Annotated[GameStorage, Depends(get_storage)]):
+    """
+    Статистика завершенных игр по конфигурациям: сыгранные игры, победы,
+    поражения, длительность по корзинам и самые быстрые победы. Читаются
+    только записи конфигураций, ответ кешируется на STATS_CACHE_TTL
+    секунд.
+    """
+    return Response(
+        content=await GameService.stats_json(storage),
+        media_type='application/json'
+    )
+
 
-    return await game.user_opens_cells(params.row, params.col)
+@router_minesweeper.get("/cache/stats")
+async def cache_stats():
+    return game_cache.stats()
@@ -1,32 +1,115 @@
-import random
+import logging
+import secrets
 import uuid
-from typing import List
+from datetime import datetime
+from itertools import chain
+from typing import Awaitable, Callable, Dict, List, Literal, Tuple, TypeVar
 
-from motor.motor_asyncio import AsyncIOMotorDatabase
-from pydantic import BaseModel, model_validator, Field
-from pymongo import ReturnDocument
+import numpy as np
+from pydantic import (
+    BaseModel, model_validator, model_serializer, Field, PrivateAttr
+)
 
-from app.database import get_db
-from app.utils import MinesWeeperHTTPException, MinesErrorText as Met
+from app.board import (
+    Board, CLOSED, FLAG, MINE, ZeroRegions, generate_data_field
+)
+from app.cache import GameCache, LRUCache, TTLCache
+from app.chunks import ChunkedBoard, ChunkedMineField, flood_fill
+from app.config import (
+    BOARD_CACHE_SIZE, BOARD_STORAGE, DENSE_MAX_CELLS, MAX_HEIGHT, MAX_WIDTH,
+    GAME_CACHE_FLUSH_INTERVAL, GAME_CACHE_MODE, GAME_CACHE_SIZE,
+    GAME_CACHE_TTL, MAX_BATCH_GAMES, MAX_BATCH_MOVES, CONFLICT_RETRIES,
+    ARCHIVE_COMPLETED, GAME_STATS, MOVE_LOG, STATS_CACHE_TTL
+)
+from app.metrics import (
+    CELLS_OPENED, GENERATION_SECONDS, MOVE_LOG_FAILURES, OPEN_CELLS_SECONDS,
+    SERIALIZATION_SECONDS, STORAGE_SECONDS
+)
+from app.no_guess import build, pick_layout
+from app.solver import solve_field
+from app.storage import GameStorage, duration_buckets, utcnow
+from app.utils import (
+    GameVersionConflict, MinesWeeperHTTPException, MinesErrorText as Met
+)
 
-# По умолчанию максимальные поля 30х30, но можно увеличить их размер
-MAX_WIDTH = 30
-MAX_HEIGHT = 30
+logger = logging.getLogger(__name__)
+
+# Служебные поля игры, которые не отдаются в ответах API
+RESPONSE_EXCLUDE = {
+    'data_field', 'count_open_cells', 'seed', 'first_click', 'version',
+    'created_at', 'last_move_at', 'no_guess', 'no_guess_board', 'flags'
+}
+
+# Версия формата документа игры. Документы текущей версии записал сам
+# сервис, они загружаются без валидации. Поменялся формат - поднимаем
+# версию, старые документы пойдут через валидацию
+SCHEMA_VERSION = 3
+
+# Поля с минами и их области нулей, построенные по зерну, по game_id
+data_field_cache = LRUCache(BOARD_CACHE_SIZE)
+# Активные игры при GAME_CACHE_MODE=write-behind
+# Игру, которую успел изменить другой процесс, из кеша не пишем
+game_cache = GameCache(
+    GAME_CACHE_SIZE, GAME_CACHE_TTL, GAME_CACHE_FLUSH_INTERVAL,
+    discard_on=(GameVersionConflict,)
+)
+# Ответ /api/stats в JSON
+stats_cache = TTLCache(STATS_CACHE_TTL)
+
+T = TypeVar('T')
+
+# Ход: открыть ячейку, поставить или снять флаг, открыть соседей цифры
+Action = Literal['open', 'flag', 'unflag', 'chord']
 
 
 class NewGameParams(BaseModel):
     width: int
     height: int
     mines_count: int
+    no_guess: bool = False
+
+
+class NewGamesParams(BaseModel):
+    """
+    Пачка игр: count игр с общими параметрами или список games.
+    """
+    width: int | None = None
+    height: int | None = None
+    mines_count: int | None = None
+    no_guess: bool = False
+    count: int = 1
+    games: List[NewGameParams] | None = None
+
+    @model_validator(mode="after")
+    def check_games(self) -> 'NewGamesParams':
+        shared = (self.width, self.height, self.mines_count)
+        if (self.games is None) == (None in shared):
+            raise MinesWeeperHTTPException(error=Met.error_games_format)
+        total = self.count if self.games is None else len(self.games)
+        if not 0 < total <= MAX_BATCH_GAMES:
+            raise MinesWeeperHTTPException(
+                error=Met.error_games_count.format(max=MAX_BATCH_GAMES)
+            )
+        return self
+
+    def all_games(self) -> List[NewGameParams]:
+        if self.games is not None:
+            return self.games
+        return [NewGameParams(
+            width=self.width, height=self.height,
+            mines_count=self.mines_count, no_guess=self.no_guess
+        )] * self.count
+
 
+class NewGamesResult(BaseModel):
+    game_ids: List[str]
 
-class TurnParams(BaseModel):
+
+class GameIdParams(BaseModel):
     game_id:  str
-    row: int
-    col: int
 
     @model_validator(mode="after")
-    def check_formate_game_id(self) -> 'TurnParams':
+    def check_formate_game_id(self) -> 'GameIdParams':
         try:
             uuid.UUID(self.game_id, version=4)
         except ValueError as exc:
@@ -36,6 +119,38 @@ class TurnParams(BaseModel):
         return self
 
 
+class TurnParams(GameIdParams):
+    row: int
+    col: int
+    action: Action = 'open'
+
+
+class Move(BaseModel):
+    row: int
+    col: int
+    action: Action = 'open'
+
+
+class TurnsParams(GameIdParams):
+    moves: List[Move]
+
+    @model_validator(mode="after")
+    def check_moves_count(self) -> 'TurnsParams':
+        if not 0 < len(self.moves) <= MAX_BATCH_MOVES:
+            raise MinesWeeperHTTPException(
+                error=Met.error_moves_count.format(max=MAX_BATCH_MOVES)
+            )
+        return self
+
+
+class MoveResult(BaseModel):
+    row: int
+    col: int
+    opened: int = 0
+    completed: bool = False
+    error: str | None = None
+
+
 class GameService(BaseModel):
     game_id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     completed: bool = False
@@ -44,9 +159,44 @@ class GameService(BaseModel):
     height: int
     mines_count: int
     count_open_cells: int = 0
+    # Номер хода, растет на каждый примененный ход
+    version: int = 0
+
+    # Зерно генератора мин и первая открытая ячейка, по ним поле
+    # можно построить заново
+    seed: int = Field(default_factory=lambda: secrets.randbits(63))
+    first_click: Tuple[int, int] | None = None
+    # Поле без угадывания: зерно, стартовая ячейка и отражение поля, по
+    # ним поле строится вместо seed и first_click
+    no_guess: bool = False
+    no_guess_board: Tuple[int, int, int, int] | None = None
+    # По last_move_at удаляются брошенные игры
+    created_at: datetime = Field(default_factory=utcnow)
+    last_move_at: datetime = Field(default_factory=utcnow)
 
-    field: List[List[str]] | None = None
-    data_field: List[List[str]] | None = None
+    field: Board | ChunkedBoard | None = None
+    data_field: Board | ChunkedMineField | None = None
+    # Флаги игрока битами по индексу ячейки, пусто - флагов нет
+    flags: bytes = b''
+
+    # Ячейки, открытые за текущий ход
+    _opened_cells: List[Tuple[int, int]] = PrivateAttr(default_factory=list)
+    # Еще не записанные в бд изменения: индексы открытых ячеек и первый ход
+    _pending_opened: List[int] = PrivateAttr(default_factory=list)
+    _pending_first_click: bool = PrivateAttr(default=False)
+    # Ходы для журнала с прошлой записи, у флагов и chord с действием
+    _pending_moves: List[Tuple] = PrivateAttr(default_factory=list)
+    # Флаги изменились с прошлой записи
+    _flags_changed: bool = PrivateAttr(default=False)
+    # Ячейки, где за текущий ход поставлен или снят флаг
+    _flag_changes: List[Tuple[int, int]] = PrivateAttr(default_factory=list)
+    # Открытые ячейки прочитаны из старого списка opened, первая запись
+    # переносит их все в opened_bits и удаляет список
+    _legacy_opened: bool = PrivateAttr(default=False)
+    # Версия игры в бд, запись проходит только если она не изменилась
+    _saved_version: int = PrivateAttr(default=0)
+    # Области нулей data_field, только для полей, созданных целиком
+    _zero_regions: ZeroRegions | None = PrivateAttr(default=None)
 
     @model_validator(mode="after")
     def __check_width_height_mines(self) -> 'GameService':
@@ -63,6 +213,10 @@ class GameService(BaseModel):
             raise MinesWeeperHTTPException(
                 error=Met.error_mines_count.format(cells=m_c)
             )
+        if self.no_guess and self.chunked:
+            raise MinesWeeperHTTPException(
+                error=Met.error_no_guess_size.format(cells=DENSE_MAX_CELLS)
+            )
 
         return self
 
@@ -73,115 +227,531 @@ class GameService(BaseModel):
         :return:
         """
         if self.field is None:
-            self.field = [
-                [' ' for _ in range(self.height)] for _ in range(self.width)
-            ]
+            if self.chunked:
+                self.field = ChunkedBoard(self.width, self.height)
+            else:
+                self.field = Board(self.width, self.height)
 
         return self
 
-    async def create_new_game(self):
-        db = await get_db()
-        result = await db.mongodb["games"].insert_one(
-            self.model_dump()
+    @model_serializer(mode="wrap")
+    def __serialize(self, handler):
+        data = handler(self)
+        # Большое поле целиком не отдаем, только открытые за ход ячейки
+        if self.chunked and 'field' in data:
+            data['cells'] = self.revealed_cells()
+        # Флаги показываем на поле игрока, пока игра не завершена
+        elif (
+                self.flags and not self.completed and
+                isinstance(data.get('field'), list)
+        ):
+            for i in self.flagged_indices():
+                x, y = divmod(i, self.height)
+                data['field'][x][y] = FLAG
+        return data
+
+    def diff(self) -> 'TurnDiff':
+        """
+        Ответ на ход только с изменившимися ячейками, все поле только
+        при завершении игры.
+        """
+        return TurnDiff(
+            game_id=self.game_id,
+            completed=self.completed,
+            version=self.version,
+            cells=self.revealed_cells(),
+            field=self.field if self.completed and not self.chunked else None,
+        )
+
+    def revealed_cells(self) -> List[List]:
+        """
+        Открытые за ход ячейки и изменения флагов в виде [row, col, value].
+        """
+        cells = [[x, y, self.field[x, y]] for x, y in self._opened_cells]
+        cells.extend(
+            [x, y, FLAG if self.flagged(x, y) else CLOSED]
+            for x, y in self._flag_changes
+        )
+        return cells
+
+    def flagged(self, x: int, y: int) -> bool:
+        i = x * self.height + y
+        return i >> 3 < len(self.flags) and bool(
+            self.flags[i >> 3] >> (i & 7) & 1
+        )
+
+    def flagged_indices(self) -> np.ndarray:
+        bits = np.unpackbits(
+            np.frombuffer(self.flags, dtype=np.uint8), bitorder='little'
+        )
+        return np.flatnonzero(bits)
+
+    def __set_flag(self, x: int, y: int, value: bool):
+        i = x * self.height + y
+        flags = bytearray(
+            self.flags or bytes((self.width * self.height + 7) // 8)
         )
-        if not result:
+        if value:
+            flags[i >> 3] |= 1 << (i & 7)
+        else:
+            flags[i >> 3] &= ~(1 << (i & 7))
+        self.flags = bytes(flags)
+        self._flags_changed = True
+        self._flag_changes.append((x, y))
+
+    @property
+    def chunked(self) -> bool:
+        return self.width * self.height > DENSE_MAX_CELLS
+
+    @property
+    def won(self) -> bool:
+        return (
+            self.count_open_cells == self.width*self.height-self.mines_count
+        )
+
+    @property
+    def stores_data_field(self) -> bool:
+        """
+        Пишется ли data_field в бд целиком или строится заново по зерну.
+        """
+        return not self.chunked and BOARD_STORAGE == 'full'
+
+    def to_document(self) -> dict:
+        """
+        Документ игры для записи в хранилище.
+        Поле игрока не пишем, оно восстанавливается из data_field и
+        битов открытых ячеек opened_bits.
+        """
+        return {
+            **self.model_dump(exclude={'field', 'data_field'}),
+            'data_field': (
+                self.data_field.to_bson()
+                if self.stores_data_field and self.data_field else None
+            ),
+            'zero_regions': (
+                self._zero_regions.to_bson()
+                if self.stores_data_field and self._zero_regions else None
+            ),
+            'opened_bits': self.field.opened_bits(),
+            'schema_version': SCHEMA_VERSION,
+        }
+
+    @staticmethod
+    def from_document(game_data: dict) -> 'GameService':
+        """
+        Восстанавливает игру из документа бд.
+        """
+        # Список opened - открытые ячейки в документах до opened_bits
+        opened = game_data.pop('opened', ())
+        opened_bits = game_data.pop('opened_bits', None)
+        data_field = game_data.pop('data_field', None)
+        zero_regions = game_data.pop('zero_regions', None)
+        snapshot = game_data.pop('field', None)
+        # Версия снимка поля, его больше не пишем
+        game_data.pop('snapshot_version', None)
+        if game_data.pop('schema_version', None) == SCHEMA_VERSION:
+            game = GameService.__trusted(game_data)
+        else:
+            game = GameService(**game_data)
+        game._saved_version = game.version
+        game._legacy_opened = bool(opened)
+        # Открытые до снимка ячейки берем из него, после - из opened.
+        # В документах первой версии field - все поле игрока, а
+        # first_click нет, поле с минами там записано всегда
+        if snapshot is not None:
+            game.field = Board.from_document(
+                game.width, game.height, snapshot
+            )
+        if game.first_click is None and data_field is None:
+            return game
+
+        if data_field is not None:
+            game.data_field = Board.from_document(
+                game.width, game.height, data_field
+            )
+            game._zero_regions = (
+                ZeroRegions.from_bson(zero_regions) if zero_regions
+                else ZeroRegions.build(game.data_field)
+            )
+        elif (cached := data_field_cache.get(game.game_id)) is not None:
+            game.data_field, game._zero_regions = cached
+        else:
+            game.__build_data_field()
+            data_field_cache.put(
+                game.game_id, (game.data_field, game._zero_regions)
+            )
+
+        if game.chunked:
+            for i in opened:
+                x, y = divmod(i, game.height)
+                game.field[x, y] = game.data_field[x, y]
+        elif opened:
+            opened = np.array(opened, dtype=np.intp)
+            field = np.frombuffer(game.field.cells, dtype=np.uint8)
+            field[opened] = np.frombuffer(
+                game.data_field.cells, dtype=np.uint8
+            )[opened]
+        if opened_bits:
+            game.field.apply_opened_bits(game.data_field, opened_bits)
+        return game
+
+    @staticmethod
+    def __trusted(game_data: dict) -> 'GameService':
+        """
+        Игра из документа текущей версии без валидации, как
+        model_construct, но без его разбора значений по умолчанию.
+        Закрытое поле игрока создается здесь, валидаторы не запускаются.
+        """
+        values = {name: game_data[name] for name in TRUSTED_FIELDS}
+        # BSON хранит кортежи списками
+        for name in ('first_click', 'no_guess_board'):
+            if values[name] is not None:
+                values[name] = tuple(values[name])
+        values['data_field'] = None
+        values['field'] = (
+            ChunkedBoard(values['width'], values['height'])
+            if values['width'] * values['height'] > DENSE_MAX_CELLS
+            else Board(values['width'], values['height'])
+        )
+        game = GameService.__new__(GameService)
+        object.__setattr__(game, '__dict__', values)
+        object.__setattr__(game, '__pydantic_fields_set__', set(values))
+        object.__setattr__(game, '__pydantic_extra__', None)
+        object.__setattr__(game, '__pydantic_private__', {
+            name: factory() for name, factory in PRIVATE_DEFAULTS
+        })
+        return game
+
+    def response_json(self) -> bytes:
+        """
+        Ответ API сразу в JSON скомпилированным сериализатором модели,
+        без проверки по response_model и jsonable_encoder в FastAPI.
+        """
+        with SERIALIZATION_SECONDS.time('response_json'):
+            return self.__pydantic_serializer__.to_json(
+                self, exclude=RESPONSE_EXCLUDE
+            )
+
+    async def create_new_game(self, storage: GameStorage):
+        with STORAGE_SECONDS.time('create'):
+            created = await storage.create(self.to_document())
+        if not created:
             raise MinesWeeperHTTPException(error="Игра не создана")
+        if MOVE_LOG:
+            await write_move_log(storage, [self.log_header()])
         return self
 
+    def log_header(self) -> dict:
+        """
+        Первая запись журнала ходов: параметры, по которым строится поле.
+        """
+        return {
+            'game_id': self.game_id,
+            'version': self.version,
+            'width': self.width,
+            'height': self.height,
+            'mines_count': self.mines_count,
+            'seed': self.seed,
+            'at': self.created_at,
+        }
+
+    @staticmethod
+    def new_games(params: List[NewGameParams]) -> List['GameService']:
+        """
+        Игры для пакетного создания. Параметры каждой конфигурации
+        проверяются один раз, остальные игры с ними собираются без
+        валидации, со своими game_id и seed.
+        """
+        templates = {}
+        games = []
+        for game_params in params:
+            key = (
+                game_params.width, game_params.height,
+                game_params.mines_count, game_params.no_guess
+            )
+            template = templates.get(key)
+            if template is None:
+                template = templates[key] = GameService(
+                    **game_params.model_dump()
+                ).model_dump(exclude={'field', 'data_field'})
+            now = utcnow()
+            games.append(GameService.__trusted({
+                **template,
+                'game_id': str(uuid.uuid4()),
+                'seed': secrets.randbits(63),
+                'created_at': now,
+                'last_move_at': now,
+            }))
+        return games
+
+    @staticmethod
+    async def create_new_games(
+            games: List['GameService'], storage: GameStorage
+    ) -> List[str]:
+        """
+        Пишет пачку новых игр одной операцией хранилища.
+        :return: game_id записанных игр
+        """
+        with STORAGE_SECONDS.time('create_many'):
+            created = await storage.create_many(
+                [game.to_document() for game in games]
+            )
+        if not created:
+            raise MinesWeeperHTTPException(error="Игра не создана")
+        if MOVE_LOG:
+            created_ids = set(created)
+            await write_move_log(storage, [
+                game.log_header() for game in games
+                if game.game_id in created_ids
+            ])
+        return created
+
     def _create_data_field(self, first_x: int, first_y: int):
         """
         Создаем поле data_field заполненное минами и не ставим мину на первую
-        ячейку, которую выбрал игрок.
+        ячейку, которую выбрал игрок. Мины зависят только от seed и первой
+        ячейки, поэтому поле можно не хранить, а построить заново.
         :param first_x: Координаты первой открываемой ячейки по оси x
         :param first_y: Координаты первой открываемой ячейки по оси y
         :return:
         """
+        self.first_click = (first_x, first_y)
+        if self.no_guess and self.no_guess_board is None:
+            self.no_guess_board = pick_layout(
+                self.width, self.height, self.mines_count, first_x, first_y
+            )
+            # Поле без угадывания не нашлось, игра будет обычной
+            self.no_guess = self.no_guess_board is not None
+        self.__build_data_field()
+        if not self.stores_data_field:
+            data_field_cache.put(
+                self.game_id, (self.data_field, self._zero_regions)
+            )
 
-        self.data_field = [
-            ['0' for _ in range(self.height)] for _ in range(self.width)
-        ]
-        free_cells = [
-            (x, y) for y in range(self.height) for x in range(self.width)
-            if (x, y) != (first_x, first_y)
-        ]
-
-        # Ставим мины в случайном порядке
-        for i in range(self.mines_count):
-            x, y = free_cells.pop(random.randint(0, len(free_cells) - 1))
-            self.data_field[x][y] = ' '
-
-        # Ставим цифры о минах
-        for y in range(self.height):
-            for x in range(self.width):
-                if self.data_field[x][y] == ' ':
-                    continue
-                counter = 0
-                for dx in [-1, 0, 1]:
-                    for dy in [-1, 0, 1]:
-                        nx, ny = x + dx, y + dy
-                        if (0 <= nx < self.width) and (0 <= ny < self.height) and \
-                                self.data_field[nx][ny] == ' ':
-                            counter += 1
-                self.data_field[x][y] = str(counter)
+    def __build_data_field(self):
+        """
+        Поле с минами и его области нулей по seed и first_click. Большое
+        поле генерируется кусками по мере открытия, без областей.
+        """
+        with GENERATION_SECONDS.time():
+            if self.chunked:
+                self.data_field = ChunkedMineField(
+                    self.width, self.height, self.mines_count,
+                    self.seed, *self.first_click
+                )
+                return
+            if self.no_guess_board is not None:
+                self.data_field = build(
+                    self.width, self.height, self.mines_count,
+                    self.no_guess_board
+                )
+            else:
+                self.data_field = generate_data_field(
+                    self.width, self.height, self.mines_count,
+                    *self.first_click, self.seed
+                )
+            self._zero_regions = ZeroRegions.build(self.data_field)
 
     def __open_cells(self, x, y):
+        if self.chunked:
+            xs, ys = flood_fill(self.field, self.data_field, x, y)
+            self.count_open_cells += len(xs)
+            self._opened_cells.extend(zip(xs.tolist(), ys.tolist()))
+            return
+
+        # Ноль открывает свою заранее посчитанную область целиком, если
+        # обход в ширину открыл бы ее так же
+        if self._zero_regions is not None:
+            region = self._zero_regions.region(self.field.index(x, y))
+            if region is not None and self.__region_untouched(region):
+                self.__open_region(region)
+                return
+
         cells_to_check = {(x, y)}
 
         while cells_to_check:
             x, y = cells_to_check.pop()
-            # Проверка, что ячейка находится внутри поля и еще не была открыта
+            # Проверка, что ячейка находится внутри поля, еще не была
+            # открыта и на ней нет флага
             if (
                     self.width <= x or x < 0 or
                     self.height <= y or y < 0 or
-                    self.field[x][y] != ' '
+                    self.field[x, y] != CLOSED or
+                    self.flags and self.flagged(x, y)
             ):
                 continue
 
             # Открываем ячейку
-            self.field[x][y] = str(self.data_field[x][y])
+            self.field[x, y] = self.data_field[x, y]
             self.count_open_cells += 1
+            self._opened_cells.append((x, y))
 
             # Если ячейка равна 0, откроем все соседние ячейки
-            if self.data_field[x][y] == '0':
+            if self.data_field[x, y] == '0':
                 for dx in [-1, 0, 1]:
                     for dy in [-1, 0, 1]:
                         cells_to_check.add((x + dx, y + dy))
 
-    async def user_opens_cells(self, row: int, col: int) -> 'GameService':
-        self.checking_coordinates(row, col)
+    def __region_untouched(self, region: np.ndarray) -> bool:
+        """
+        В области нет флагов и открытых нулей. Флаг останавливает обход в
+        ширину, а нуль, открытый рядом с флагом, после снятия флага
+        отделяет закрытую часть области. В обоих случаях область целиком
+        открыла бы больше, чем обход.
+        """
+        field = np.frombuffer(self.field.cells, dtype=np.uint8)
+        if (field[region] == ord('0')).any():
+            return False
+        if self.flags:
+            flagged = np.zeros(len(field), dtype=bool)
+            flagged[self.flagged_indices()] = True
+            return not flagged[region].any()
+        return True
+
+    def __open_region(self, region: np.ndarray):
+        field = np.frombuffer(self.field.cells, dtype=np.uint8)
+        data_field = np.frombuffer(self.data_field.cells, dtype=np.uint8)
+        region = region[field[region] == ord(CLOSED)]
+        field[region] = data_field[region]
+        self.count_open_cells += len(region)
+        xs, ys = np.divmod(region, self.height)
+        self._opened_cells.extend(zip(xs.tolist(), ys.tolist()))
+
+    def begin_turn(self):
+        """
+        Начало запроса с ходами, revealed_cells копит ячейки с этого места.
+        """
+        self._opened_cells.clear()
+        self._flag_changes.clear()
+
+    def open_cell(self, row: int, col: int, action: Action = 'open') -> int:
+        """
+        Ход игрока без записи в бд.
+        :param action: open - открыть ячейку, flag и unflag - поставить и
+            снять флаг, chord - открыть всех соседей без флагов у открытой
+            цифры, вокруг которой столько же флагов
+        :return: Сколько ячеек открыто ходом
+        """
+        self.checking_coordinates(row, col, action)
+        opened_before = len(self._opened_cells)
+
+        if action in ('flag', 'unflag'):
+            self.__set_flag(row, col, action == 'flag')
+            self.version += 1
+            self.last_move_at = utcnow()
+            self._pending_moves.append((row, col, action))
+            return 0
+
+        if action == 'chord':
+            cells = self.__chord_cells(row, col)
+            if not cells:
+                return 0
+        else:
+            cells = [(row, col)]
 
         # Создать поле при первом открытии ячейки
-        first_open = False
         if self.data_field is None:
-            first_open = True
+            self._pending_first_click = True
             self._create_data_field(row, col)
 
+        self.version += 1
+        self.last_move_at = utcnow()
+        self._pending_moves.append(
+            (row, col) if action == 'open' else (row, col, action)
+        )
+
         # Нажал на мину
-        if self.data_field[row][col] == ' ':
-            self.field = [
-                [col if col != ' ' else 'X' for col in row]
-                for row in self.data_field
-            ]
+        mine = next(
+            ((x, y) for x, y in cells if self.data_field[x, y] == MINE), None
+        )
+        if mine is not None:
+            if self.chunked:
+                self.field[mine] = 'X'
+            else:
+                self.field = self.data_field.replace(MINE, 'X')
+            self._opened_cells.append(mine)
             self.completed = True
-            await self.__save_turn(db=await get_db(), first_open=first_open)
-            return self
+            return len(self._opened_cells) - opened_before
 
-        # Открываем ячейку
-        self.__open_cells(row, col)
+        # Открываем ячейки, chord открывает всех соседей за один ход
+        with OPEN_CELLS_SECONDS.time():
+            for x, y in cells:
+                self.__open_cells(x, y)
+        CELLS_OPENED.observe(len(self._opened_cells) - opened_before)
 
         # Все ячейки открыты, победа
-        if self.count_open_cells == self.height*self.width-self.mines_count:
-            self.field = [
-                [col if col != ' ' else 'M' for col in row]
-                for row in self.data_field
-            ]
+        if self.won:
+            if not self.chunked:
+                self.field = self.data_field.replace(MINE, 'M')
             self.completed = True
 
-        await self.__save_turn(db=await get_db(), first_open=first_open)
+        opened = self._opened_cells[opened_before:]
+        cells = np.fromiter(
+            chain.from_iterable(opened), dtype=np.int64, count=2 * len(opened)
+        ).reshape(-1, 2)
+        self._pending_opened.extend(
+            (cells[:, 0] * self.height + cells[:, 1]).tolist()
+        )
+        return len(opened)
+
+    def __chord_cells(self, row: int, col: int) -> List[Tuple[int, int]]:
+        """
+        Закрытые соседи без флагов у цифры, если флагов вокруг столько же,
+        сколько мин.
+        """
+        neighbours = [
+            (x, y)
+            for x in range(max(0, row - 1), min(self.width, row + 2))
+            for y in range(max(0, col - 1), min(self.height, col + 2))
+            if (x, y) != (row, col) and self.field[x, y] == CLOSED
+        ]
+        flags = sum(self.flagged(x, y) for x, y in neighbours)
+        if flags != ord(self.field[row, col]) - ord('0'):
+            raise MinesWeeperHTTPException(error=Met.error_chord)
+        return [(x, y) for x, y in neighbours if not self.flagged(x, y)]
+
+    async def user_opens_cells(
+            self, row: int, col: int, storage: GameStorage,
+            action: Action = 'open'
+    ) -> 'GameService':
+        self.begin_turn()
+        self.open_cell(row, col, action)
+        await self.persist(storage)
 
         return self
 
-    def checking_coordinates(self, row: int, col: int):
+    async def user_opens_many(
+            self, moves: List['Move'], storage: GameStorage
+    ) -> List['MoveResult']:
+        """
+        Применяет ходы по порядку до мины или победы и пишет в бд один раз.
+        Ошибочный ход не прерывает остальные, ошибка попадает в результат.
+        """
+        self.begin_turn()
+        results = []
+        for move in moves:
+            if self.completed:
+                break
+            try:
+                opened = self.open_cell(move.row, move.col, move.action)
+            except MinesWeeperHTTPException as exc:
+                results.append(
+                    MoveResult(row=move.row, col=move.col, error=exc.detail)
+                )
+                continue
+            results.append(
+                MoveResult(
+                    row=move.row, col=move.col, opened=opened,
+                    completed=self.completed
+                )
+            )
+
+        if any(result.error is None for result in results):
+            await self.persist(storage)
+        return results
+
+    def checking_coordinates(self, row: int, col: int,
+                             action: Action = 'open'):
         if self.width <= row or row < 0:
             raise MinesWeeperHTTPException(
                 error=Met.error_row.format(w=self.width)
@@ -190,48 +760,403 @@ class GameService(BaseModel):
             raise MinesWeeperHTTPException(
                 error=Met.error_col.format(h=self.height)
             )
-        if self.field[row][col] != ' ':
+        if action != 'open' and self.chunked:
+            raise MinesWeeperHTTPException(
+                error=Met.error_flags_size.format(cells=DENSE_MAX_CELLS)
+            )
+        if action == 'chord':
+            if not '1' <= self.field[row, col] <= '8':
+                raise MinesWeeperHTTPException(error=Met.error_chord)
+            return
+        if self.field[row, col] != CLOSED:
             raise MinesWeeperHTTPException(
                 error=Met.error_open_cell
             )
+        if action == 'open' and self.flags and self.flagged(row, col):
+            raise MinesWeeperHTTPException(error=Met.error_flagged)
+        if action == 'unflag' and not self.flagged(row, col):
+            raise MinesWeeperHTTPException(error=Met.error_not_flagged)
+        if action == 'flag' and self.flagged(row, col):
+            raise MinesWeeperHTTPException(error=Met.error_flagged)
 
-    async def __save_turn(self, db: AsyncIOMotorDatabase, first_open=False):
+    async def persist(self, storage: GameStorage):
+        """
+        Сохраняет ход. В режиме write-behind ход остается в кеше и пишется
+        в бд позже, завершенная игра пишется сразу.
+        """
+        if GAME_CACHE_MODE != 'write-behind':
+            await self.save(storage)
+        elif self.completed:
+            await game_cache.pop(self.game_id, flush=False)
+            await self.save(storage)
+        else:
+            game_cache.mark_dirty(self.game_id)
+
+    @staticmethod
+    async def load(
+            game_id: str, storage: GameStorage
+    ) -> 'GameService':
+        """
+        Игра для хода: из кеша активных игр или из бд.
+        """
+        if GAME_CACHE_MODE != 'write-behind':
+            return await GameService.game_from_db(game_id, storage)
+        return await game_cache.get_or_load(
+            game_id, lambda: GameService.game_from_db(game_id, storage),
+            storage
+        )
+
+    async def save(self, storage: GameStorage):
+        """
+        Пишет в бд накопленные с прошлой записи изменения. Если игру в бд
+        уже изменил другой процесс, выбрасывает GameVersionConflict.
+        """
         if not self.game_id:
             return
 
-        # Если игра завершилась, то чистим поля в бд
+        # Версия и ходы берутся до записи: пока запись ждет хранилище, в
+        # игру из кеша write-behind могут прийти новые ходы, они уйдут
+        # следующей записью
+        version = self.version
+        moves = self._pending_moves
+        self._pending_moves = []
+        first_click = self._pending_first_click
+        entry = self.__move_log_entry(moves, first_click)
+
+        # Если игра завершилась, то переносим ее в архив или чистим поля в бд
         if self.completed:
-            await db.mongodb["games"].find_one_and_replace(
-                {'game_id': self.game_id},
-                {'game_id': self.game_id,
-                 'completed': self.completed},
-            )
+            try:
+                if ARCHIVE_COMPLETED:
+                    with STORAGE_SECONDS.time('archive'):
+                        saved = await storage.archive(
+                            self.game_id, self._saved_version,
+                            self.archive_record()
+                        )
+                else:
+                    with STORAGE_SECONDS.time('complete'):
+                        saved = await storage.complete(
+                            self.game_id, self._saved_version,
+                            {'completed': self.completed, 'version': version,
+                             'last_move_at': self.last_move_at}
+                        )
+                if not saved:
+                    raise GameVersionConflict(error=Met.error_conflict)
+            except Exception:
+                self._pending_moves[:0] = moves
+                raise
+            data_field_cache.pop(self.game_id)
+            self._saved_version = version
+            if GAME_STATS:
+                await self.__record_result(storage)
+            self._pending_first_click = False
+            if entry is not None:
+                await write_move_log(storage, [entry])
             return
 
         new_values = {
-            'field': self.field,
             'completed': self.completed,
             'count_open_cells': self.count_open_cells,
+            'version': self.version,
+            'last_move_at': self.last_move_at,
         }
-        # Записываем игровое поле с минами на первый ход
-        if first_open:
-            new_values.update(data_field=self.data_field)
-
-        await db.mongodb["games"].find_one_and_update(
-            {'game_id': self.game_id},
-            {'$set': new_values},
-            return_document=ReturnDocument.AFTER
+        # Записываем игровое поле с минами на первый ход, иначе оно
+        # восстанавливается по зерну и первой ячейке
+        if self._flags_changed:
+            new_values.update(flags=self.flags)
+        if self._pending_first_click:
+            new_values.update(
+                first_click=self.first_click, no_guess=self.no_guess,
+                no_guess_board=self.no_guess_board
+            )
+            if self.stores_data_field:
+                new_values.update(
+                    data_field=self.data_field.to_bson(),
+                    zero_regions=self._zero_regions.to_bson()
+                )
+
+        # Перезаписываем только блоки битов, где открылись ячейки. Игру
+        # со старым списком opened записываем всеми блоками, хранилище
+        # при этом удаляет список
+        legacy = self._legacy_opened
+        opened_bits = self.field.opened_bits(
+            None if legacy else self._pending_opened
+        )
+        pending = self._pending_opened
+        self._pending_opened = []
+        self._pending_first_click = False
+        flags_changed = self._flags_changed
+        self._flags_changed = False
+        self._legacy_opened = False
+        try:
+            with STORAGE_SECONDS.time('save_delta'):
+                saved = await storage.save_delta(
+                    self.game_id, self._saved_version, new_values,
+                    opened_bits, replace_opened=legacy
+                )
+            if not saved:
+                raise GameVersionConflict(error=Met.error_conflict)
+        except Exception:
+            self._pending_opened[:0] = pending
+            self._pending_moves[:0] = moves
+            self._pending_first_click = first_click
+            self._flags_changed = flags_changed
+            self._legacy_opened = legacy
+            raise
+        self._saved_version = version
+        if entry is not None:
+            await write_move_log(storage, [entry])
+
+    def __move_log_entry(
+            self, moves: List[tuple], first_click: bool
+    ) -> dict | None:
+        """
+        Запись журнала с ходами, которые уходят в бд этим сохранением.
+        """
+        if not MOVE_LOG or not moves:
+            return None
+        entry = {
+            'game_id': self.game_id,
+            'version': self.version,
+            'moves': [list(move) for move in moves],
+            'count_open_cells': self.count_open_cells,
+            'completed': self.completed,
+            'at': self.last_move_at,
+        }
+        # Поле без угадывания не строится по seed, для повтора игры
+        # пишем его вместе с первым ходом
+        if first_click and self.no_guess_board is not None:
+            entry['no_guess_board'] = list(self.no_guess_board)
+        return entry
+
+    async def __record_result(self, storage: GameStorage):
+        """
+        Итог игры в статистику. Игра уже записана завершенной, поэтому
+        ошибка статистики не отменяет ход, а только пишется в лог.
+        """
+        try:
+            with STORAGE_SECONDS.time('record_result'):
+                await storage.record_result(self.archive_record())
+        except Exception:
+            logger.exception(
+                'Итог игры %s не записан в статистику', self.game_id
+            )
+
+    def archive_record(self) -> dict:
+        """
+        Итог завершенной игры для архива.
+        """
+        return {
+            'game_id': self.game_id,
+            'won': self.won,
+            'width': self.width,
+            'height': self.height,
+            'mines_count': self.mines_count,
+            'moves': self.version,
+            'duration': (self.last_move_at - self.created_at).total_seconds(),
+            'completed_at': self.last_move_at,
+        }
+
+    async def hint(self) -> 'HintResult':
+        """
+        Подсказка по видимому полю: какие ячейки точно безопасны, какие
+        точно мины и вероятность мины для остальных закрытых ячеек.
+        """
+        if self.chunked:
+            raise MinesWeeperHTTPException(
+                error=Met.error_hint_size.format(cells=DENSE_MAX_CELLS)
+            )
+        if self.first_click is None:
+            # Первый ход всегда безопасен, поле еще не создано
+            return HintResult(
+                game_id=self.game_id,
+                best=(self.width // 2, self.height // 2),
+                other_probability=0.0
+            )
+
+        solution = await solve_field(self.field, self.mines_count)
+        closed = [
+            i for i, cell in enumerate(self.field.cells) if cell == ord(CLOSED)
+        ]
+        best = solution.best(closed)
+        return HintResult(
+            game_id=self.game_id,
+            safe=[divmod(i, self.height) for i in solution.safe],
+            mines=[divmod(i, self.height) for i in solution.mines],
+            probabilities=[
+                (*divmod(i, self.height), p)
+                for i, p in sorted(solution.probabilities.items())
+            ],
+            other_probability=solution.other,
+            best=divmod(best, self.height) if best is not None else None,
+            exact=solution.exact
         )
 
+    @staticmethod
+    async def stats(storage: GameStorage) -> 'StatsResult':
+        """
+        Статистика по конфигурациям из счетчиков хранилища, самые
+        популярные конфигурации первыми.
+        """
+        with STORAGE_SECONDS.time('load_stats'):
+            documents = await storage.load_stats()
+        buckets = duration_buckets()
+        configs = [
+            ConfigStats(**{
+                **document,
+                'win_rate': document['wins'] / document['played'],
+                'mean_duration':
+                    document['duration_sum'] / document['played'],
+                'durations': {
+                    **dict.fromkeys(buckets, 0), **document['durations']
+                },
+            })
+            for document in documents if document['played']
+        ]
+        configs.sort(key=lambda config: (
+            -config.played, config.width, config.height, config.mines_count
+        ))
+        return StatsResult(configs=configs)
+
+    @staticmethod
+    async def stats_json(storage: GameStorage) -> bytes:
+        """
+        Ответ /api/stats, не чаще раза в STATS_CACHE_TTL секунд из
+        хранилища.
+        """
+        content = stats_cache.get('stats')
+        if content is None:
+            result = await GameService.stats(storage)
+            content = result.__pydantic_serializer__.to_json(result)
+            stats_cache.put('stats', content)
+        return content
+
+    @staticmethod
+    async def apply_with_retry(
+            game_id: str, storage: GameStorage,
+            apply: Callable[['GameService'], Awaitable[T]]
+    ) -> T:
+        """
+        Загружает игру и применяет к ней ход apply. Если игру между чтением
+        и записью изменил другой процесс, читает ее заново и повторяет ход,
+        не более CONFLICT_RETRIES раз.
+        """
+        for attempt in range(CONFLICT_RETRIES + 1):
+            game = await GameService.load(game_id, storage)
+            try:
+                return await apply(game)
+            except GameVersionConflict:
+                await game_cache.pop(game_id, flush=False)
+                if attempt == CONFLICT_RETRIES:
+                    raise
+
     @staticmethod
     async def game_from_db(
-            game_id: str, db: AsyncIOMotorDatabase
+            game_id: str, storage: GameStorage
     ) -> 'GameService':
-        game_data = await db.mongodb["games"].find_one({'game_id': game_id})
+        with STORAGE_SECONDS.time('load'):
+            game_data = await storage.load(game_id)
         if not game_data:
+            # Завершенной игры в games может не быть, она в архиве
+            with STORAGE_SECONDS.time('find_archived'):
+                archived = await storage.find_archived(game_id)
+            if archived:
+                raise MinesWeeperHTTPException(error=Met.error_completed)
             raise MinesWeeperHTTPException(
                 error=Met.error_game_id.format(game_id=game_id)
             )
         if game_data.get('completed'):
             raise MinesWeeperHTTPException(error=Met.error_completed)
-        return GameService(**game_data)
+        with SERIALIZATION_SECONDS.time('from_document'):
+            return GameService.from_document(game_data)
+
+
+# Значения игры из документа, field и data_field строятся отдельно
+TRUSTED_FIELDS = tuple(
+    name for name in GameService.model_fields
+    if name not in ('field', 'data_field')
+)
+# Фабрики приватных атрибутов новой игры
+PRIVATE_DEFAULTS = tuple(
+    (
+        name,
+        attr.default_factory if attr.default_factory is not None
+        else lambda default=attr.default: default
+    )
+    for name, attr in GameService.__private_attributes__.items()
+)
+
+
+async def write_move_log(storage: GameStorage, entries: List[dict]):
+    """
+    Дописывает записи в журнал ходов. Игры и ходы к этому моменту уже
+    записаны в бд, поэтому ошибка журнала не отменяет запрос: она пишется
+    в лог и в MOVE_LOG_FAILURES, а в журнале игры остается пропуск.
+    """
+    if not entries:
+        return
+    try:
+        if len(entries) == 1:
+            with STORAGE_SECONDS.time('log_moves'):
+                await storage.log_moves(entries[0])
+        else:
+            with STORAGE_SECONDS.time('log_moves_many'):
+                await storage.log_moves_many(entries)
+    except Exception:
+        MOVE_LOG_FAILURES.inc(amount=len(entries))
+        logger.exception(
+            'Журнал ходов не записан для игр %s',
+            ', '.join(sorted({entry['game_id'] for entry in entries}))
+        )
+
+
+class TurnsResult(BaseModel):
+    game: GameService
+    moves: List[MoveResult]
+
+
+class TurnDiff(BaseModel):
+    game_id: str
+    completed: bool
+    version: int
+    cells: List[Tuple[int, int, str]]
+    field: Board | None = None
+
+
+class HintResult(BaseModel):
+    game_id: str
+    safe: List[Tuple[int, int]] = []
+    mines: List[Tuple[int, int]] = []
+    # [row, col, вероятность мины] для закрытых ячеек у открытых цифр
+    probabilities: List[Tuple[int, int, float]] = []
+    # Вероятность мины для любой другой закрытой ячейки
+    other_probability: float
+    best: Tuple[int, int] | None = None
+    # False, если перебор не уложился в бюджет времени
+    exact: bool = True
+
+
+class LeaderboardEntry(BaseModel):
+    game_id: str
+    duration: float
+    moves: int
+    completed_at: datetime
+
+
+class ConfigStats(BaseModel):
+    width: int
+    height: int
+    mines_count: int
+    played: int
+    wins: int
+    losses: int
+    win_rate: float
+    # Длительность от создания игры до последнего хода, в секундах
+    mean_duration: float
+    # Число игр по верхней границе длительности в секундах
+    durations: Dict[str, int]
+    # Самые быстрые победы
+    leaderboard: List[LeaderboardEntry]
+
+
+class StatsResult(BaseModel):
+    configs: List[ConfigStats]
@@ -0,0 +1,388 @@
+"""
+Решатель для подсказок по видимому полю игрока.
+
+1. Каждая открытая цифра дает ограничение: среди ее закрытых соседей
+   ровно столько мин. Ограничения упрощаются по одной ячейке (0 мин или
+   все ячейки - мины) и по вложенным множествам (A внутри B дает B \\ A).
+2. Оставшаяся граница делится на независимые компоненты, каждая
+   перебирается полностью с подсчетом решений по числу мин.
+3. Компоненты и закрытые ячейки вне границы сводятся с учетом общего
+   числа мин, так получаются точные вероятности мины для каждой ячейки.
+
+Перебор ограничен по времени. Если время вышло, компонента считается
+неизвестной (ее ячейки идут в общий остаток), а решение - неточным.
+"""
+import asyncio
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from math import comb
+from typing import Dict, FrozenSet, List, Tuple
+
+from app.board import Board, CLOSED
+from app.config import (
+    HINT_INLINE_CELLS, HINT_POOL_TIME_BUDGET, HINT_TIME_BUDGET, HINT_WORKERS
+)
+from app.metrics import Histogram
+
+HINT_SECONDS = Histogram(
+    'minesweeper_hint_seconds', 'Время расчета подсказки', ('where',)
+)
+
+# Как часто перебор проверяет, не вышло ли время: узел перебора - около
+# микросекунды, так что бюджет превышается не больше чем на десятки
+# микросекунд
+DEADLINE_CHECK_NODES = 64
+# Компоненты больше этого не перебираются, за бюджет их не перебрать
+MAX_COMPONENT_CELLS = 200
+
+
+class Solution:
+    """
+    Итог решения, индексы ячеек как в Board.cells.
+
+    probabilities - вероятность мины для ячеек границы,
+    other - для любой закрытой ячейки вне границы.
+    """
+    __slots__ = ('safe', 'mines', 'probabilities', 'other', 'exact')
+
+    def __init__(self, safe: List[int], mines: List[int],
+                 probabilities: Dict[int, float], other: float, exact: bool):
+        self.safe = safe
+        self.mines = mines
+        self.probabilities = probabilities
+        self.other = other
+        self.exact = exact
+
+    def best(self, closed: List[int]) -> int | None:
+        """
+        Ячейка для следующего хода: безопасная, иначе наименее опасная.
+        """
+        if self.safe:
+            return self.safe[0]
+        candidates = [(p, i) for i, p in self.probabilities.items()]
+        mines = set(self.mines)
+        outside = next(
+            (i for i in closed if i not in self.probabilities
+             and i not in mines), None
+        )
+        if outside is not None:
+            candidates.append((self.other, outside))
+        return min(candidates)[1] if candidates else None
+
+
+class _Timeout(Exception):
+    pass
+
+
+class _Budget:
+    """
+    Срок перебора и общий на все компоненты счетчик узлов.
+    """
+    __slots__ = ('deadline', 'nodes')
+
+    def __init__(self, seconds: float):
+        self.deadline = time.perf_counter() + seconds
+        self.nodes = 0
+
+    def spent(self) -> bool:
+        return time.perf_counter() > self.deadline
+
+
+def _neighbours(i: int, width: int, height: int) -> List[int]:
+    x, y = divmod(i, height)
+    return [
+        nx * height + ny
+        for nx in range(max(0, x - 1), min(width, x + 2))
+        for ny in range(max(0, y - 1), min(height, y + 2))
+        if (nx, ny) != (x, y)
+    ]
+
+
+def _constraints(cells: bytes, width: int,
+                 height: int) -> Dict[FrozenSet[int], int]:
+    closed = ord(CLOSED)
+    constraints = {}
+    for i, cell in enumerate(cells):
+        if cell == closed or not 0x30 <= cell <= 0x38:
+            continue
+        unknown = frozenset(
+            n for n in _neighbours(i, width, height) if cells[n] == closed
+        )
+        if unknown:
+            constraints[unknown] = cell - 0x30
+    return constraints
+
+
+def _propagate(constraints: Dict[FrozenSet[int], int],
+               safe: set, mines: set) -> Dict[FrozenSet[int], int]:
+    """
+    Правила одной ячейки и вложенных множеств до неподвижной точки.
+    """
+    while True:
+        changed = False
+        reduced = {}
+        for cells, value in constraints.items():
+            value -= len(cells & mines)
+            cells = cells - mines - safe
+            if not cells:
+                continue
+            if value == 0:
+                safe |= cells
+                changed = True
+            elif value == len(cells):
+                mines |= cells
+                changed = True
+            else:
+                reduced[cells] = value
+        constraints = reduced
+        if changed:
+            continue
+
+        by_cell = defaultdict(list)
+        for cells in constraints:
+            for i in cells:
+                by_cell[i].append(cells)
+        derived = {}
+        for small, value in constraints.items():
+            for big in by_cell[next(iter(small))]:
+                if len(big) > len(small) and small < big:
+                    rest = big - small
+                    if rest not in constraints and rest not in derived:
+                        derived[rest] = constraints[big] - value
+        if not derived:
+            return constraints
+        constraints.update(derived)
+
+
+def _components(
+        constraints: Dict[FrozenSet[int], int]
+) -> List[Tuple[List[int], List[Tuple[FrozenSet[int], int]]]]:
+    parent = {}
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for cells in constraints:
+        for i in cells:
+            parent.setdefault(i, i)
+        first = find(next(iter(cells)))
+        for i in cells:
+            root = find(i)
+            if root != first:
+                parent[root] = first
+
+    groups = defaultdict(lambda: ([], []))
+    for i in parent:
+        groups[find(i)][0].append(i)
+    for cells, value in constraints.items():
+        groups[find(next(iter(cells)))][1].append((cells, value))
+    return list(groups.values())
+
+
+def _enumerate(variables: List[int],
+               constraints: List[Tuple[FrozenSet[int], int]],
+               max_mines: int, budget: _Budget):
+    """
+    Все расстановки мин в компоненте.
+    :return: порядок ячеек, число решений и число решений с миной в
+        каждой ячейке по количеству мин в компоненте
+    """
+    if len(variables) > MAX_COMPONENT_CELLS:
+        raise _Timeout
+    # Порядок обхода: соседние по ограничениям ячейки подряд
+    order, seen = [], set()
+    by_cell = defaultdict(list)
+    for k, (cells, _) in enumerate(constraints):
+        for i in cells:
+            by_cell[i].append(k)
+    for start in variables:
+        if start in seen:
+            continue
+        stack = [start]
+        seen.add(start)
+        while stack:
+            i = stack.pop()
+            order.append(i)
+            for k in by_cell[i]:
+                for j in constraints[k][0]:
+                    if j not in seen:
+                        seen.add(j)
+                        stack.append(j)
+
+    touches = [by_cell[i] for i in order]
+    need = [value for _, value in constraints]
+    left = [len(cells) for cells, _ in constraints]
+    assigned = [0] * len(order)
+    solutions: Dict[int, int] = defaultdict(int)
+    cell_counts: Dict[int, List[int]] = {}
+
+    def visit(n: int, mines: int):
+        budget.nodes += 1
+        if budget.nodes % DEADLINE_CHECK_NODES == 0 and budget.spent():
+            raise _Timeout
+        if n == len(order):
+            solutions[mines] += 1
+            counts = cell_counts.setdefault(mines, [0] * len(order))
+            for m, value in enumerate(assigned):
+                counts[m] += value
+            return
+        for value in (0, 1):
+            if mines + value > max_mines:
+                break
+            ok = True
+            for k in touches[n]:
+                need[k] -= value
+                left[k] -= 1
+                if need[k] < 0 or need[k] > left[k]:
+                    ok = False
+            if ok:
+                assigned[n] = value
+                visit(n + 1, mines + value)
+            for k in touches[n]:
+                need[k] += value
+                left[k] += 1
+        assigned[n] = 0
+
+    visit(0, 0)
+    return order, dict(solutions), cell_counts
+
+
+def _multiply(a: Dict[int, int], b: Dict[int, int]) -> Dict[int, int]:
+    product = defaultdict(int)
+    for i, x in a.items():
+        for j, y in b.items():
+            product[i + j] += x * y
+    return product
+
+
+def solve(cells: bytes, width: int, height: int, mines_count: int,
+          budget: float) -> Solution:
+    """
+    :param cells: Board.cells видимого поля
+    :param budget: сколько секунд можно потратить на перебор
+    """
+    limit = _Budget(budget)
+    safe, mines = set(), set()
+    constraints = _propagate(_constraints(cells, width, height), safe, mines)
+
+    exact = True
+    solved = []
+    for variables, component in _components(constraints):
+        # Когда время вышло, остальные компоненты уже не перебираются
+        if limit.spent():
+            exact = False
+            break
+        try:
+            solved.append(_enumerate(
+                variables, component, mines_count - len(mines), limit
+            ))
+        except _Timeout:
+            exact = False
+            break
+
+    closed = ord(CLOSED)
+    in_components = {i for order, *_ in solved for i in order}
+    rest = sum(
+        1 for i, cell in enumerate(cells)
+        if cell == closed and i not in safe and i not in mines
+        and i not in in_components
+    )
+    left = mines_count - len(mines)
+
+    def ways(mines_in_components: int) -> int:
+        outside = left - mines_in_components
+        return comb(rest, outside) if 0 <= outside <= rest else 0
+
+    # Число решений по количеству мин без компоненты c, слева и справа
+    polys = [solutions for _, solutions, _ in solved]
+    prefix = [{0: 1}]
+    for poly in polys:
+        prefix.append(_multiply(prefix[-1], poly))
+    suffix = [{0: 1}]
+    for poly in reversed(polys):
+        suffix.append(_multiply(suffix[-1], poly))
+    suffix.reverse()
+
+    everything = prefix[-1]
+    total = sum(count * ways(t) for t, count in everything.items())
+    probabilities = {}
+    if total:
+        for c, (order, solutions, cell_counts) in enumerate(solved):
+            others = _multiply(prefix[c], suffix[c + 1])
+            weight = {
+                k: sum(count * ways(k + t) for t, count in others.items())
+                for k in solutions
+            }
+            for n, i in enumerate(order):
+                mined = sum(
+                    cell_counts[k][n] * weight[k] for k in solutions
+                )
+                # Без части компонент общее число мин учтено неточно,
+                # тогда верим только решениям самой компоненты
+                if exact:
+                    certain_safe, certain_mine = mined == 0, mined == total
+                else:
+                    certain_safe = all(
+                        not cell_counts[k][n] for k in solutions
+                    )
+                    certain_mine = all(
+                        cell_counts[k][n] == count
+                        for k, count in solutions.items()
+                    )
+                if certain_safe:
+                    safe.add(i)
+                elif certain_mine:
+                    mines.add(i)
+                else:
+                    probabilities[i] = mined / total
+
+    other = 0.0
+    if total and rest:
+        other = sum(
+            count * ways(t) * (left - t) for t, count in everything.items()
+        ) / (total * rest)
+
+    return Solution(
+        sorted(safe), sorted(mines), probabilities, other, exact
+    )
+
+
+class _Pool:
+    executor: ProcessPoolExecutor | None = None
+
+
+pool = _Pool()
+
+
+def shutdown_pool():
+    if pool.executor is not None:
+        pool.executor.shutdown(cancel_futures=True)
+        pool.executor = None
+
+
+async def solve_field(field: Board, mines_count: int) -> Solution:
+    """
+    Небольшие поля решаются сразу с бюджетом HINT_TIME_BUDGET. Большие
+    поля и позиции, где бюджета не хватило, уходят в пул процессов с
+    бюджетом HINT_POOL_TIME_BUDGET, чтобы не держать event loop.
+    """
+    args = (
+        bytes(field.cells), field.width, field.height, mines_count
+    )
+    solution = None
+    if field.width * field.height <= HINT_INLINE_CELLS or not HINT_WORKERS:
+        with HINT_SECONDS.time('inline'):
+            solution = solve(*args, HINT_TIME_BUDGET)
+        if solution.exact or not HINT_WORKERS:
+            return solution
+
+    if pool.executor is None:
+        pool.executor = ProcessPoolExecutor(HINT_WORKERS)
+    with HINT_SECONDS.time('pool'):
+        return await asyncio.get_running_loop().run_in_executor(
+            pool.executor, solve, *args, HINT_POOL_TIME_BUDGET
+        )
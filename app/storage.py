@@ -0,0 +1,985 @@
+"""
+Хранилища игр. GameService работает только с интерфейсом GameStorage,
+конкретное хранилище выбирается через STORAGE_BACKEND:
+mongo - Mongo через Motor,
+sqlite - файл SQLITE_PATH, для небольших установок на одном сервере,
+memory - память процесса, для тестов и бенчмарков без docker.
+
+Документ игры - словарь из GameService.to_document. Открытые ячейки
+лежат в opened_bits битами по блокам, ключ - номер блока. Запись хода
+передает только изменившиеся поля и блоки, где открылись ячейки, и
+применяется только если версия игры в хранилище не изменилась. Старые
+документы хранят открытые ячейки списком opened, он только читается и
+удаляется первой записью хода после загрузки.
+
+Завершенная игра либо заменяется короткой записью в games, либо
+переносится в архив (ARCHIVE_COMPLETED), где лежит только итог.
+
+Отдельно от игр хранится журнал ходов (MOVE_LOG): запись с параметрами
+игры при создании и по записи на каждое сохранение с ходами с прошлого
+сохранения. Журнал только дописывается и переживает завершение игры,
+записи удаляются через GAME_TTL секунд после записи, как брошенные игры.
+
+Статистика (GAME_STATS) - по записи на конфигурацию (ширина, высота,
+мины) со счетчиками, которые при завершении игры растут одной атомарной
+записью. Чтение статистики не зависит от числа сыгранных игр.
+"""
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Tuple
+
+import bson
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from app.config import (
+    GAME_EXPIRE_INTERVAL, GAME_TTL, STATS_DURATION_BUCKETS,
+    STATS_LEADERBOARD_SIZE
+)
+from app.database import close_db, create_indexes, game_key, get_db
+
+logger = logging.getLogger(__name__)
+
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", default="mongo")
+SQLITE_PATH = os.environ.get("SQLITE_PATH", default="minesweeper.sqlite3")
+
+
+def utcnow() -> datetime:
+    """
+    Текущее время UTC без часового пояса, в таком виде даты
+    возвращаются из BSON.
+    """
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def duration_buckets() -> List[str]:
+    """
+    Корзины длительности игры в статистике: верхние границы в секундах,
+    последняя +Inf.
+    """
+    return [f'{bound:g}' for bound in STATS_DURATION_BUCKETS] + ['+Inf']
+
+
+def duration_bucket(duration: float) -> str:
+    return duration_buckets()[bisect_left(STATS_DURATION_BUCKETS, duration)]
+
+
+def leaderboard_entry(result: dict) -> dict:
+    """
+    Победа в таблице самых быстрых игр конфигурации.
+    """
+    return {
+        'game_id': result['game_id'],
+        'duration': result['duration'],
+        'moves': result['moves'],
+        'completed_at': result['completed_at'],
+    }
+
+
+class GameStorage(ABC):
+    # Удаляет ли хранилище брошенные игры само, как TTL индекс Mongo
+    expires_itself = False
+
+    async def setup(self):
+        """
+        Готовит хранилище к работе: индексы, таблицы.
+        """
+
+    async def close(self):
+        pass
+
+    @abstractmethod
+    async def create(self, document: dict) -> bool:
+        """
+        Записывает новую игру.
+        """
+
+    async def create_many(self, documents: List[dict]) -> List[str]:
+        """
+        Записывает пачку новых игр.
+        :return: game_id записанных игр
+        """
+        return [
+            document['game_id'] for document in documents
+            if await self.create(document)
+        ]
+
+    @abstractmethod
+    async def load(self, game_id: str) -> dict | None:
+        """
+        Документ игры с game_id и битами открытых ячеек opened_bits.
+        """
+
+    @abstractmethod
+    async def save_delta(
+            self, game_id: str, version: int, values: dict,
+            opened: Dict[str, bytes], replace_opened: bool = False
+    ) -> bool:
+        """
+        Обновляет поля values и перезаписывает блоки битов opened, если в
+        хранилище игра версии version.
+        :param replace_opened: заменить все биты открытых ячеек на opened
+            и удалить старый список opened, когда opened - все блоки игры
+        :return: False, если игру успел изменить другой запрос
+        """
+
+    @abstractmethod
+    async def complete(self, game_id: str, version: int, values: dict) -> bool:
+        """
+        Заменяет игру версии version на короткую запись values
+        завершенной игры.
+        :return: False, если игру успел изменить другой запрос
+        """
+
+    @abstractmethod
+    async def archive(self, game_id: str, version: int, record: dict) -> bool:
+        """
+        Удаляет игру версии version из games и пишет record в архив.
+        :return: False, если игру успел изменить другой запрос
+        """
+
+    @abstractmethod
+    async def find_archived(self, game_id: str) -> dict | None:
+        pass
+
+    @abstractmethod
+    async def expire(self, before: datetime) -> int:
+        """
+        Удаляет игры без ходов с момента before и записи журнала ходов,
+        сделанные до before.
+        :return: Сколько игр удалено
+        """
+
+    @abstractmethod
+    async def log_moves(self, entry: dict):
+        """
+        Дописывает запись в журнал ходов, у записи есть game_id и version.
+        """
+
+    async def log_moves_many(self, entries: List[dict]):
+        for entry in entries:
+            await self.log_moves(entry)
+
+    @abstractmethod
+    async def load_move_log(self, game_id: str) -> List[dict]:
+        """
+        Журнал ходов игры по возрастанию version.
+        """
+
+    @abstractmethod
+    async def logged_games(self, limit: int) -> List[str]:
+        """
+        Последние limit игр в журнале ходов.
+        """
+
+    @abstractmethod
+    async def record_result(self, result: dict):
+        """
+        Добавляет итог завершенной игры (GameService.archive_record) в
+        статистику ее конфигурации одной атомарной записью.
+        """
+
+    @abstractmethod
+    async def load_stats(self) -> List[dict]:
+        """
+        Статистика конфигураций: width, height, mines_count, played, wins,
+        losses, duration_sum, durations - игры по корзинам длительности и
+        leaderboard - самые быстрые победы по возрастанию duration.
+        """
+
+
+class MongoStorage(GameStorage):
+    expires_itself = True
+
+    def __init__(self, db: AsyncIOMotorDatabase):
+        self.db = db
+
+    @property
+    def games(self):
+        return self.db.mongodb["games"]
+
+    @property
+    def archived(self):
+        return self.db.mongodb["archive"]
+
+    @property
+    def moves(self):
+        return self.db.mongodb["moves"]
+
+    @property
+    def stats(self):
+        return self.db.mongodb["stats"]
+
+    async def setup(self):
+        await create_indexes(self.db)
+
+    @staticmethod
+    def version_key(game_id: str, version: int) -> dict:
+        """
+        Фильтр игры той версии, что была прочитана из бд. У игр, созданных
+        до появления версий, поля version нет.
+        """
+        return {
+            **game_key(game_id),
+            'version': {'$in': [0, None]} if version == 0 else version
+        }
+
+    async def create(self, document: dict) -> bool:
+        document = dict(document)
+        game_id = document.pop('game_id')
+        result = await self.games.insert_one({**game_key(game_id), **document})
+        return result.acknowledged
+
+    async def create_many(self, documents: List[dict]) -> List[str]:
+        game_ids = [document['game_id'] for document in documents]
+        # Без упорядочивания Mongo пишет пачку параллельно и не
+        # останавливается на первой ошибке
+        try:
+            await self.games.insert_many(
+                [
+                    {
+                        **game_key(document['game_id']),
+                        **{k: v for k, v in document.items()
+                           if k != 'game_id'}
+                    }
+                    for document in documents
+                ],
+                ordered=False
+            )
+        except BulkWriteError as exc:
+            failed = {error['index'] for error in exc.details['writeErrors']}
+            logger.warning('Не записано игр из пачки: %s', len(failed))
+            return [
+                game_id for n, game_id in enumerate(game_ids)
+                if n not in failed
+            ]
+        return game_ids
+
+    async def load(self, game_id: str) -> dict | None:
+        document = await self.games.find_one(game_key(game_id))
+        if document is not None:
+            document['game_id'] = game_id
+        return document
+
+    async def save_delta(
+            self, game_id: str, version: int, values: dict,
+            opened: Dict[str, bytes], replace_opened: bool = False
+    ) -> bool:
+        if replace_opened:
+            update = {
+                '$set': {**values, 'opened_bits': opened},
+                '$unset': {'opened': ''},
+            }
+        else:
+            update = {'$set': {
+                **values,
+                **{f'opened_bits.{block}': bits
+                   for block, bits in opened.items()}
+            }}
+        result = await self.games.update_one(
+            self.version_key(game_id, version), update
+        )
+        return bool(result.matched_count)
+
+    async def complete(self, game_id: str, version: int, values: dict) -> bool:
+        result = await self.games.replace_one(
+            self.version_key(game_id, version),
+            {**game_key(game_id), **values},
+        )
+        return bool(result.matched_count)
+
+    async def archive(self, game_id: str, version: int, record: dict) -> bool:
+        # Сначала запись в архив, потом удаление с проверкой версии: если
+        # удаление не пройдет, игра не потеряется. Запись архива с версией
+        # игры новее этой не перезаписывается, повтор той же записи
+        # идемпотентен
+        key = game_key(game_id)
+        record = dict(record)
+        record.pop('game_id', None)
+        try:
+            await self.archived.update_one(
+                {**key, 'version': {'$lte': version}},
+                {'$set': {**record, 'version': version}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            return False
+        result = await self.games.delete_one(
+            self.version_key(game_id, version)
+        )
+        if result.deleted_count:
+            return True
+        # Игру успел изменить другой запрос - убираем свою запись, если
+        # игра еще в games. Если ее там нет, ее уже перенесли в архив
+        if await self.games.count_documents(key, limit=1):
+            await self.archived.delete_one({**key, 'version': version})
+        return False
+
+    async def find_archived(self, game_id: str) -> dict | None:
+        return await self.archived.find_one(game_key(game_id))
+
+    async def expire(self, before: datetime) -> int:
+        result = await self.games.delete_many(
+            {'last_move_at': {'$lt': before}}
+        )
+        return result.deleted_count
+
+    async def log_moves(self, entry: dict):
+        await self.moves.insert_one(dict(entry))
+
+    async def log_moves_many(self, entries: List[dict]):
+        if entries:
+            await self.moves.insert_many(
+                [dict(entry) for entry in entries], ordered=False
+            )
+
+    async def load_move_log(self, game_id: str) -> List[dict]:
+        cursor = self.moves.find(
+            {'game_id': game_id}, {'_id': False}
+        ).sort('version', 1)
+        return await cursor.to_list(None)
+
+    async def logged_games(self, limit: int) -> List[str]:
+        cursor = self.moves.find(
+            {'version': 0}, {'game_id': True}
+        ).sort('_id', -1).limit(limit)
+        return [entry['game_id'] async for entry in cursor]
+
+    async def record_result(self, result: dict):
+        config = (result['width'], result['height'], result['mines_count'])
+        won = bool(result['won'])
+        # Точка в ключе - вложенный путь, поэтому в корзинах вроде 0.5
+        # точка заменяется на _
+        bucket = duration_bucket(result['duration']).replace('.', '_')
+        update = {
+            '$inc': {
+                'played': 1,
+                'wins': int(won),
+                'losses': int(not won),
+                'duration_sum': result['duration'],
+                f'durations.{bucket}': 1,
+            },
+            '$setOnInsert': dict(
+                zip(('width', 'height', 'mines_count'), config)
+            ),
+        }
+        if not won:
+            update['$setOnInsert']['leaderboard'] = []
+        else:
+            # Таблица остается отсортированной и не длиннее
+            # STATS_LEADERBOARD_SIZE в той же записи
+            update['$push'] = {
+                'leaderboard': {
+                    '$each': [leaderboard_entry(result)],
+                    '$sort': {'duration': 1},
+                    '$slice': STATS_LEADERBOARD_SIZE,
+                }
+            }
+        await self.stats.update_one(
+            {'_id': '{}x{}x{}'.format(*config)}, update, upsert=True
+        )
+
+    async def load_stats(self) -> List[dict]:
+        documents = await self.stats.find({}, {'_id': False}).to_list(None)
+        # У записей, созданных до счетчиков wins и losses в каждом $inc,
+        # нет полей, которые еще ни разу не менялись
+        return [
+            {
+                'wins': 0, 'losses': 0, 'leaderboard': [], **document,
+                'durations': _mongo_durations(document.get('durations', {})),
+            }
+            for document in documents
+        ]
+
+
+def _mongo_durations(durations: dict, prefix: str = '') -> Dict[str, int]:
+    """
+    Корзины длительности из документа Mongo: _ обратно в точку. Прежние
+    ключи с точкой Mongo сохранил вложенными словарями, они склеиваются.
+    """
+    flat = {}
+    for key, games in durations.items():
+        bucket = prefix + key.replace('_', '.')
+        nested = (
+            _mongo_durations(games, bucket + '.')
+            if isinstance(games, dict) else {bucket: games}
+        )
+        for bucket, games in nested.items():
+            flat[bucket] = flat.get(bucket, 0) + games
+    return flat
+
+
+class MemoryStorage(GameStorage):
+    """
+    Игры в словаре. Между проверкой версии и записью нет await, поэтому
+    запись атомарна в пределах event loop.
+    """
+
+    def __init__(self):
+        self.games: dict[str, dict] = {}
+        self.archived: dict[str, dict] = {}
+        self.moves: dict[str, List[dict]] = {}
+        self.stats: dict[Tuple[int, int, int], dict] = {}
+
+    async def create(self, document: dict) -> bool:
+        self.games[document['game_id']] = {
+            **document, 'opened_bits': dict(document.get('opened_bits', {}))
+        }
+        return True
+
+    async def load(self, game_id: str) -> dict | None:
+        document = self.games.get(game_id)
+        if document is None:
+            return None
+        # Остальные значения GameService не изменяет
+        return {
+            **document, 'opened_bits': dict(document.get('opened_bits', {}))
+        }
+
+    def _matches(self, game_id: str, version: int) -> dict | None:
+        document = self.games.get(game_id)
+        if document is None or document.get('version', 0) != version:
+            return None
+        return document
+
+    async def save_delta(
+            self, game_id: str, version: int, values: dict,
+            opened: Dict[str, bytes], replace_opened: bool = False
+    ) -> bool:
+        document = self._matches(game_id, version)
+        if document is None:
+            return False
+        document.update(values)
+        if replace_opened:
+            document.pop('opened', None)
+            document['opened_bits'] = dict(opened)
+        else:
+            document.setdefault('opened_bits', {}).update(opened)
+        return True
+
+    async def complete(self, game_id: str, version: int, values: dict) -> bool:
+        if self._matches(game_id, version) is None:
+            return False
+        self.games[game_id] = {'game_id': game_id, **values}
+        return True
+
+    async def archive(self, game_id: str, version: int, record: dict) -> bool:
+        if self._matches(game_id, version) is None:
+            return False
+        del self.games[game_id]
+        self.archived[game_id] = {**record, 'game_id': game_id}
+        return True
+
+    async def find_archived(self, game_id: str) -> dict | None:
+        return self.archived.get(game_id)
+
+    async def expire(self, before: datetime) -> int:
+        expired = [
+            game_id for game_id, document in self.games.items()
+            if document.get('last_move_at') and
+            document['last_move_at'] < before
+        ]
+        for game_id in expired:
+            del self.games[game_id]
+        for game_id, entries in list(self.moves.items()):
+            entries = [entry for entry in entries if entry['at'] >= before]
+            if entries:
+                self.moves[game_id] = entries
+            else:
+                del self.moves[game_id]
+        return len(expired)
+
+    async def log_moves(self, entry: dict):
+        self.moves.setdefault(entry['game_id'], []).append(dict(entry))
+
+    async def load_move_log(self, game_id: str) -> List[dict]:
+        return sorted(
+            self.moves.get(game_id, ()), key=lambda entry: entry['version']
+        )
+
+    async def logged_games(self, limit: int) -> List[str]:
+        return list(self.moves)[-limit:][::-1]
+
+    async def record_result(self, result: dict):
+        config = (result['width'], result['height'], result['mines_count'])
+        stats = self.stats.get(config)
+        if stats is None:
+            stats = self.stats[config] = {
+                **dict(zip(('width', 'height', 'mines_count'), config)),
+                'played': 0, 'wins': 0, 'losses': 0, 'duration_sum': 0.0,
+                'durations': {}, 'leaderboard': [],
+            }
+        stats['played'] += 1
+        stats['wins' if result['won'] else 'losses'] += 1
+        stats['duration_sum'] += result['duration']
+        bucket = duration_bucket(result['duration'])
+        stats['durations'][bucket] = stats['durations'].get(bucket, 0) + 1
+        if result['won']:
+            leaderboard = stats['leaderboard']
+            leaderboard.append(leaderboard_entry(result))
+            leaderboard.sort(key=lambda entry: entry['duration'])
+            del leaderboard[STATS_LEADERBOARD_SIZE:]
+
+    async def load_stats(self) -> List[dict]:
+        return [
+            {
+                **stats, 'durations': dict(stats['durations']),
+                'leaderboard': list(stats['leaderboard'])
+            }
+            for stats in self.stats.values()
+        ]
+
+
+class SQLiteStorage(GameStorage):
+    """
+    Документ игры без opened_bits лежит в BSON, блоки битов открытых
+    ячеек - отдельными строками, так что ход перезаписывает только
+    изменившиеся блоки. В таблице opened - открытые ячейки игр, записанных
+    до opened_bits, она только читается и чистится. Запросы идут
+    в потоке через asyncio.to_thread по одному соединению под блокировкой.
+    """
+
+    def __init__(self, path: str = SQLITE_PATH):
+        self.path = path
+        self._connection: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    async def _run(self, operation: Callable[[sqlite3.Connection], Any]):
+        def call():
+            with self._lock, self._connection:
+                return operation(self._connection)
+        return await asyncio.to_thread(call)
+
+    async def setup(self):
+        if self._connection is not None:
+            return
+        self._connection = sqlite3.connect(
+            self.path, check_same_thread=False
+        )
+
+        def create_tables(connection: sqlite3.Connection):
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS games ('
+                'game_id TEXT PRIMARY KEY, version INTEGER NOT NULL, '
+                'last_move_at REAL, document BLOB NOT NULL)'
+            )
+            connection.execute(
+                'CREATE INDEX IF NOT EXISTS games_last_move_at '
+                'ON games (last_move_at)'
+            )
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS archive ('
+                'game_id TEXT PRIMARY KEY, document BLOB NOT NULL)'
+            )
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS moves ('
+                'game_id TEXT NOT NULL, version INTEGER NOT NULL, '
+                'entry BLOB NOT NULL)'
+            )
+            connection.execute(
+                'CREATE INDEX IF NOT EXISTS moves_game_id_version '
+                'ON moves (game_id, version)'
+            )
+            # Журнал, созданный до срока хранения записей, без колонки at
+            columns = {
+                row[1]
+                for row in connection.execute('PRAGMA table_info(moves)')
+            }
+            if 'at' not in columns:
+                connection.execute('ALTER TABLE moves ADD COLUMN at REAL')
+            connection.execute(
+                'CREATE INDEX IF NOT EXISTS moves_at ON moves (at)'
+            )
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS opened ('
+                'game_id TEXT NOT NULL, cell INTEGER NOT NULL)'
+            )
+            connection.execute(
+                'CREATE INDEX IF NOT EXISTS opened_game_id '
+                'ON opened (game_id)'
+            )
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS opened_bits ('
+                'game_id TEXT NOT NULL, block TEXT NOT NULL, '
+                'bits BLOB NOT NULL, PRIMARY KEY (game_id, block))'
+            )
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS stats ('
+                'width INTEGER NOT NULL, height INTEGER NOT NULL, '
+                'mines_count INTEGER NOT NULL, played INTEGER NOT NULL, '
+                'wins INTEGER NOT NULL, losses INTEGER NOT NULL, '
+                'duration_sum REAL NOT NULL, '
+                'PRIMARY KEY (width, height, mines_count))'
+            )
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS stats_durations ('
+                'width INTEGER NOT NULL, height INTEGER NOT NULL, '
+                'mines_count INTEGER NOT NULL, bucket TEXT NOT NULL, '
+                'games INTEGER NOT NULL, '
+                'PRIMARY KEY (width, height, mines_count, bucket))'
+            )
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS leaderboard ('
+                'width INTEGER NOT NULL, height INTEGER NOT NULL, '
+                'mines_count INTEGER NOT NULL, duration REAL NOT NULL, '
+                'entry BLOB NOT NULL)'
+            )
+            connection.execute(
+                'CREATE INDEX IF NOT EXISTS leaderboard_config_duration '
+                'ON leaderboard (width, height, mines_count, duration)'
+            )
+        await self._run(create_tables)
+
+    async def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    @staticmethod
+    def _set_opened(
+            connection: sqlite3.Connection, game_id: str,
+            opened: Dict[str, bytes]
+    ):
+        connection.executemany(
+            'INSERT OR REPLACE INTO opened_bits (game_id, block, bits) '
+            'VALUES (?, ?, ?)',
+            ((game_id, block, bits) for block, bits in opened.items())
+        )
+
+    @staticmethod
+    def _delete_opened(connection: sqlite3.Connection, game_id: str):
+        for table in ('opened', 'opened_bits'):
+            connection.execute(
+                f'DELETE FROM {table} WHERE game_id = ?', (game_id,)
+            )
+
+    async def create(self, document: dict) -> bool:
+        document = dict(document)
+        opened = document.pop('opened_bits', {})
+
+        def insert(connection: sqlite3.Connection) -> bool:
+            connection.execute(
+                'INSERT INTO games (game_id, version, last_move_at, document) '
+                'VALUES (?, ?, ?, ?)',
+                (document['game_id'], document.get('version', 0),
+                 _timestamp(document.get('last_move_at')),
+                 bson.encode(document))
+            )
+            self._set_opened(connection, document['game_id'], opened)
+            return True
+        return await self._run(insert)
+
+    async def create_many(self, documents: List[dict]) -> List[str]:
+        def insert(connection: sqlite3.Connection) -> List[str]:
+            # Одна транзакция на всю пачку
+            created = []
+            for document in documents:
+                document = dict(document)
+                opened = document.pop('opened_bits', {})
+                inserted = connection.execute(
+                    'INSERT OR IGNORE INTO games '
+                    '(game_id, version, last_move_at, document) '
+                    'VALUES (?, ?, ?, ?)',
+                    (document['game_id'], document.get('version', 0),
+                     _timestamp(document.get('last_move_at')),
+                     bson.encode(document))
+                ).rowcount
+                if inserted:
+                    self._set_opened(connection, document['game_id'], opened)
+                    created.append(document['game_id'])
+            return created
+        return await self._run(insert)
+
+    async def load(self, game_id: str) -> dict | None:
+        def select(connection: sqlite3.Connection) -> dict | None:
+            row = connection.execute(
+                'SELECT document FROM games WHERE game_id = ?', (game_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            document = bson.decode(row[0])
+            document['opened_bits'] = dict(connection.execute(
+                'SELECT block, bits FROM opened_bits WHERE game_id = ?',
+                (game_id,)
+            ))
+            opened = [
+                cell for cell, in connection.execute(
+                    'SELECT cell FROM opened WHERE game_id = ? '
+                    'ORDER BY rowid', (game_id,)
+                )
+            ]
+            if opened:
+                document['opened'] = opened
+            return document
+        return await self._run(select)
+
+    async def save_delta(
+            self, game_id: str, version: int, values: dict,
+            opened: Dict[str, bytes], replace_opened: bool = False
+    ) -> bool:
+        def update(connection: sqlite3.Connection) -> bool:
+            row = connection.execute(
+                'SELECT document FROM games '
+                'WHERE game_id = ? AND version = ?', (game_id, version)
+            ).fetchone()
+            if row is None:
+                return False
+            document = {**bson.decode(row[0]), **values}
+            connection.execute(
+                'UPDATE games SET version = ?, last_move_at = ?, '
+                'document = ? WHERE game_id = ?',
+                (document.get('version', version),
+                 _timestamp(document.get('last_move_at')),
+                 bson.encode(document), game_id)
+            )
+            if replace_opened:
+                self._delete_opened(connection, game_id)
+            self._set_opened(connection, game_id, opened)
+            return True
+        return await self._run(update)
+
+    async def complete(self, game_id: str, version: int, values: dict) -> bool:
+        document = {'game_id': game_id, **values}
+
+        def replace(connection: sqlite3.Connection) -> bool:
+            updated = connection.execute(
+                'UPDATE games SET version = ?, last_move_at = ?, '
+                'document = ? WHERE game_id = ? AND version = ?',
+                (document.get('version', version),
+                 _timestamp(document.get('last_move_at')),
+                 bson.encode(document), game_id, version)
+            ).rowcount
+            if updated:
+                self._delete_opened(connection, game_id)
+            return bool(updated)
+        return await self._run(replace)
+
+    async def archive(self, game_id: str, version: int, record: dict) -> bool:
+        record = {**record, 'game_id': game_id}
+
+        def move(connection: sqlite3.Connection) -> bool:
+            deleted = connection.execute(
+                'DELETE FROM games WHERE game_id = ? AND version = ?',
+                (game_id, version)
+            ).rowcount
+            if not deleted:
+                return False
+            self._delete_opened(connection, game_id)
+            connection.execute(
+                'INSERT INTO archive (game_id, document) VALUES (?, ?)',
+                (game_id, bson.encode(record))
+            )
+            return True
+        return await self._run(move)
+
+    async def find_archived(self, game_id: str) -> dict | None:
+        def select(connection: sqlite3.Connection) -> dict | None:
+            row = connection.execute(
+                'SELECT document FROM archive WHERE game_id = ?', (game_id,)
+            ).fetchone()
+            return bson.decode(row[0]) if row else None
+        return await self._run(select)
+
+    async def expire(self, before: datetime) -> int:
+        def delete(connection: sqlite3.Connection) -> int:
+            for table in ('opened', 'opened_bits'):
+                connection.execute(
+                    f'DELETE FROM {table} WHERE game_id IN ('
+                    'SELECT game_id FROM games WHERE last_move_at < ?)',
+                    (_timestamp(before),)
+                )
+            connection.execute(
+                'DELETE FROM moves WHERE at < ?', (_timestamp(before),)
+            )
+            return connection.execute(
+                'DELETE FROM games WHERE last_move_at < ?',
+                (_timestamp(before),)
+            ).rowcount
+        return await self._run(delete)
+
+    async def log_moves(self, entry: dict):
+        def insert(connection: sqlite3.Connection):
+            connection.execute(
+                'INSERT INTO moves (game_id, version, at, entry) '
+                'VALUES (?, ?, ?, ?)',
+                (
+                    entry['game_id'], entry['version'],
+                    _timestamp(entry['at']), bson.encode(entry)
+                )
+            )
+        await self._run(insert)
+
+    async def log_moves_many(self, entries: List[dict]):
+        def insert(connection: sqlite3.Connection):
+            connection.executemany(
+                'INSERT INTO moves (game_id, version, at, entry) '
+                'VALUES (?, ?, ?, ?)',
+                (
+                    (
+                        entry['game_id'], entry['version'],
+                        _timestamp(entry['at']), bson.encode(entry)
+                    )
+                    for entry in entries
+                )
+            )
+        await self._run(insert)
+
+    async def load_move_log(self, game_id: str) -> List[dict]:
+        def select(connection: sqlite3.Connection) -> List[dict]:
+            return [
+                bson.decode(entry) for entry, in connection.execute(
+                    'SELECT entry FROM moves WHERE game_id = ? '
+                    'ORDER BY version', (game_id,)
+                )
+            ]
+        return await self._run(select)
+
+    async def logged_games(self, limit: int) -> List[str]:
+        def select(connection: sqlite3.Connection) -> List[str]:
+            return [
+                game_id for game_id, in connection.execute(
+                    'SELECT game_id FROM moves WHERE version = 0 '
+                    'ORDER BY rowid DESC LIMIT ?', (limit,)
+                )
+            ]
+        return await self._run(select)
+
+    async def record_result(self, result: dict):
+        config = (result['width'], result['height'], result['mines_count'])
+        won = bool(result['won'])
+
+        def update(connection: sqlite3.Connection):
+            # Счетчики растут в одной транзакции через upsert, без чтения
+            connection.execute(
+                'INSERT INTO stats (width, height, mines_count, played, '
+                'wins, losses, duration_sum) VALUES (?, ?, ?, 1, ?, ?, ?) '
+                'ON CONFLICT (width, height, mines_count) DO UPDATE SET '
+                'played = played + 1, wins = wins + excluded.wins, '
+                'losses = losses + excluded.losses, '
+                'duration_sum = duration_sum + excluded.duration_sum',
+                (*config, int(won), int(not won), result['duration'])
+            )
+            connection.execute(
+                'INSERT INTO stats_durations '
+                '(width, height, mines_count, bucket, games) '
+                'VALUES (?, ?, ?, ?, 1) '
+                'ON CONFLICT (width, height, mines_count, bucket) '
+                'DO UPDATE SET games = games + 1',
+                (*config, duration_bucket(result['duration']))
+            )
+            if not won:
+                return
+            connection.execute(
+                'INSERT INTO leaderboard '
+                '(width, height, mines_count, duration, entry) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (*config, result['duration'],
+                 bson.encode(leaderboard_entry(result)))
+            )
+            connection.execute(
+                'DELETE FROM leaderboard WHERE width = ? AND height = ? '
+                'AND mines_count = ? AND rowid NOT IN ('
+                'SELECT rowid FROM leaderboard WHERE width = ? '
+                'AND height = ? AND mines_count = ? '
+                'ORDER BY duration LIMIT ?)',
+                (*config, *config, STATS_LEADERBOARD_SIZE)
+            )
+        await self._run(update)
+
+    async def load_stats(self) -> List[dict]:
+        def select(connection: sqlite3.Connection) -> List[dict]:
+            stats = {
+                tuple(row[:3]): {
+                    'width': row[0], 'height': row[1], 'mines_count': row[2],
+                    'played': row[3], 'wins': row[4], 'losses': row[5],
+                    'duration_sum': row[6], 'durations': {},
+                    'leaderboard': [],
+                }
+                for row in connection.execute(
+                    'SELECT width, height, mines_count, played, wins, '
+                    'losses, duration_sum FROM stats'
+                )
+            }
+            for *config, bucket, games in connection.execute(
+                    'SELECT width, height, mines_count, bucket, games '
+                    'FROM stats_durations'
+            ):
+                stats[tuple(config)]['durations'][bucket] = games
+            for *config, entry in connection.execute(
+                    'SELECT width, height, mines_count, entry '
+                    'FROM leaderboard ORDER BY duration'
+            ):
+                stats[tuple(config)]['leaderboard'].append(
+                    bson.decode(entry)
+                )
+            return list(stats.values())
+        return await self._run(select)
+
+
+def _timestamp(value: datetime | None) -> float | None:
+    if value is None:
+        return None
+    return value.replace(tzinfo=timezone.utc).timestamp()
+
+
+class _LocalStorage:
+    """
+    Общее на процесс хранилище memory или sqlite.
+    """
+    storage: GameStorage | None = None
+
+
+local = _LocalStorage()
+
+
+def create_storage(backend: str = STORAGE_BACKEND) -> GameStorage:
+    if backend == 'memory':
+        return MemoryStorage()
+    if backend == 'sqlite':
+        return SQLiteStorage(SQLITE_PATH)
+    raise ValueError(f'Неизвестное хранилище {backend}')
+
+
+async def get_storage() -> GameStorage:
+    """
+    Хранилище для запросов. Для Mongo оборачивает базу из get_db, у
+    которой клиент пересоздается при смене event loop.
+    """
+    if STORAGE_BACKEND == 'mongo':
+        return MongoStorage(await get_db())
+    if local.storage is None:
+        local.storage = create_storage()
+        await local.storage.setup()
+    return local.storage
+
+
+async def expire_idle_games(storage: GameStorage):
+    """
+    Раз в GAME_EXPIRE_INTERVAL секунд удаляет игры без ходов дольше
+    GAME_TTL секунд. Для хранилищ без своего TTL.
+    """
+    while True:
+        await asyncio.sleep(GAME_EXPIRE_INTERVAL)
+        try:
+            expired = await storage.expire(
+                utcnow() - timedelta(seconds=GAME_TTL)
+            )
+        except Exception:
+            logger.exception('Не удалось удалить брошенные игры')
+            continue
+        if expired:
+            logger.info('Удалено брошенных игр: %s', expired)
+
+
+async def close_storage():
+    if local.storage is not None:
+        await local.storage.close()
+        local.storage = None
+    await close_db()
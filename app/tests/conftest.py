@@ -10,7 +10,7 @@ import pytest
 from httpx import AsyncClient
 from motor.motor_asyncio import AsyncIOMotorDatabase
 
-from app.database import get_db
+from app.database import create_indexes, get_db
 from main import app
 
 
@@ -22,4 +22,6 @@ async def ac() -> AsyncGenerator[AsyncClient, None]:
 
 @pytest.fixture(scope="session")
 async def db() -> AsyncIOMotorDatabase:
-    return await get_db()
+    database = await get_db()
+    await create_indexes(database)
+    return database
@@ -1,10 +1,19 @@
+import asyncio
+import time
 import uuid
 
+import numpy as np
+from fastapi.testclient import TestClient
 from httpx import AsyncClient, Response
 from motor.motor_asyncio import AsyncIOMotorDatabase
 
-from app.schemas import MAX_HEIGHT, MAX_WIDTH
+from app import router
+from app.board import Board, OPENED_BLOCK
+from app.config import MAX_BATCH_GAMES, MAX_BATCH_MOVES
+from app.database import game_key
+from app.schemas import GameService, MAX_HEIGHT, MAX_WIDTH, stats_cache
 from app.utils import MinesErrorText as Met
+from main import app
 
 
 class TestNewGame:
@@ -110,6 +119,59 @@ class TestNewGame:
             assert response_4.status_code == 422, f"w={w}, h={h}, m_c={m_c}"
 
 
+class TestNewGamesBatch:
+
+    async def test_batch_count(self, ac: AsyncClient):
+        response: Response = await ac.post(
+            "/api/new/batch",
+            json={"width": 10, "height": 10, "mines_count": 10, "count": 5}
+        )
+        assert response.status_code == 200
+        game_ids = response.json()['game_ids']
+        assert len(set(game_ids)) == 5
+
+        response = await ac.post(
+            "/api/turn",
+            json={"game_id": game_ids[-1], "row": 0, "col": 0}
+        )
+        assert response.status_code == 200
+        assert response.json()['field'][0][0] != ' '
+
+    async def test_batch_list(self, ac: AsyncClient):
+        response: Response = await ac.post(
+            "/api/new/batch",
+            json={"games": [
+                {"width": 10, "height": 10, "mines_count": 10},
+                {"width": 5, "height": 6, "mines_count": 3},
+            ]}
+        )
+        assert response.status_code == 200
+        assert len(response.json()['game_ids']) == 2
+
+    async def test_batch_bad_params(self, ac: AsyncClient):
+        response: Response = await ac.post(
+            "/api/new/batch",
+            json={"width": 10, "height": 10, "mines_count": 10, "count": 0}
+        )
+        assert response.status_code == 400
+        assert response.json()['error'] == Met.error_games_count.format(
+            max=MAX_BATCH_GAMES
+        )
+
+        response = await ac.post(
+            "/api/new/batch", json={"width": 10, "count": 2}
+        )
+        assert response.status_code == 400
+        assert response.json()['error'] == Met.error_games_format
+
+        response = await ac.post(
+            "/api/new/batch",
+            json={"width": 1, "height": 10, "mines_count": 10, "count": 2}
+        )
+        assert response.status_code == 400
+        assert response.json()['error'] == Met.error_width
+
+
 class TestTurnGame:
 
     @staticmethod
@@ -176,9 +238,12 @@ class TestTurnGame:
 
         # Находим ячейку с миной
         game_in_db = await db.mongodb["games"].find_one(
-            {'game_id': game['game_id']},
+            game_key(game['game_id']),
         )
-        for nx, x in enumerate(game_in_db['data_field']):
+        data_field = Board.from_bson(
+            game_in_db['width'], game_in_db['height'], game_in_db['data_field']
+        ).to_lists()
+        for nx, x in enumerate(data_field):
             if row or col:
                 break
             for ny, y in enumerate(x):
@@ -198,10 +263,62 @@ class TestTurnGame:
         assert response_2.json()['completed']
         field = [
             [col if col != ' ' else 'X' for col in row]
-            for row in game_in_db['data_field']
+            for row in data_field
         ]
         assert response_2.json()['field'] == field
 
+    async def test_diff_mode(self, ac: AsyncClient):
+        game = await self.new_game(ac, 10, 10, 10)
+        response: Response = await ac.post(
+            "/api/turn",
+            params={"mode": "diff"},
+            json={"game_id": game['game_id'], "row": 0, "col": 0}
+        )
+        assert response.status_code == 200
+        diff = response.json()
+        assert diff['version'] == 1
+        assert [0, 0, diff['cells'][0][2]] in diff['cells']
+        assert 'field' not in diff or diff['completed']
+
+        closed = [
+            (x, y) for x in range(10) for y in range(10)
+            if [x, y] not in [cell[:2] for cell in diff['cells']]
+        ]
+        response_2: Response = await ac.post(
+            "/api/turn",
+            headers={"Accept": "application/vnd.minesweeper.diff+json"},
+            json={
+                "game_id": game['game_id'],
+                "row": closed[0][0],
+                "col": closed[0][1]
+            }
+        )
+        assert response_2.json()['version'] == 2
+
+    async def test_flag_action(self, ac: AsyncClient):
+        game = await self.new_game(ac, 10, 10, 10)
+        response: Response = await ac.post(
+            "/api/turn",
+            json={"game_id": game['game_id'], "row": 0, "col": 0,
+                  "action": "flag"}
+        )
+        assert response.status_code == 200
+        assert response.json()['field'][0][0] == 'F'
+
+        response = await ac.post(
+            "/api/turn",
+            json={"game_id": game['game_id'], "row": 0, "col": 0}
+        )
+        assert response.status_code == 400
+        assert response.json()['error'] == Met.error_flagged
+
+        response = await ac.post(
+            "/api/turn",
+            json={"game_id": game['game_id'], "row": 0, "col": 0,
+                  "action": "chord"}
+        )
+        assert response.json()['error'] == Met.error_chord
+
     async def test_bad_params_turn(self, ac: AsyncClient):
         w, h, m_c = 10, 10, 98
         game = await self.new_game(ac, w, h, m_c)
@@ -284,3 +401,191 @@ class TestTurnGame:
             )
         assert response_5.status_code == 400
         assert response_5.json()['error'] == Met.error_completed
+
+
+class TestTurnsGame:
+
+    async def test_batch_until_end(self, ac: AsyncClient):
+        game = await TestTurnGame.new_game(ac, 10, 10, 10)
+        moves = [{"row": x, "col": y} for x in range(10) for y in range(10)]
+        response: Response = await ac.post(
+            "/api/turns",
+            json={"game_id": game['game_id'], "moves": moves}
+        )
+        assert response.status_code == 200
+        result = response.json()
+        assert result['game']['completed']
+        assert result['moves'][0]['opened'] > 0
+        assert result['moves'][-1]['completed']
+        assert len(result['moves']) < len(moves)
+
+    async def test_bad_moves_count(self, ac: AsyncClient):
+        game = await TestTurnGame.new_game(ac, 10, 10, 10)
+        response: Response = await ac.post(
+            "/api/turns",
+            json={"game_id": game['game_id'], "moves": []}
+        )
+        assert response.status_code == 400
+        assert response.json()['error'] == Met.error_moves_count.format(
+            max=MAX_BATCH_MOVES
+        )
+
+
+class TestHint:
+
+    async def test_hint_after_turn(self, ac: AsyncClient):
+        game = await TestTurnGame.new_game(ac, 10, 10, 10)
+        await ac.post(
+            "/api/turn",
+            json={"game_id": game['game_id'], "row": 0, "col": 0}
+        )
+        response: Response = await ac.post(
+            "/api/hint", json={"game_id": game['game_id']}
+        )
+        assert response.status_code == 200
+        hint = response.json()
+        row, col = hint['best']
+        response = await ac.post(
+            "/api/turn",
+            json={"game_id": game['game_id'], "row": row, "col": col}
+        )
+        assert response.status_code == 200
+        if hint['safe']:
+            assert response.json()['field'][row][col] != 'X'
+
+    async def test_hint_unknown_game(self, ac: AsyncClient):
+        response: Response = await ac.post(
+            "/api/hint", json={"game_id": "not-a-game"}
+        )
+        assert response.status_code == 400
+        assert response.json()['error'] == Met.error_form_game_id
+
+
+class TestStats:
+
+    @staticmethod
+    def config_stats(response: Response) -> dict:
+        return next(
+            config for config in response.json()['configs']
+            if (config['width'], config['height'], config['mines_count']) ==
+            (2, 2, 3)
+        )
+
+    @staticmethod
+    async def win_game(ac: AsyncClient):
+        # Первый ход безопасен, на поле 2x2 с 3 минами он и есть победа
+        game = await TestTurnGame.new_game(ac, 2, 2, 3)
+        await ac.post(
+            "/api/turn",
+            json={"game_id": game['game_id'], "row": 0, "col": 0}
+        )
+
+    async def test_won_game_in_stats(self, ac: AsyncClient):
+        stats_cache.clear()
+        await self.win_game(ac)
+        response: Response = await ac.get("/api/stats")
+        assert response.status_code == 200
+        stats = self.config_stats(response)
+        assert stats['wins'] >= 1
+        assert stats['win_rate'] > 0
+        assert stats['leaderboard'][0]['moves'] == 1
+
+        # Новая игра не видна, пока ответ в кеше
+        await self.win_game(ac)
+        assert self.config_stats(await ac.get("/api/stats")) == stats
+        stats_cache.clear()
+        stats_after = self.config_stats(await ac.get("/api/stats"))
+        assert stats_after['played'] == stats['played'] + 1
+
+
+class TestWebSocketGame:
+
+    async def test_session_pushes_cells(self, ac: AsyncClient):
+        game = await TestTurnGame.new_game(ac, 10, 10, 99)
+        with TestClient(app).websocket_connect(
+                f"/api/ws/{game['game_id']}"
+        ) as websocket:
+            assert websocket.receive_json()['game_id'] == game['game_id']
+
+            websocket.send_json({"row": 0, "col": 0})
+            message = websocket.receive_json()
+            assert message['cells'] == [[0, 0, '3']]
+            assert message['completed']
+            assert message['field'][0][0] == '3'
+
+        response: Response = await ac.post(
+            "/api/turn",
+            json={"game_id": game['game_id'], "row": 1, "col": 1}
+        )
+        assert response.json()['error'] == Met.error_completed
+
+    async def test_idle_session_persists(self, ac: AsyncClient, monkeypatch):
+        """
+        Несохраненный ход пишется по WS_PERSIST_INTERVAL, даже если
+        клиент больше ничего не шлет.
+        """
+        monkeypatch.setattr(router, 'WS_PERSIST_INTERVAL', 0.05)
+        persisted = []
+        persist = GameService.persist
+
+        async def record(game: GameService, storage):
+            persisted.append(game.version)
+            await persist(game, storage)
+
+        monkeypatch.setattr(GameService, 'persist', record)
+        game = await TestTurnGame.new_game(ac, 30, 16, 99)
+        with TestClient(app).websocket_connect(
+                f"/api/ws/{game['game_id']}"
+        ) as websocket:
+            websocket.receive_json()
+            websocket.send_json({"row": 0, "col": 0})
+            assert not websocket.receive_json()['completed']
+            for _ in range(50):
+                if persisted:
+                    break
+                time.sleep(0.01)
+            assert persisted == [1]
+
+    async def test_session_bad_game_id(self):
+        with TestClient(app).websocket_connect(
+                "/api/ws/not-a-game"
+        ) as websocket:
+            assert websocket.receive_json()['error'] == Met.error_form_game_id
+
+
+class TestConcurrentTurns:
+
+    async def test_no_lost_updates(
+            self, ac: AsyncClient, db: AsyncIOMotorDatabase
+    ):
+        game = await TestTurnGame.new_game(ac, 30, 30, 100)
+        responses = await asyncio.gather(*(
+            ac.post(
+                "/api/turn",
+                json={"game_id": game['game_id'], "row": x, "col": y}
+            )
+            for x in range(30) for y in range(30) if (x + y) % 7 == 0
+        ))
+        assert {r.status_code for r in responses} <= {200, 400, 409}
+        applied = sum(r.status_code == 200 for r in responses)
+        assert applied > 0
+
+        game_in_db = await db.mongodb["games"].find_one(
+            game_key(game['game_id'])
+        )
+        # Каждый примененный ход увеличил версию ровно на один
+        assert game_in_db['version'] == applied
+        if not game_in_db['completed']:
+            # Открытые до снимка поля ячейки лежат в самом снимке
+            opened = np.zeros(30 * 30, dtype=bool)
+            if game_in_db.get('field') is not None:
+                opened |= Board.from_bson(
+                    30, 30, game_in_db['field']
+                ).opened_mask()
+            for block, bits in game_in_db['opened_bits'].items():
+                cells = opened[int(block) * OPENED_BLOCK:]
+                cells[:OPENED_BLOCK] |= np.unpackbits(
+                    np.frombuffer(bits, dtype=np.uint8),
+                    count=min(len(cells), OPENED_BLOCK)
+                ).view(bool)
+            assert opened.sum() == game_in_db['count_open_cells']
@@ -0,0 +1,166 @@
+import pytest
+
+from app.board import Board, CLOSED, MINE, generate_data_field
+from app.chunks import ChunkedBoard, ChunkedMineField, flood_fill
+
+
+class TestBoard:
+
+    def test_lists_round_trip(self):
+        lists = [['1', ' ', '0'], ['X', 'M', '8']]
+        board = Board.from_lists(lists)
+        assert (board.width, board.height) == (2, 3)
+        assert board[1, 0] == 'X'
+        assert board.to_lists() == lists
+
+    def test_bson_round_trip(self):
+        board = Board(4, 3)
+        board[3, 2] = '5'
+        restored = Board.from_bson(4, 3, board.to_bson())
+        assert restored == board
+        assert restored[3, 2] == '5'
+        assert restored[0, 0] == CLOSED
+
+    def test_opened_bits_round_trip(self):
+        data_field = generate_data_field(100, 90, 50, 0, 0, 1)
+        board = Board(100, 90)
+        for i in (0, 4095, 4096, 8999):
+            board.cells[i] = data_field.cells[i]
+        bits = board.opened_bits()
+        assert sorted(bits) == ['0', '1', '2']
+        assert list(board.opened_bits([5000, 4097])) == ['1']
+
+        restored = Board(100, 90)
+        restored.apply_opened_bits(data_field, bits)
+        assert restored == board
+
+    def test_replace(self):
+        board = Board(2, 2, fill='1')
+        board[0, 1] = MINE
+        assert board.replace(MINE, 'X').to_lists() == [['1', 'X'], ['1', '1']]
+        assert board[0, 1] == MINE
+
+
+def count_mines_around(board: Board, x: int, y: int) -> int:
+    return sum(
+        board[nx, ny] == MINE
+        for nx in range(x - 1, x + 2) for ny in range(y - 1, y + 2)
+        if 0 <= nx < board.width and 0 <= ny < board.height
+    )
+
+
+class TestGenerateDataField:
+
+    def test_counts_match_neighbours(self):
+        for w, h, m_c, seed in ((30, 30, 99, 1), (2, 30, 1, 2), (9, 4, 35, 3)):
+            board = generate_data_field(w, h, m_c, 1, 1, seed)
+            assert board.cells.count(ord(MINE)) == m_c
+            assert board[1, 1] != MINE
+            for x in range(w):
+                for y in range(h):
+                    if board[x, y] != MINE:
+                        assert board[x, y] == str(
+                            count_mines_around(board, x, y)
+                        ), f"x={x}, y={y}, seed={seed}"
+
+    def test_first_cell_is_never_mine(self):
+        for seed in range(9):
+            x, y = seed % 3, seed // 3
+            board = generate_data_field(3, 3, 8, x, y, seed)
+            assert board[x, y] == str(count_mines_around(board, x, y))
+
+    def test_seed_reproducible(self):
+        assert generate_data_field(16, 16, 40, 5, 5, 42) == \
+            generate_data_field(16, 16, 40, 5, 5, 42)
+
+
+class TestChunkedMineField:
+
+    @staticmethod
+    def as_board(mine_field: ChunkedMineField) -> Board:
+        board = Board(mine_field.width, mine_field.height)
+        for x in range(mine_field.width):
+            for y in range(mine_field.height):
+                board[x, y] = mine_field[x, y]
+        return board
+
+    def test_counts_cross_chunks(self):
+        mine_field = ChunkedMineField(30, 20, 120, 7, 12, 13, chunk_size=7)
+        board = self.as_board(mine_field)
+        assert board.cells.count(ord(MINE)) == 120
+        assert board[12, 13] != MINE
+        for x in range(30):
+            for y in range(20):
+                if board[x, y] != MINE:
+                    assert board[x, y] == str(
+                        count_mines_around(board, x, y)
+                    ), f"x={x}, y={y}"
+
+    def test_lazy_and_reproducible(self):
+        mine_field = ChunkedMineField(10000, 10000, 10 ** 7, 3, 0, 0)
+        value = mine_field[0, 0]
+        assert len(mine_field._mines) <= 4
+        assert ChunkedMineField(10000, 10000, 10 ** 7, 3, 0, 0)[0, 0] == value
+
+
+def bfs_opened(mine_field: ChunkedMineField, x: int, y: int) -> set:
+    opened, to_check = set(), {(x, y)}
+    while to_check:
+        x, y = to_check.pop()
+        if (
+                not (0 <= x < mine_field.width and 0 <= y < mine_field.height)
+                or (x, y) in opened
+        ):
+            continue
+        opened.add((x, y))
+        if mine_field[x, y] == '0':
+            to_check.update(
+                (x + dx, y + dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)
+            )
+    return opened
+
+
+class TestFloodFill:
+
+    @pytest.mark.parametrize('seed', range(10))
+    def test_matches_bfs(self, seed):
+        mine_field = ChunkedMineField(37, 29, 60, seed, 3, 4, chunk_size=8)
+        field = ChunkedBoard(37, 29, chunk_size=8)
+        xs, ys = flood_fill(field, mine_field, 3, 4)
+
+        opened = set(zip(xs.tolist(), ys.tolist()))
+        assert len(opened) == len(xs)
+        assert opened == bfs_opened(mine_field, 3, 4)
+        assert all(field[x, y] == mine_field[x, y] for x, y in opened)
+        assert sorted(field.opened_indices()) == sorted(
+            x * 29 + y for x, y in opened
+        )
+
+    def test_limit_and_continue(self):
+        mine_field = ChunkedMineField(300, 300, 10, 1, 0, 0, chunk_size=16)
+        field = ChunkedBoard(300, 300, chunk_size=16)
+        xs, _ = flood_fill(field, mine_field, 0, 0, max_cells=1000)
+        assert 1000 <= len(xs) < 2000
+
+        # Следующий ход в закрытую ячейку у открытого нуля продолжает
+        x, y = next(
+            (x, y) for x in range(300) for y in range(300)
+            if field[x, y] == CLOSED and any(
+                field[nx, ny] == '0'
+                for nx in range(x - 1, x + 2) for ny in range(y - 1, y + 2)
+                if 0 <= nx < 300 and 0 <= ny < 300
+            )
+        )
+        more, _ = flood_fill(field, mine_field, x, y, max_cells=1000)
+        assert len(more) >= 1000
+
+    def test_opened_bits_round_trip(self):
+        mine_field = ChunkedMineField(200, 150, 300, 2, 5, 5, chunk_size=32)
+        field = ChunkedBoard(200, 150, chunk_size=32)
+        flood_fill(field, mine_field, 5, 5)
+        field[199, 149] = mine_field[199, 149]
+
+        restored = ChunkedBoard(200, 150, chunk_size=32)
+        restored.apply_opened_bits(mine_field, field.opened_bits())
+        assert restored == field
+        assert list(field.opened_bits([199 * 150 + 149])) == ['6_4']
@@ -0,0 +1,105 @@
+import asyncio
+import time
+
+from app.cache import GameCache, LRUCache, TTLCache
+
+
+class FakeGame:
+
+    def __init__(self, game_id: str):
+        self.game_id = game_id
+        self.saved = 0
+
+    async def save(self, db):
+        self.saved += 1
+
+
+class TestLRUCache:
+
+    def test_evicts_least_recent(self):
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        assert 'a' in cache and 'c' in cache and 'b' not in cache
+
+
+class TestTTLCache:
+
+    def test_expires(self, monkeypatch):
+        now = time.monotonic()
+        cache = TTLCache(5)
+        monkeypatch.setattr(time, 'monotonic', lambda: now)
+        cache.put('a', 1)
+        assert cache.get('a') == 1
+        monkeypatch.setattr(time, 'monotonic', lambda: now + 5)
+        assert cache.get('a') is None
+
+
+class TestGameCache:
+
+    async def test_writes_are_coalesced(self):
+        cache = GameCache(maxsize=10, ttl=60, flush_interval=1)
+        game = FakeGame('a')
+        await cache.put(game, db=None)
+        for _ in range(5):
+            assert await cache.get('a') is game
+            cache.mark_dirty('a')
+        assert cache.stats()['dirty'] == 1
+
+        await cache.flush()
+        assert game.saved == 1
+        assert cache.stats()['dirty'] == 0
+        assert cache.stats()['hits'] == 5
+
+    async def test_eviction_flushes(self):
+        cache = GameCache(maxsize=1, ttl=60, flush_interval=1)
+        first, second = FakeGame('a'), FakeGame('b')
+        await cache.put(first, db=None)
+        cache.mark_dirty('a')
+        await cache.put(second, db=None)
+        assert first.saved == 1
+        assert await cache.get('a') is None
+
+    async def test_expired_game_is_flushed_on_get(self):
+        cache = GameCache(maxsize=10, ttl=0.01, flush_interval=1)
+        game = FakeGame('a')
+        await cache.put(game, db=None)
+        cache.mark_dirty('a')
+        await asyncio.sleep(0.02)
+        assert await cache.get('a') is None
+        assert game.saved == 1
+        assert len(cache) == 0
+
+    async def test_concurrent_misses_load_once(self):
+        cache = GameCache(maxsize=10, ttl=60, flush_interval=1)
+        loads = []
+
+        async def load():
+            await asyncio.sleep(0.01)
+            loads.append(FakeGame('a'))
+            return loads[-1]
+
+        first, second = await asyncio.gather(
+            cache.get_or_load('a', load, db=None),
+            cache.get_or_load('a', load, db=None),
+        )
+        assert len(loads) == 1
+        assert first is second is await cache.get('a')
+
+    async def test_flush_continues_after_error(self):
+        class BrokenGame(FakeGame):
+            async def save(self, db):
+                raise ConnectionError
+
+        cache = GameCache(maxsize=10, ttl=60, flush_interval=1)
+        broken, game = BrokenGame('a'), FakeGame('b')
+        for current in (broken, game):
+            await cache.put(current, db=None)
+            cache.mark_dirty(current.game_id)
+
+        await cache.flush()
+        assert game.saved == 1
+        # Игра с ошибкой ждет следующего сброса
+        assert cache.stats()['dirty'] == 1
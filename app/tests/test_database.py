@@ -0,0 +1,162 @@
+import asyncio
+import uuid
+
+import pytest
+from httpx import AsyncClient, Response
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from pymongo import MongoClient
+
+import app.storage
+from app.config import GAME_TTL
+from app.database import (
+    MOVES_TTL_INDEX, TTL_INDEX, close_db, create_indexes, game_key, get_db,
+    mongo
+)
+from app.schemas import GameService
+from app.storage import MongoStorage, utcnow
+
+
+def plan_stages(plan: dict) -> set:
+    """
+    Собирает названия всех стадий плана запроса.
+    """
+    stages = {plan.get('stage')}
+    if 'inputStage' in plan:
+        stages |= plan_stages(plan['inputStage'])
+    for child in plan.get('inputStages', []):
+        stages |= plan_stages(child)
+    return stages
+
+
+class TestIndexes:
+
+    async def test_find_game_uses_index(
+            self, ac: AsyncClient, db: AsyncIOMotorDatabase
+    ):
+        response: Response = await ac.post(
+            "/api/new",
+            json={"width": 10, "height": 10, "mines_count": 10}
+        )
+        game_id = response.json()['game_id']
+
+        explain = await db.mongodb["games"].find(game_key(game_id)).explain()
+        stages = plan_stages(explain['queryPlanner']['winningPlan'])
+        assert 'COLLSCAN' not in stages
+        assert stages & {
+            'IXSCAN', 'IDHACK', 'EXPRESS_IXSCAN', 'EXPRESS_IDHACK'
+        }
+
+    async def test_create_indexes_idempotent(self, db: AsyncIOMotorDatabase):
+        await create_indexes(db)
+        await create_indexes(db)
+
+    async def test_ttl_index(self, db: AsyncIOMotorDatabase):
+        indexes = await db.mongodb["games"].index_information()
+        move_indexes = await db.mongodb["moves"].index_information()
+        if not GAME_TTL:
+            assert TTL_INDEX not in indexes
+            assert MOVES_TTL_INDEX not in move_indexes
+            return
+        assert indexes[TTL_INDEX]['key'] == [('last_move_at', 1)]
+        assert indexes[TTL_INDEX]['expireAfterSeconds'] == GAME_TTL
+        assert move_indexes[MOVES_TTL_INDEX]['key'] == [('at', 1)]
+        assert move_indexes[MOVES_TTL_INDEX]['expireAfterSeconds'] == GAME_TTL
+
+
+class TestMongoStorage:
+
+    async def test_archive(self, db: AsyncIOMotorDatabase, monkeypatch):
+        storage = MongoStorage(db)
+        game_id = str(uuid.uuid4())
+        await storage.create(
+            {'game_id': game_id, 'version': 3, 'opened_bits': {}}
+        )
+
+        # Игра остается в games, если запись в архив не прошла
+        class BrokenArchive:
+            async def update_one(self, *args, **kwargs):
+                raise ConnectionError
+
+        with monkeypatch.context() as patch:
+            patch.setattr(
+                MongoStorage, 'archived', property(lambda _: BrokenArchive())
+            )
+            with pytest.raises(ConnectionError):
+                await storage.archive(game_id, 3, {'won': True})
+        assert await storage.load(game_id)
+
+        # Устаревшая версия не оставляет записи в архиве
+        assert not await storage.archive(game_id, 2, {'won': False})
+        assert await storage.load(game_id)
+        assert await storage.find_archived(game_id) is None
+
+        assert await storage.archive(game_id, 3, {'won': True, 'moves': 3})
+        assert await storage.load(game_id) is None
+        # Повтор той же записи и более старая версия не трогают архив
+        assert not await storage.archive(game_id, 3, {'won': True})
+        assert not await storage.archive(game_id, 2, {'won': False})
+        archived = await storage.find_archived(game_id)
+        assert archived['won'] and archived['moves'] == 3
+
+    async def test_one_sided_stats(
+            self, db: AsyncIOMotorDatabase, monkeypatch
+    ):
+        monkeypatch.setattr(app.storage, 'STATS_DURATION_BUCKETS', [0.5, 10])
+        storage = MongoStorage(db)
+        # Своя ширина, чтобы не смешаться со статистикой других тестов
+        width = 1000 + uuid.uuid4().int % 10 ** 6
+        for height, won in ((1, False), (2, True)):
+            await storage.record_result({
+                'game_id': str(uuid.uuid4()), 'won': won, 'width': width,
+                'height': height, 'mines_count': 1, 'moves': 1,
+                'duration': 0.2, 'completed_at': utcnow(),
+            })
+
+        loss, win = sorted(
+            (
+                config for config in (await GameService.stats(storage)).configs
+                if config.width == width
+            ),
+            key=lambda config: config.height
+        )
+        assert (loss.wins, loss.losses, loss.leaderboard) == (0, 1, [])
+        assert (win.wins, win.losses, len(win.leaderboard)) == (1, 0, 1)
+        assert loss.durations['0.5'] == win.durations['0.5'] == 1
+
+
+class TestMotorClient:
+
+    def test_client_closed_on_loop_change(self, monkeypatch):
+        # Свое чистое состояние вместо клиента сессионной фикстуры db,
+        # monkeypatch вернет его после теста
+        monkeypatch.setattr(mongo, 'client', None)
+        monkeypatch.setattr(mongo, 'loop', None)
+        monkeypatch.setattr(mongo, 'previous', [])
+        created = []
+        closed = []
+        close = MongoClient.close
+
+        def track_close(client):
+            # MongoClient сравнивается по адресу сервера, нужна identity
+            if any(client is ours for ours in created):
+                closed.append(id(client))
+            close(client)
+        monkeypatch.setattr(MongoClient, 'close', track_close)
+
+        async def client() -> AsyncIOMotorClient:
+            await get_db()
+            created.append(mongo.client.delegate)
+            return mongo.client
+
+        first = asyncio.run(client())
+        second = asyncio.run(client())
+        assert closed == [id(first.delegate)]
+
+        # Клиент еще открытого loop закрывается только при остановке
+        loop = asyncio.new_event_loop()
+        third = loop.run_until_complete(client())
+        fourth = asyncio.run(client())
+        assert closed == [id(first.delegate), id(second.delegate)]
+        asyncio.run(close_db())
+        loop.close()
+        assert closed[2:] == [id(third.delegate), id(fourth.delegate)]
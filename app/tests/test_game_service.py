@@ -0,0 +1,296 @@
+import json
+import math
+
+import bson
+import numpy as np
+import pytest
+from bson import Binary
+
+import app.schemas
+from app.board import Board, ZeroRegions
+from app.chunks import ChunkedBoard
+from app.config import DENSE_MAX_CELLS
+from app.schemas import GameService, RESPONSE_EXCLUDE, data_field_cache
+from app.utils import MinesWeeperHTTPException, MinesErrorText as Met
+
+
+class TestGameDocument:
+
+    @staticmethod
+    def played_game(**params) -> GameService:
+        game = GameService(**params)
+        game._create_data_field(0, 0)
+        game._GameService__open_cells(0, 0)
+        return game
+
+    def test_full_round_trip(self):
+        game = self.played_game(width=10, height=8, mines_count=10)
+        document = game.to_document()
+        assert document['data_field'] is not None
+
+        restored = GameService.from_document(document)
+        assert restored.field == game.field
+        assert restored.data_field == game.data_field
+
+    @pytest.mark.parametrize('cached', [True, False])
+    def test_seed_round_trip(self, monkeypatch, cached):
+        monkeypatch.setattr(app.schemas, 'BOARD_STORAGE', 'seed')
+        game = self.played_game(width=10, height=8, mines_count=10)
+        document = game.to_document()
+        assert document['data_field'] is None
+        assert document['seed'] == game.seed
+        if not cached:
+            data_field_cache.pop(game.game_id)
+
+        restored = GameService.from_document(document)
+        assert restored.data_field == game.data_field
+        assert restored.field == game.field
+        assert game.game_id in data_field_cache
+
+    def test_trusted_matches_validated(self):
+        game = self.played_game(
+            width=10, height=8, mines_count=10, no_guess_board=(7, 0, 0, 0)
+        )
+        document = game.to_document()
+        legacy = dict(document)
+        del legacy['schema_version']
+
+        trusted = GameService.from_document(document)
+        validated = GameService.from_document(legacy)
+        assert trusted.model_dump() == validated.model_dump()
+        assert trusted.first_click == (0, 0)
+        assert trusted.no_guess_board == (7, 0, 0, 0)
+        assert trusted.response_json() == validated.response_json()
+
+        trusted.open_cell(*divmod(trusted.field.cells.index(b' '), 8))
+        assert trusted._pending_moves and not validated._pending_moves
+
+    def test_baseline_document(self):
+        """
+        Документ первой версии: поля списками строк, без opened и
+        first_click.
+        """
+        game = self.played_game(width=10, height=8, mines_count=10)
+        document = {
+            'game_id': game.game_id,
+            'completed': False,
+            'width': 10,
+            'height': 8,
+            'mines_count': 10,
+            'count_open_cells': game.count_open_cells,
+            'field': game.field.to_lists(),
+            'data_field': game.data_field.to_lists(),
+        }
+        restored = GameService.from_document(dict(document))
+        assert restored.field == game.field
+        assert restored.data_field == game.data_field
+
+        x, y = divmod(game.field.cells.index(b' '), 8)
+        assert restored.open_cell(x, y) == game.open_cell(x, y)
+        assert restored.field == game.field
+
+        new_game = GameService.from_document({
+            **document, 'count_open_cells': 0, 'data_field': None,
+            'field': GameService(width=10, height=8, mines_count=10)
+            .field.to_lists()
+        })
+        assert new_game.data_field is None
+        assert new_game.field.opened_indices() == []
+
+    def test_largest_dense_document_fits(self, monkeypatch):
+        """
+        Самое большое плотное поле со всеми служебными массивами
+        помещается в лимит документа MongoDB.
+        """
+        side = math.isqrt(DENSE_MAX_CELLS)
+        monkeypatch.setattr(app.schemas, 'MAX_WIDTH', side)
+        monkeypatch.setattr(app.schemas, 'MAX_HEIGHT', side)
+        game = GameService(width=side, height=side, mines_count=side)
+        game.open_cell(side // 2, side // 2)
+        document = {
+            **game.to_document(),
+            'field': game.field.to_bson(),
+            'flags': bytes(-(-side * side // 8)),
+        }
+        assert len(bson.encode(document)) < 16 * 1024 * 1024
+
+    def test_chunked_round_trip(self, monkeypatch):
+        monkeypatch.setattr(app.schemas, 'DENSE_MAX_CELLS', 100)
+        game = GameService(width=20, height=15, mines_count=30, seed=2)
+        assert isinstance(game.field, ChunkedBoard)
+        game.open_cell(10, 7)
+        assert json.loads(game.response_json())['field'] is None
+
+        restored = GameService.from_document(game.to_document())
+        assert isinstance(restored.field, ChunkedBoard)
+        assert restored.field == game.field
+        assert restored.count_open_cells == game.count_open_cells
+
+    def test_response_json(self):
+        game = self.played_game(width=10, height=8, mines_count=10)
+        assert json.loads(game.response_json()) == game.model_dump(
+            mode='json', exclude=RESPONSE_EXCLUDE
+        )
+
+
+class TestZeroRegions:
+
+    @pytest.mark.parametrize('seed', range(5))
+    def test_region_matches_bfs(self, seed):
+        game = GameService(width=30, height=20, mines_count=60, seed=seed)
+        game._create_data_field(0, 0)
+        bfs = game.model_copy(deep=True)
+        bfs._zero_regions = None
+
+        zeros = [
+            (x, y) for x in range(30) for y in range(20)
+            if game.data_field[x, y] == '0'
+        ]
+        for x, y in zeros[::7]:
+            if game.field[x, y] == ' ':
+                game._GameService__open_cells(x, y)
+                bfs._GameService__open_cells(x, y)
+                assert game.field == bfs.field
+                assert game.count_open_cells == bfs.count_open_cells
+
+    def test_bson_round_trip(self):
+        game = GameService(width=30, height=30, mines_count=100, seed=1)
+        game._create_data_field(0, 0)
+        regions = game._zero_regions
+        data = regions.to_bson()
+        # 900 ячеек: номера областей в байте, номера ячеек в двух
+        assert len(data['labels']) == 900
+        assert len(data['members']) == 2 * len(regions.members)
+
+        legacy = {
+            key: Binary(getattr(regions, key).astype(np.int32).tobytes())
+            for key in ('labels', 'offsets', 'members')
+        }
+        for restored in map(ZeroRegions.from_bson, (data, legacy)):
+            for key in ('labels', 'offsets', 'members'):
+                assert np.array_equal(
+                    getattr(restored, key), getattr(regions, key)
+                )
+
+
+def chord_position(game: GameService):
+    """
+    Открытая цифра с закрытыми соседями: мины и безопасные ячейки.
+    """
+    for i, cell in enumerate(game.field.cells):
+        x, y = divmod(i, game.height)
+        if not ord('1') <= cell <= ord('8'):
+            continue
+        neighbours = [
+            (nx, ny)
+            for nx in range(max(0, x - 1), min(game.width, x + 2))
+            for ny in range(max(0, y - 1), min(game.height, y + 2))
+            if game.field[nx, ny] == ' '
+        ]
+        mines = [n for n in neighbours if game.data_field[n] == ' ']
+        if len(mines) < len(neighbours):
+            return (x, y), mines, len(neighbours) - len(mines)
+    raise AssertionError('нет цифры с безопасными соседями')
+
+
+class TestActions:
+
+    def test_flag_and_unflag(self):
+        game = GameService(width=10, height=8, mines_count=10, seed=1)
+        game.open_cell(0, 0, 'flag')
+        assert game.flagged(0, 0) and len(game.flags) == 10
+        assert game.version == 1
+        with pytest.raises(MinesWeeperHTTPException) as exc:
+            game.open_cell(0, 0)
+        assert exc.value.detail == Met.error_flagged
+        assert json.loads(game.response_json())['field'][0][0] == 'F'
+
+        game.begin_turn()
+        game.open_cell(0, 0, 'unflag')
+        assert not game.flagged(0, 0)
+        assert game.revealed_cells() == [[0, 0, ' ']]
+
+    def test_flood_fill_skips_flags(self):
+        game = GameService(width=10, height=8, mines_count=10, seed=1)
+        game._create_data_field(0, 0)
+        zero = game.data_field.cells.index(ord('0'))
+        region = game._zero_regions.region(zero)
+        flagged = divmod(int(region[-1]), game.height)
+        game.open_cell(*flagged, 'flag')
+        game.open_cell(*divmod(zero, game.height))
+
+        assert game.field[flagged] == ' '
+        assert game.count_open_cells == len(region) - 1
+
+    def test_flagged_zero_matches_bfs(self):
+        """
+        Нули в один ряд между рядами мин: флаг на нуле делит область.
+        Открытие рядом с ним и после снятия флага дает одно и то же
+        через области и через обход в ширину.
+        """
+        game = GameService(width=8, height=5, mines_count=16)
+        game.data_field = Board.from_lists([
+            [' ', digit, '0', digit, ' ']
+            for digit in '23333332'
+        ])
+        game._zero_regions = ZeroRegions.build(game.data_field)
+        bfs = game.model_copy(deep=True)
+        bfs._zero_regions = None
+
+        for current in (game, bfs):
+            current.open_cell(3, 2, 'flag')
+            current.open_cell(0, 2)
+        assert game.field == bfs.field
+        assert game.field[4, 2] == ' '
+        assert game.count_open_cells == 3 + 2 * 4
+
+        for current in (game, bfs):
+            current.open_cell(3, 2, 'unflag')
+            current.open_cell(5, 2)
+        assert game.field == bfs.field
+        assert game.count_open_cells == bfs.count_open_cells == 8 * 3
+
+    def test_chord(self):
+        game = GameService(width=16, height=16, mines_count=40, seed=3)
+        game.open_cell(8, 8)
+        number, mines, safe = chord_position(game)
+        with pytest.raises(MinesWeeperHTTPException) as exc:
+            game.open_cell(*number, 'chord')
+        assert exc.value.detail == Met.error_chord
+
+        for mine in mines:
+            game.open_cell(*mine, 'flag')
+        version = game.version
+        game.begin_turn()
+        opened = game.open_cell(*number, 'chord')
+        assert opened >= safe
+        assert game.version == version + 1
+        assert all(game.field[mine] == ' ' for mine in mines)
+
+    def test_chord_on_wrong_flag_loses(self):
+        game = GameService(width=16, height=16, mines_count=40, seed=3)
+        game.open_cell(8, 8)
+        number, mines, _ = chord_position(game)
+        wrong = [
+            (x, y)
+            for x in range(number[0] - 1, number[0] + 2)
+            for y in range(number[1] - 1, number[1] + 2)
+            if 0 <= x < 16 and 0 <= y < 16 and game.field[x, y] == ' '
+            and (x, y) not in mines
+        ][:len(mines)]
+        if len(wrong) < len(mines):
+            pytest.skip('мало безопасных соседей для неверных флагов')
+        for cell in wrong:
+            game.open_cell(*cell, 'flag')
+        game.open_cell(*number, 'chord')
+        assert game.completed and not game.won
+
+    def test_flags_round_trip(self):
+        game = GameService(width=10, height=8, mines_count=10, seed=1)
+        game.open_cell(0, 0)
+        closed = game.field.cells.index(ord(' '))
+        game.open_cell(*divmod(closed, 8), 'flag')
+
+        restored = GameService.from_document(game.to_document())
+        assert restored.flags == game.flags
+        assert restored.flagged(*divmod(closed, 8))
@@ -0,0 +1,53 @@
+from httpx import AsyncClient
+
+from app.metrics import Counter, Histogram, error_type, registry
+from app.utils import MinesErrorText as Met
+
+
+class TestMetrics:
+
+    def test_histogram_render(self):
+        histogram = Histogram('test_seconds', 'test', ('op',), (0.1, 1))
+        registry.remove(histogram)
+        histogram.observe(0.05, 'load')
+        histogram.observe(0.5, 'load')
+        histogram.observe(5, 'load')
+
+        lines = list(histogram.render())
+        assert 'test_seconds_bucket{op="load",le="0.1"} 1' in lines
+        assert 'test_seconds_bucket{op="load",le="1"} 2' in lines
+        assert 'test_seconds_bucket{op="load",le="+Inf"} 3' in lines
+        assert 'test_seconds_sum{op="load"} 5.55' in lines
+        assert 'test_seconds_count{op="load"} 3' in lines
+
+    def test_counter_render(self):
+        counter = Counter('test_total', 'test', ('status',))
+        registry.remove(counter)
+        counter.inc('200')
+        counter.inc('200')
+        assert 'test_total{status="200"} 2' in list(counter.render())
+
+    def test_error_type(self):
+        game_id = 'f6a1b0bc-8f0a-4a25-94a8-5e7a2f0f3c43'
+        assert error_type(Met.error_game_id.format(game_id=game_id)) == (
+            'game_id'
+        )
+        assert error_type(Met.error_width) == 'width'
+        assert error_type(Met.error_row.format(w=10)) == 'row'
+        assert error_type('Что-то другое') == 'other'
+
+    async def test_metrics_endpoint(self, ac: AsyncClient):
+        await ac.post(
+            "/api/new", json={"width": 1, "height": 10, "mines_count": 5}
+        )
+        response = await ac.get("/metrics")
+        assert response.status_code == 200
+        assert response.headers['content-type'].startswith('text/plain')
+        assert (
+            'minesweeper_errors_total{route="/api/new",error="width",'
+            'status="400"}' in response.text
+        )
+        assert (
+            'minesweeper_http_requests_total{method="POST",'
+            'route="/api/new",status="400"}' in response.text
+        )
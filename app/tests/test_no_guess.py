@@ -0,0 +1,117 @@
+import time
+
+import pytest
+
+import app.no_guess
+import app.schemas
+from app.board import generate_data_field
+from app.no_guess import (
+    BoardPool, _source_index, build, find_board, is_no_guess, symmetries,
+    transform
+)
+from app.schemas import GameService, data_field_cache
+from app.storage import MemoryStorage
+from app.utils import MinesWeeperHTTPException, MinesErrorText as Met
+from benchmarks.replay import replay
+
+
+@pytest.fixture
+def pool(monkeypatch) -> BoardPool:
+    board_pool = BoardPool([(9, 9, 10)], size=5, workers=0)
+    monkeypatch.setattr(app.no_guess, 'board_pool', board_pool)
+    return board_pool
+
+
+class TestBoards:
+
+    @pytest.mark.parametrize('width, height', [(9, 9), (6, 9)])
+    def test_transform(self, width, height):
+        board = generate_data_field(width, height, 10, 3, 4, 7)
+        for symmetry in symmetries(width, height):
+            moved = transform(board, symmetry)
+            assert moved.cells.count(b' ') == 10
+            for x in range(width):
+                for y in range(height):
+                    source = _source_index(x, y, symmetry, width, height)
+                    assert moved[x, y] == chr(board.cells[source])
+
+    def test_pool_maps_first_click(self, pool: BoardPool):
+        seed, x, y, zeros = find_board(9, 9, 10, 5)
+        pool.put((9, 9, 10), seed, x, y, zeros)
+        # Ячейка из области старта после отражения по x
+        click = divmod(zeros[-1], 9)
+        click = (8 - click[0], click[1])
+
+        layout = pool.take(9, 9, 10, *click)
+        assert layout[:3] == (seed, x, y)
+        assert build(9, 9, 10, layout)[click] == '0'
+        assert pool.take(9, 9, 10, *click) is None
+        assert pool.stats() == {'9x9x10': 0}
+
+
+class TestNoGuessGame:
+
+    def test_game_from_pool(self, pool: BoardPool, monkeypatch):
+        monkeypatch.setattr(app.schemas, 'BOARD_STORAGE', 'seed')
+        seed, x, y, zeros = find_board(9, 9, 10, 5)
+        pool.put((9, 9, 10), seed, x, y, zeros)
+        game = GameService(width=9, height=9, mines_count=10, no_guess=True)
+        game.open_cell(x, y)
+
+        assert game.no_guess_board == (seed, x, y, 0)
+        assert is_no_guess(game.data_field, x, y, time.perf_counter() + 5)
+        data_field_cache.pop(game.game_id)
+        restored = GameService.from_document(game.to_document())
+        assert restored.data_field == game.data_field
+
+    def test_generated_without_pool(self, pool: BoardPool, monkeypatch):
+        # Бюджет с запасом, чтобы тест не зависел от скорости машины
+        monkeypatch.setattr(app.no_guess, 'NO_GUESS_BUDGET', 5)
+        game = GameService(width=9, height=9, mines_count=10, no_guess=True)
+        game.open_cell(4, 4)
+        assert game.no_guess
+        assert game.no_guess_board[1:] == (4, 4, 0)
+        assert game.field[4, 4] == '0'
+
+    def test_falls_back_to_random(self, pool: BoardPool, monkeypatch):
+        monkeypatch.setattr(app.no_guess, 'NO_GUESS_BUDGET', 0)
+        game = GameService(width=9, height=9, mines_count=10, no_guess=True)
+        game.open_cell(4, 4)
+        assert not game.no_guess
+        assert game.no_guess_board is None
+
+    async def test_pool_starts_on_first_game(self, monkeypatch):
+        board_pool = BoardPool([(9, 9, 10)], size=5, workers=1)
+        monkeypatch.setattr(app.no_guess, 'board_pool', board_pool)
+        monkeypatch.setattr(app.no_guess, 'NO_GUESS_BUDGET', 0)
+        try:
+            GameService(width=9, height=9, mines_count=10).open_cell(4, 4)
+            assert board_pool._task is None
+            GameService(
+                width=9, height=9, mines_count=10, no_guess=True
+            ).open_cell(4, 4)
+            assert board_pool._task is not None
+        finally:
+            await board_pool.close()
+
+    def test_pool_needs_event_loop(self):
+        board_pool = BoardPool([(9, 9, 10)], size=5, workers=1)
+        board_pool.start()
+        assert board_pool._task is None
+
+    def test_chunked_board(self, monkeypatch):
+        monkeypatch.setattr(app.schemas, 'DENSE_MAX_CELLS', 50)
+        with pytest.raises(MinesWeeperHTTPException) as exc:
+            GameService(width=9, height=9, mines_count=10, no_guess=True)
+        assert exc.value.detail == Met.error_no_guess_size.format(cells=50)
+
+    async def test_replay(self, pool: BoardPool, monkeypatch):
+        monkeypatch.setattr(app.no_guess, 'NO_GUESS_BUDGET', 5)
+        storage = MemoryStorage()
+        game = GameService(width=9, height=9, mines_count=10, no_guess=True)
+        await game.create_new_game(storage)
+        await game.user_opens_cells(4, 4, storage)
+
+        log = await storage.load_move_log(game.game_id)
+        assert log[1]['no_guess_board'] == list(game.no_guess_board)
+        assert replay(log) == (1, None)
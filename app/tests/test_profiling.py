@@ -0,0 +1,77 @@
+import json
+import os
+
+from fastapi import FastAPI
+from httpx import AsyncClient
+
+import app.profiling
+from app.metrics import Histogram, phases, registry
+from app.profiling import ProfilingMiddleware, rotate
+from benchmarks.profile_report import load, phase_table
+
+
+def profiled_app() -> FastAPI:
+    histogram = Histogram('minesweeper_test_seconds', 'test', ('op',))
+    registry.remove(histogram)
+    test_app = FastAPI()
+
+    @test_app.get('/work')
+    async def work():
+        with histogram.time('load'):
+            sum(range(1000))
+        return {}
+
+    test_app.add_middleware(ProfilingMiddleware)
+    return test_app
+
+
+class TestProfiling:
+
+    def test_phases_only_inside_request(self):
+        histogram = Histogram('minesweeper_test_seconds', 'test', ('op',))
+        registry.remove(histogram)
+        with histogram.time('load'):
+            pass
+
+        request_phases = {}
+        token = phases.set(request_phases)
+        with histogram.time('load'):
+            pass
+        phases.reset(token)
+        assert list(request_phases) == ['test_seconds:load']
+
+    def test_rotate(self, tmp_path):
+        for n in range(5):
+            for suffix in ('.prof', '.json'):
+                path = tmp_path / f'{n}{suffix}'
+                path.write_bytes(b'x' * 10)
+                os.utime(path, (n, n))
+        rotate(str(tmp_path), max_files=3, max_bytes=1000)
+        assert sorted(os.listdir(tmp_path))[0] == '2.json'
+        assert len(os.listdir(tmp_path)) == 6
+
+        rotate(str(tmp_path), max_files=3, max_bytes=25)
+        assert sorted(os.listdir(tmp_path)) == ['4.json', '4.prof']
+
+    async def test_token_header(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(app.profiling, 'PROFILE_DIR', str(tmp_path))
+        monkeypatch.setattr(app.profiling, 'PROFILE_TOKEN', 'secret')
+        monkeypatch.setattr(app.profiling, 'PROFILE_RATE', 0)
+        async with AsyncClient(
+                app=profiled_app(), base_url='http://test'
+        ) as client:
+            await client.get('/work')
+            await client.get('/work', headers={'X-Profile': 'wrong'})
+            assert not os.listdir(tmp_path)
+            await client.get('/work', headers={'X-Profile': 'secret'})
+
+        (path, summary), = load(str(tmp_path), '/work')
+        assert path.endswith('.prof')
+        assert summary['status'] == 200
+        assert 'test_seconds:load' in summary['phases']
+        with open(path.removesuffix('.prof') + '.json') as file:
+            assert json.load(file) == summary
+
+        row, = phase_table([summary])
+        assert row['phase'] == 'test_seconds:load'
+        assert 0 < row['share'] < 1
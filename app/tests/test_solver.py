@@ -0,0 +1,142 @@
+import itertools
+import random
+import time
+
+import app.solver
+from app.board import Board, CLOSED, MINE
+from app.schemas import GameService
+from app.solver import solve, _neighbours
+
+
+def brute_force(cells: bytes, width: int, height: int,
+                mines_count: int) -> dict:
+    """
+    Вероятность мины для каждой закрытой ячейки полным перебором.
+    """
+    closed = [i for i, cell in enumerate(cells) if cell == ord(CLOSED)]
+    mined = dict.fromkeys(closed, 0)
+    total = 0
+    for combination in itertools.combinations(closed, mines_count):
+        mines = set(combination)
+        if all(
+            sum(n in mines for n in _neighbours(i, width, height)) == cell - 48
+            for i, cell in enumerate(cells) if 0x30 <= cell <= 0x38
+        ):
+            total += 1
+            for i in mines:
+                mined[i] += 1
+    return {i: count / total for i, count in mined.items()}
+
+
+def played_game(width: int, height: int, mines_count: int,
+                seed: int, moves: int) -> GameService:
+    game = GameService(
+        width=width, height=height, mines_count=mines_count, seed=seed
+    )
+    rng = random.Random(seed)
+    game.open_cell(rng.randrange(width), rng.randrange(height))
+    for _ in range(moves):
+        safe = [
+            i for i, cell in enumerate(game.field.cells)
+            if cell == ord(CLOSED) and game.data_field.cells[i] != ord(MINE)
+        ]
+        if game.completed or not safe:
+            break
+        game.open_cell(*divmod(rng.choice(safe), height))
+    return game
+
+
+class TestSolver:
+
+    def test_matches_brute_force(self):
+        rng = random.Random(0)
+        checked = 0
+        for seed in range(100):
+            width, height = rng.randint(3, 5), rng.randint(3, 5)
+            mines_count = rng.randint(1, 6)
+            game = played_game(width, height, mines_count, seed, 2)
+            if game.completed:
+                continue
+            cells = bytes(game.field.cells)
+            solution = solve(cells, width, height, mines_count, 1)
+            assert solution.exact
+            for i, expected in brute_force(
+                    cells, width, height, mines_count
+            ).items():
+                if i in solution.safe:
+                    got = 0.0
+                elif i in solution.mines:
+                    got = 1.0
+                else:
+                    got = solution.probabilities.get(i, solution.other)
+                assert abs(got - expected) < 1e-9, (seed, i)
+            checked += 1
+        assert checked > 50
+
+    def test_one_two_one(self):
+        field = Board.from_lists([
+            [CLOSED, CLOSED, CLOSED],
+            ['1', '2', '1'],
+            ['0', '0', '0'],
+        ])
+        solution = solve(bytes(field.cells), 3, 3, 2, 1)
+        assert solution.safe == [1]
+        assert solution.mines == [0, 2]
+        assert solution.best([0, 1, 2]) == 1
+
+    def test_deductions_are_correct(self):
+        for seed in range(20):
+            game = played_game(30, 30, 99, seed, 10)
+            solution = solve(bytes(game.field.cells), 30, 30, 99, 1)
+            mines = game.data_field.cells
+            assert all(mines[i] != ord(MINE) for i in solution.safe)
+            assert all(mines[i] == ord(MINE) for i in solution.mines)
+
+    def test_timeout_is_inexact(self, monkeypatch):
+        monkeypatch.setattr(app.solver, 'MAX_COMPONENT_CELLS', 0)
+        game = played_game(30, 30, 99, 3, 5)
+        solution = solve(bytes(game.field.cells), 30, 30, 99, 1)
+        assert not solution.exact
+        mines = game.data_field.cells
+        assert all(mines[i] != ord(MINE) for i in solution.safe)
+
+    def test_spent_budget_skips_components(self, monkeypatch):
+        calls = []
+        enumerate_component = app.solver._enumerate
+
+        def counted(*args):
+            calls.append(args)
+            return enumerate_component(*args)
+
+        monkeypatch.setattr(app.solver, '_enumerate', counted)
+        game = played_game(30, 30, 99, 3, 5)
+        solution = solve(bytes(game.field.cells), 30, 30, 99, 0)
+        assert not solution.exact
+        assert calls == []
+        mines = game.data_field.cells
+        assert all(mines[i] != ord(MINE) for i in solution.safe)
+
+    def test_fast_on_30x30(self):
+        games = [played_game(30, 30, 99, seed, 10) for seed in range(20)]
+        start = time.perf_counter()
+        for game in games:
+            solve(bytes(game.field.cells), 30, 30, 99, 0.005)
+        assert (time.perf_counter() - start) / len(games) < 0.01
+
+
+class TestHint:
+
+    async def test_before_first_click(self):
+        game = GameService(width=9, height=7, mines_count=10)
+        hint = await game.hint()
+        assert hint.best == (4, 3)
+        assert hint.other_probability == 0
+
+    async def test_hint_is_safe(self, monkeypatch):
+        monkeypatch.setattr(app.solver, 'HINT_WORKERS', 0)
+        game = played_game(16, 16, 40, 5, 3)
+        hint = await game.hint()
+        for row, col in hint.safe:
+            assert game.data_field[row, col] != MINE
+        if hint.safe:
+            assert hint.best == hint.safe[0]
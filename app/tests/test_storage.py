@@ -0,0 +1,430 @@
+import asyncio
+import sqlite3
+from datetime import timedelta
+from typing import List
+
+import bson
+import pytest
+
+import app.schemas
+import app.storage
+from app.board import MINE
+from app.metrics import MOVE_LOG_FAILURES
+from app.schemas import GameService, NewGameParams
+from app.storage import (
+    GameStorage, MemoryStorage, MongoStorage, SQLiteStorage, utcnow
+)
+from app.tests.test_game_service import chord_position
+from app.utils import (
+    GameVersionConflict, MinesWeeperHTTPException, MinesErrorText as Met
+)
+from benchmarks.replay import has_gap, replay
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+async def storage(request, tmp_path) -> GameStorage:
+    if request.param == 'sqlite':
+        backend = SQLiteStorage(str(tmp_path / 'games.sqlite3'))
+    else:
+        backend = MemoryStorage()
+    await backend.setup()
+    yield backend
+    await backend.close()
+
+
+class TestStorage:
+
+    async def test_save_delta(self, storage: GameStorage):
+        await storage.create(
+            {'game_id': 'a', 'version': 0, 'opened_bits': {'0': b'\x80'}}
+        )
+        assert await storage.save_delta(
+            'a', 0, {'version': 1}, {'0': b'\xc0', '2': b'\x01'}
+        )
+        document = await storage.load('a')
+        assert document['version'] == 1
+        assert document['opened_bits'] == {'0': b'\xc0', '2': b'\x01'}
+
+        assert await storage.save_delta(
+            'a', 1, {'version': 2}, {'1': b'\x01'}, replace_opened=True
+        )
+        assert (await storage.load('a'))['opened_bits'] == {'1': b'\x01'}
+
+    async def test_version_conflict(self, storage: GameStorage):
+        await storage.create({'game_id': 'a', 'version': 0, 'opened_bits': {}})
+        assert await storage.save_delta('a', 0, {'version': 1}, {'0': b'1'})
+        assert not await storage.save_delta(
+            'a', 0, {'version': 1}, {'0': b'2'}
+        )
+        assert not await storage.complete('a', 0, {'completed': True})
+        assert (await storage.load('a'))['opened_bits'] == {'0': b'1'}
+
+    async def test_complete(self, storage: GameStorage):
+        await storage.create(
+            {'game_id': 'a', 'version': 0, 'opened_bits': {'0': b'1'}}
+        )
+        assert await storage.complete(
+            'a', 0, {'completed': True, 'version': 1}
+        )
+        document = await storage.load('a')
+        assert document['completed']
+        assert not document.get('opened_bits')
+
+    async def test_archive(self, storage: GameStorage):
+        await storage.create(
+            {'game_id': 'a', 'version': 0, 'opened_bits': {'0': b'1'}}
+        )
+        assert not await storage.archive('a', 5, {'won': True})
+        assert await storage.archive('a', 0, {'won': True, 'moves': 3})
+
+        assert await storage.load('a') is None
+        archived = await storage.find_archived('a')
+        assert archived['won'] and archived['moves'] == 3
+
+    async def test_expire(self, storage: GameStorage):
+        now = utcnow()
+        await storage.create({
+            'game_id': 'old', 'version': 0, 'opened_bits': {},
+            'last_move_at': now - timedelta(days=2)
+        })
+        await storage.create({
+            'game_id': 'new', 'version': 0, 'opened_bits': {},
+            'last_move_at': now
+        })
+        for game_id, at in (('old', now - timedelta(days=2)), ('new', now)):
+            await storage.log_moves(
+                {'game_id': game_id, 'version': 0, 'at': at}
+            )
+        await storage.log_moves({
+            'game_id': 'new', 'version': 1, 'moves': [[0, 0]],
+            'at': now - timedelta(days=2)
+        })
+        assert await storage.expire(now - timedelta(days=1)) == 1
+        assert await storage.load('old') is None
+        assert await storage.load('new') is not None
+        # Записи журнала живут GAME_TTL с момента записи
+        assert await storage.load_move_log('old') == []
+        assert [
+            entry['version'] for entry in await storage.load_move_log('new')
+        ] == [0]
+
+    async def test_stats(self, storage: GameStorage, monkeypatch):
+        monkeypatch.setattr(app.storage, 'STATS_LEADERBOARD_SIZE', 2)
+        for n, (won, duration) in enumerate(
+                [(True, 50), (False, 5), (True, 20), (True, 700)]
+        ):
+            await storage.record_result({
+                'game_id': str(n), 'won': won, 'width': 9, 'height': 9,
+                'mines_count': 10, 'moves': n, 'duration': duration,
+                'completed_at': utcnow().replace(microsecond=0),
+            })
+
+        stats, = await storage.load_stats()
+        assert (stats['played'], stats['wins'], stats['losses']) == (4, 3, 1)
+        assert stats['duration_sum'] == 775
+        assert stats['durations'] == {'10': 1, '30': 1, '60': 1, '1800': 1}
+        assert [entry['game_id'] for entry in stats['leaderboard']] == [
+            '2', '0'
+        ]
+
+    async def test_missing_game(self, storage: GameStorage):
+        assert await storage.load('missing') is None
+        assert not await storage.save_delta('missing', 0, {}, [])
+
+
+class TestGameServiceStorage:
+
+    async def test_turns_round_trip(self, storage: GameStorage):
+        game = GameService(width=10, height=8, mines_count=10)
+        await game.create_new_game(storage)
+        await game.user_opens_cells(0, 0, storage)
+
+        restored = await GameService.game_from_db(game.game_id, storage)
+        assert restored.field == game.field
+        assert restored.data_field == game.data_field
+        assert restored.version == game.version
+
+    async def test_stale_game_conflicts(self, storage: GameStorage):
+        game = GameService(width=10, height=8, mines_count=10)
+        await game.create_new_game(storage)
+        stale = await GameService.game_from_db(game.game_id, storage)
+        await game.user_opens_cells(0, 0, storage)
+
+        with pytest.raises(GameVersionConflict):
+            await stale.user_opens_cells(0, 0, storage)
+
+    async def test_archived_game_is_completed(
+            self, storage: GameStorage, monkeypatch
+    ):
+        monkeypatch.setattr(app.schemas, 'ARCHIVE_COMPLETED', True)
+        game = GameService(width=10, height=8, mines_count=10)
+        await game.create_new_game(storage)
+        await game.user_opens_cells(0, 0, storage)
+        mine = game.data_field.cells.index(ord(MINE))
+        await game.user_opens_cells(*divmod(mine, game.height), storage)
+
+        archived = await storage.find_archived(game.game_id)
+        assert archived['won'] is False
+        assert archived['moves'] == 2
+        assert (archived['width'], archived['height']) == (10, 8)
+        with pytest.raises(MinesWeeperHTTPException) as exc:
+            await GameService.game_from_db(game.game_id, storage)
+        assert exc.value.detail == Met.error_completed
+
+    async def test_legacy_opened_dropped(self, storage: GameStorage):
+        """
+        Первая запись хода игры со старым списком opened переносит все
+        открытые ячейки в opened_bits и удаляет список.
+        """
+        game = GameService(width=10, height=8, mines_count=10, seed=1)
+        await game.create_new_game(storage)
+        await game.user_opens_cells(0, 0, storage)
+        opened = [
+            i for i, cell in enumerate(game.field.cells) if cell != ord(' ')
+        ]
+        if isinstance(storage, SQLiteStorage):
+            storage._connection.execute(
+                'DELETE FROM opened_bits WHERE game_id = ?', (game.game_id,)
+            )
+            storage._connection.executemany(
+                'INSERT INTO opened (game_id, cell) VALUES (?, ?)',
+                ((game.game_id, cell) for cell in opened)
+            )
+            storage._connection.commit()
+        else:
+            document = storage.games[game.game_id]
+            document['opened'] = opened
+            document['opened_bits'] = {}
+
+        restored = await GameService.game_from_db(game.game_id, storage)
+        assert restored.field == game.field
+        x, y = next(
+            divmod(i, game.height)
+            for i, cell in enumerate(game.data_field.cells)
+            if cell != ord(MINE) and game.field.cells[i] == ord(' ')
+        )
+        await restored.user_opens_cells(x, y, storage)
+
+        document = await storage.load(game.game_id)
+        assert 'opened' not in document
+        assert document['opened_bits'] == restored.field.opened_bits()
+        reloaded = await GameService.game_from_db(game.game_id, storage)
+        assert reloaded.field == restored.field
+
+    async def test_move_log(self, storage: GameStorage):
+        game = GameService(width=10, height=8, mines_count=10)
+        await game.create_new_game(storage)
+        await game.user_opens_cells(0, 0, storage)
+
+        header, entry = await storage.load_move_log(game.game_id)
+        assert header['seed'] == game.seed
+        assert entry['moves'] == [[0, 0]]
+        assert entry['version'] == 1
+        assert await storage.logged_games(10) == [game.game_id]
+
+    async def test_move_log_failure(self, storage: GameStorage, monkeypatch):
+        game = GameService(width=10, height=8, mines_count=10)
+        await game.create_new_game(storage)
+
+        async def broken(entry: dict):
+            raise ConnectionError
+
+        failures = MOVE_LOG_FAILURES.values.get((), 0)
+        with monkeypatch.context() as patch:
+            patch.setattr(storage, 'log_moves', broken)
+            await game.user_opens_cells(0, 0, storage)
+        assert MOVE_LOG_FAILURES.values[()] == failures + 1
+
+        # Ход записан, в журнале пропуск
+        restored = await GameService.game_from_db(game.game_id, storage)
+        assert restored.version == 1
+        await restored.user_opens_cells(*divmod(
+            restored.field.cells.index(b' '), restored.height
+        ), storage)
+        assert has_gap(await storage.load_move_log(game.game_id))
+
+    async def test_move_during_save(self, storage: GameStorage, monkeypatch):
+        """
+        Ход, пришедший в игру, пока ее запись ждет хранилище, уходит
+        следующей записью, а не ломает проверку версии.
+        """
+        game = GameService(width=10, height=8, mines_count=10, seed=1)
+        await game.create_new_game(storage)
+        game.open_cell(0, 0)
+        closed = [
+            divmod(i, game.height) for i, cell in enumerate(game.field.cells)
+            if cell == ord(' ') and game.data_field.cells[i] != ord(MINE)
+        ]
+
+        release = asyncio.Event()
+        save_delta = storage.save_delta
+
+        async def slow_save_delta(*args, **kwargs):
+            await release.wait()
+            return await save_delta(*args, **kwargs)
+
+        monkeypatch.setattr(storage, 'save_delta', slow_save_delta)
+        saving = asyncio.create_task(game.save(storage))
+        await asyncio.sleep(0)
+        game.open_cell(*closed[0])
+        release.set()
+        await saving
+        assert (await storage.load(game.game_id))['version'] == 1
+
+        await game.save(storage)
+        restored = await GameService.game_from_db(game.game_id, storage)
+        assert restored.version == game.version == 2
+        assert restored.field == game.field
+        log = await storage.load_move_log(game.game_id)
+        assert not has_gap(log) and replay(log)[1] is None
+
+    async def test_create_many(self, storage: GameStorage):
+        games = GameService.new_games(
+            [NewGameParams(width=10, height=8, mines_count=10)] * 3
+        )
+        assert len({game.seed for game in games}) == 3
+        created = await GameService.create_new_games(games, storage)
+        assert created == [game.game_id for game in games]
+
+        restored = await GameService.game_from_db(created[1], storage)
+        await restored.user_opens_cells(0, 0, storage)
+        header, entry = await storage.load_move_log(created[1])
+        assert header['seed'] == games[1].seed
+        assert entry['version'] == 1
+
+    async def test_game_stats(self, storage: GameStorage):
+        game = GameService(width=10, height=8, mines_count=10)
+        await game.create_new_game(storage)
+        await game.user_opens_cells(0, 0, storage)
+        mine = game.data_field.cells.index(ord(MINE))
+        await game.user_opens_cells(*divmod(mine, game.height), storage)
+
+        stats, = (await GameService.stats(storage)).configs
+        assert (stats.width, stats.height, stats.mines_count) == (10, 8, 10)
+        assert (stats.played, stats.losses, stats.win_rate) == (1, 1, 0)
+        assert sum(stats.durations.values()) == 1
+        assert list(stats.durations)[-1] == '+Inf'
+        assert not stats.leaderboard
+
+    async def test_flags_and_chord(self, storage: GameStorage):
+        game = GameService(width=16, height=16, mines_count=40, seed=3)
+        await game.create_new_game(storage)
+        await game.user_opens_cells(8, 8, storage)
+        number, mines, _ = chord_position(game)
+        for mine in mines:
+            await game.user_opens_cells(*mine, storage, 'flag')
+        await game.user_opens_cells(*number, storage, 'chord')
+
+        restored = await GameService.game_from_db(game.game_id, storage)
+        assert restored.flags == game.flags
+        assert restored.field == game.field
+        log = await storage.load_move_log(game.game_id)
+        assert log[-1]['moves'] == [[*number, 'chord']]
+        assert replay(log)[1] is None
+
+
+class FakeStats:
+    """
+    Коллекция stats с документами в том виде, в каком их хранит Mongo.
+    """
+
+    def __init__(self, documents: List[dict]):
+        self.documents = documents
+        self.updates = []
+
+    def find(self, *args):
+        documents = self.documents
+
+        class Cursor:
+            async def to_list(self, length):
+                return [dict(document) for document in documents]
+        return Cursor()
+
+    async def update_one(self, key: dict, update: dict, upsert: bool):
+        self.updates.append(update)
+
+
+class TestMongoStats:
+
+    @pytest.fixture
+    def collection(self, monkeypatch) -> FakeStats:
+        collection = FakeStats([
+            # Только поражения: без wins и leaderboard
+            {
+                'width': 9, 'height': 9, 'mines_count': 10, 'played': 2,
+                'losses': 2, 'duration_sum': 30, 'durations': {'30': 2},
+            },
+            # Только победы, корзина 0.5 записана вложенным путем
+            {
+                'width': 16, 'height': 16, 'mines_count': 40, 'played': 3,
+                'wins': 3, 'duration_sum': 1.5,
+                'durations': {'0': {'5': 1}, '0_5': 1, '10': 1},
+                'leaderboard': [{
+                    'game_id': 'a', 'duration': 0.4, 'moves': 5,
+                    'completed_at': utcnow().replace(microsecond=0),
+                }],
+            },
+        ])
+        monkeypatch.setattr(
+            MongoStorage, 'stats', property(lambda _: collection)
+        )
+        return collection
+
+    async def test_one_sided_configs(self, collection: FakeStats):
+        wins, losses = (await GameService.stats(MongoStorage(None))).configs
+        assert (losses.width, losses.wins, losses.losses) == (9, 0, 2)
+        assert losses.leaderboard == []
+        assert (wins.width, wins.wins, wins.losses) == (16, 3, 0)
+        assert wins.win_rate == 1
+        assert wins.durations['0.5'] == 2
+        assert wins.durations['10'] == 1
+
+    async def test_update_shape(self, collection: FakeStats, monkeypatch):
+        monkeypatch.setattr(app.storage, 'STATS_DURATION_BUCKETS', [0.5, 10])
+        storage = MongoStorage(None)
+        for won in (False, True):
+            await storage.record_result({
+                'game_id': 'a', 'won': won, 'width': 9, 'height': 9,
+                'mines_count': 10, 'moves': 3, 'duration': 0.2,
+                'completed_at': utcnow(),
+            })
+        loss, win = collection.updates
+        # Оба счетчика в каждом $inc, ключи корзин без точек
+        assert loss['$inc']['wins'] == 0 and loss['$inc']['losses'] == 1
+        assert win['$inc']['wins'] == 1 and win['$inc']['losses'] == 0
+        assert 'durations.0_5' in loss['$inc']
+        assert loss['$setOnInsert']['leaderboard'] == []
+        assert 'leaderboard' not in win['$setOnInsert']
+        assert 'leaderboard' in win['$push']
+
+
+class TestSQLiteStorage:
+
+    async def test_moves_without_at(self, tmp_path):
+        path = str(tmp_path / 'games.sqlite3')
+        connection = sqlite3.connect(path)
+        connection.execute(
+            'CREATE TABLE moves (game_id TEXT NOT NULL, '
+            'version INTEGER NOT NULL, entry BLOB NOT NULL)'
+        )
+        connection.execute(
+            'INSERT INTO moves VALUES (?, 0, ?)',
+            ('a', bson.encode({'game_id': 'a', 'version': 0}))
+        )
+        connection.commit()
+        connection.close()
+
+        storage = SQLiteStorage(path)
+        await storage.setup()
+        try:
+            await storage.log_moves(
+                {'game_id': 'a', 'version': 1, 'moves': [], 'at': utcnow()}
+            )
+            await storage.expire(utcnow() + timedelta(days=1))
+            # Записи без времени не удаляются по сроку
+            assert [
+                entry['version']
+                for entry in await storage.load_move_log('a')
+            ] == [0]
+        finally:
+            await storage.close()
@@ -2,6 +2,8 @@ from typing_extensions import Annotated, Doc
 
 from fastapi import HTTPException, status
 
+from app.config import MAX_HEIGHT, MAX_WIDTH
+
 
 class MinesWeeperHTTPException(HTTPException):
 
@@ -15,17 +17,28 @@ class MinesWeeperHTTPException(HTTPException):
                 """
             ),
         ],
+        status_code: int = status.HTTP_400_BAD_REQUEST,
     ) -> None:
         super().__init__(
-            status_code=status.HTTP_400_BAD_REQUEST,
+            status_code=status_code,
             detail=error,
             headers=None
         )
 
 
+class GameVersionConflict(MinesWeeperHTTPException):
+    """
+    Игру между чтением и записью изменил другой процесс.
+    """
+
+    def __init__(self, error: str) -> None:
+        super().__init__(error=error, status_code=status.HTTP_409_CONFLICT)
+
+
 class MinesErrorText:
-    error_width = 'Ширина поля должна быть не менее 2 и не более 30'
-    error_height = 'Высота поля должна быть не менее 2 и не более 30'
+    error_width = f'Ширина поля должна быть не менее 2 и не более {MAX_WIDTH}'
+    error_height = ('Высота поля должна быть не менее 2 и '
+                    f'не более {MAX_HEIGHT}')
     error_mines_count = ('Количество мин должно быть не менее 1 и '
                          'строго менее количества ячеек {cells}')
 
@@ -36,3 +49,19 @@ class MinesErrorText:
     error_open_cell = 'Уже открытая ячейка'
     error_form_game_id = 'Некорректный формат идентификатора игры'
     error_game_id = 'Нет игры с идентификатором {game_id}'
+    error_moves_count = 'Количество ходов должно быть от 1 до {max}'
+    error_games_count = 'Количество игр должно быть от 1 до {max}'
+    error_games_format = ('Нужны width, height и mines_count с count '
+                          'или список games')
+    error_move_format = 'Ход должен быть объектом с полями row и col'
+    error_flagged = 'Ячейка отмечена флагом'
+    error_not_flagged = 'Ячейка не отмечена флагом'
+    error_chord = ('Открыть соседей можно только у открытой цифры, вокруг '
+                   'которой столько же флагов')
+    error_flags_size = ('Флаги доступны для полей не более '
+                        '{cells} ячеек')
+    error_conflict = 'Игра изменена другим запросом, повторите ход'
+    error_hint_size = ('Подсказка доступна для полей не более '
+                       '{cells} ячеек')
+    error_no_guess_size = ('Поле без угадывания можно создать не более '
+                           'чем из {cells} ячеек')
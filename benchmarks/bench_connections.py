@@ -0,0 +1,97 @@
+"""
+Сколько соединений с Mongo открывается на один ход.
+
+Сравниваются два режима:
+- per_call: как было раньше, новый AsyncIOMotorClient на каждый вызов
+  get_db() (на один /api/turn приходилось три вызова);
+- pooled: общий клиент процесса из app.database.
+
+Нужна запущенная Mongo (docker-compose up mongo).
+
+    python -m benchmarks.bench_connections --requests 200
+"""
+import argparse
+import asyncio
+import time
+import uuid
+
+from pymongo import monitoring
+
+from app.database import close_db, create_client, get_db
+
+# Столько раз старый код вызывал get_db() за один /api/turn
+CALLS_PER_TURN = 3
+
+
+class ConnectionCounter(monitoring.ConnectionPoolListener):
+    created = 0
+
+    def connection_created(self, event):
+        self.created += 1
+
+    def pool_created(self, event): pass
+    def pool_ready(self, event): pass
+    def pool_cleared(self, event): pass
+    def pool_closed(self, event): pass
+    def connection_ready(self, event): pass
+    def connection_closed(self, event): pass
+    def connection_check_out_started(self, event): pass
+    def connection_check_out_failed(self, event): pass
+    def connection_checked_out(self, event): pass
+    def connection_checked_in(self, event): pass
+
+
+async def turn_per_call(game_id: str):
+    clients = []
+    for _ in range(CALLS_PER_TURN):
+        client = create_client()
+        clients.append(client)
+        await client["minesweeper"].mongodb["games"].find_one(
+            {'game_id': game_id}
+        )
+    for client in clients:
+        client.close()
+
+
+async def turn_pooled(game_id: str):
+    for _ in range(CALLS_PER_TURN):
+        db = await get_db()
+        await db.mongodb["games"].find_one({'game_id': game_id})
+
+
+async def run(mode: str, requests: int, concurrency: int) -> dict:
+    counter = ConnectionCounter()
+    monitoring.register(counter)
+    turn = turn_per_call if mode == 'per_call' else turn_pooled
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            await turn(str(uuid.uuid4()))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    elapsed = time.perf_counter() - start
+    await close_db()
+    return {
+        'mode': mode,
+        'requests': requests,
+        'connections': counter.created,
+        'connections_per_request': counter.created / requests,
+        'seconds': round(elapsed, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=20)
+    args = parser.parse_args()
+    # Слушатели pymongo регистрируются глобально, поэтому каждый режим
+    # в своем event loop и со своим счетчиком
+    for mode in ('per_call', 'pooled'):
+        print(asyncio.run(run(mode, args.requests, args.concurrency)))
+
+
+if __name__ == '__main__':
+    main()
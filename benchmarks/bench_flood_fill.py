@@ -0,0 +1,81 @@
+"""
+Открытие нулевой ячейки: обход в ширину против заранее посчитанных
+областей нулей. Бд не нужна.
+
+    python -m benchmarks.bench_flood_fill
+"""
+import argparse
+import time
+
+import app.schemas
+from app.schemas import GameService
+
+# Ширина, высота и доля мин
+BOARDS = (
+    (30, 30, 0.05),
+    (30, 30, 0.12),
+    (300, 300, 0.05),
+    (1000, 1000, 0.05),
+)
+# Большие поля в бенчмарке разрешаем без MAX_WIDTH и MAX_HEIGHT в env
+app.schemas.MAX_WIDTH = app.schemas.MAX_HEIGHT = 1000
+
+
+def biggest_zero(game: GameService) -> tuple[int, int]:
+    regions = game._zero_regions
+    sizes = regions.offsets[1:] - regions.offsets[:-1]
+    label = int(sizes.argmax())
+    index = int((regions.labels == label).nonzero()[0][0])
+    return divmod(index, game.height)
+
+
+def make_game(width: int, height: int, density: float) -> GameService:
+    game = GameService(
+        width=width, height=height,
+        mines_count=max(1, int(width * height * density)), seed=1,
+    )
+    game._create_data_field(0, 0)
+    return game
+
+
+def measure(game: GameService, x: int, y: int, repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        trial = game.model_copy(deep=True)
+        start = time.perf_counter()
+        trial._GameService__open_cells(x, y)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    for width, height, density in BOARDS:
+        start = time.perf_counter()
+        game = make_game(width, height, density)
+        build = time.perf_counter() - start
+        x, y = biggest_zero(game)
+
+        region = measure(game, x, y, args.repeat)
+        bfs_game = game.model_copy(deep=True)
+        bfs_game._zero_regions = None
+        bfs = measure(bfs_game, x, y, args.repeat)
+
+        trial = game.model_copy(deep=True)
+        trial._GameService__open_cells(x, y)
+        print({
+            'board': f'{width}x{height}',
+            'density': density,
+            'cells_opened': trial.count_open_cells,
+            'generate_and_index_ms': round(build * 1000, 3),
+            'bfs_ms': round(bfs * 1000, 3),
+            'region_ms': round(region * 1000, 3),
+            'speedup': round(bfs / region, 1),
+        })
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Сводка по профилям запросов из PROFILE_DIR (см. app/profiling.py):
+топ функций по собственному или накопленному времени по всем профилям
+вместе и среднее, p95 и доля каждого этапа во времени ответа.
+
+    python -m benchmarks.profile_report --top 20
+    python -m benchmarks.profile_report --route /api/turn --sort cumulative
+"""
+import argparse
+import glob
+import json
+import os
+import pstats
+import sys
+from collections import defaultdict
+
+from app.config import PROFILE_DIR
+
+
+def load(directory: str, route: str | None) -> list[tuple[str, dict]]:
+    """
+    Профили с их сводками, только для маршрута route, если он задан.
+    """
+    profiles = []
+    for path in sorted(glob.glob(os.path.join(directory, '*.prof'))):
+        try:
+            with open(path.removesuffix('.prof') + '.json',
+                      encoding='utf-8') as file:
+                summary = json.load(file)
+        except FileNotFoundError:
+            continue
+        if route is None or summary['route'] == route:
+            profiles.append((path, summary))
+    return profiles
+
+
+def phase_table(summaries: list[dict]) -> list[dict]:
+    """
+    Этапы по убыванию среднего времени на запрос. Этап, которого не было
+    в запросе, считается за 0.
+    """
+    values = defaultdict(list)
+    for summary in summaries:
+        for name, seconds in summary['phases'].items():
+            values[name].append(seconds)
+    total = sum(summary['seconds'] for summary in summaries)
+    rows = []
+    for name, seconds in values.items():
+        seconds = sorted(seconds + [0.0] * (len(summaries) - len(seconds)))
+        rows.append({
+            'phase': name,
+            'mean_ms': sum(seconds) / len(seconds) * 1000,
+            'p95_ms': seconds[min(len(seconds) - 1,
+                                  int(0.95 * len(seconds)))] * 1000,
+            'share': sum(seconds) / total if total else 0.0,
+        })
+    return sorted(rows, key=lambda row: row['mean_ms'], reverse=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dir', default=PROFILE_DIR)
+    parser.add_argument('--route', help='шаблон пути, например /api/turn')
+    parser.add_argument('--top', type=int, default=20)
+    parser.add_argument('--sort', choices=('tottime', 'cumulative'),
+                        default='tottime')
+    args = parser.parse_args()
+
+    profiles = load(args.dir, args.route)
+    if not profiles:
+        print(f'Нет профилей в {args.dir}', file=sys.stderr)
+        sys.exit(1)
+
+    summaries = [summary for _, summary in profiles]
+    latencies = sorted(summary['seconds'] for summary in summaries)
+    print(
+        f'Запросов: {len(summaries)}, среднее '
+        f'{sum(latencies) / len(latencies) * 1000:.3f} ms, максимум '
+        f'{latencies[-1] * 1000:.3f} ms'
+    )
+    print(f"\n{'этап':<45} {'mean ms':>10} {'p95 ms':>10} {'доля':>7}")
+    for row in phase_table(summaries):
+        print(
+            f"{row['phase']:<45} {row['mean_ms']:>10.3f} "
+            f"{row['p95_ms']:>10.3f} {row['share']:>7.1%}"
+        )
+    print()
+
+    stats = pstats.Stats(*(path for path, _ in profiles))
+    stats.strip_dirs().sort_stats(args.sort).print_stats(args.top)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+Повтор записанных игр из журнала ходов через GameService без записи в
+хранилище. После каждой записи журнала сверяет version, число открытых
+ячеек и completed с записанными, так что расхождение означает, что
+движок или генерация поля перестали быть детерминированными. Заодно
+меряет скорость движка на реальных ходах. Игры с пропусками в журнале
+(запись журнала не удалась) не повторяются, а только считаются.
+
+Хранилище берется из STORAGE_BACKEND, как у сервиса.
+
+    python -m benchmarks.replay --games 1000
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from typing import List
+
+from app.schemas import GameService
+from app.storage import close_storage, get_storage
+from app.utils import MinesWeeperHTTPException
+
+
+def has_gap(log: List[dict]) -> bool:
+    """
+    Каждый ход увеличивает version на один, поэтому записи журнала без
+    пропусков идут встык.
+    """
+    version = 0
+    for entry in log[1:]:
+        if entry['version'] - len(entry['moves']) != version:
+            return True
+        version = entry['version']
+    return False
+
+
+def replay(log: List[dict]) -> tuple[int, str | None]:
+    """
+    Повторяет ходы одной игры.
+    :return: сколько ходов повторено и описание расхождения
+    """
+    header, *entries = log
+    game = GameService(
+        game_id=header['game_id'], width=header['width'],
+        height=header['height'], mines_count=header['mines_count'],
+        seed=header['seed']
+    )
+    moves = 0
+    for entry in entries:
+        if 'no_guess_board' in entry:
+            game.no_guess_board = tuple(entry['no_guess_board'])
+        game.begin_turn()
+        try:
+            for move in entry['moves']:
+                game.open_cell(*move)
+                moves += 1
+        except MinesWeeperHTTPException as exc:
+            return moves, f"version {entry['version']}: {exc.detail}"
+        replayed = (game.version, game.count_open_cells, game.completed)
+        recorded = (
+            entry['version'], entry['count_open_cells'], entry['completed']
+        )
+        if replayed != recorded:
+            return moves, f'{recorded} != {replayed}'
+    return moves, None
+
+
+async def run(args) -> dict:
+    storage = await get_storage()
+    try:
+        game_ids = await storage.logged_games(args.games)
+        logs = [await storage.load_move_log(game_id) for game_id in game_ids]
+    finally:
+        await close_storage()
+
+    logs = [log for log in logs if log and log[0]['version'] == 0]
+    incomplete = [log[0]['game_id'] for log in logs if has_gap(log)]
+    logs = [log for log in logs if not has_gap(log)]
+    mismatches = {}
+    total_moves = 0
+    start = time.perf_counter()
+    for log in logs:
+        moves, mismatch = replay(log)
+        total_moves += moves
+        if mismatch:
+            mismatches[log[0]['game_id']] = mismatch
+    elapsed = time.perf_counter() - start
+
+    return {
+        'games': len(logs),
+        'moves': total_moves,
+        'seconds': elapsed,
+        'moves_per_second': total_moves / elapsed if elapsed else 0.0,
+        'mismatches': mismatches,
+        'incomplete': incomplete,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--games', type=int, default=1000,
+                        help='сколько последних игр повторить')
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if report['mismatches']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,396 @@
+"""
+Набор бенчмарков движка и нагрузочный тест API без docker и Mongo.
+
+Микробенчмарки: генерация поля (_create_data_field), открытие ячеек
+(__open_cells) и ходы с победой и проигрышем (user_opens_cells) на разных
+размерах полей и плотностях мин. Нагрузочный тест гоняет /api/new,
+/api/turn и /api/new/batch через httpx по ASGI с хранилищем в памяти
+(--backend memory или sqlite), без docker и Mongo.
+
+Сериализация на поле 30x30: загрузка игры из документа с валидацией
+(документ старого формата) и без нее (schema_version), ответ /api/turn
+через response_model FastAPI и через GameService.response_json.
+
+Результат пишется в JSON: на каждый замер throughput, p50, p95, p99.
+С --compare сравнивает с прошлым прогоном и падает с кодом 1, если p50
+вырос больше чем на --threshold.
+
+    python -m benchmarks.suite --output bench.json
+    python -m benchmarks.suite --compare bench.json --quick
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from typing import Awaitable, Callable
+
+import numpy as np
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+from httpx import AsyncClient
+
+import app.schemas
+from app.board import CLOSED, MINE
+from app.schemas import GameService, RESPONSE_EXCLUDE
+from app.storage import (
+    GameStorage, MemoryStorage, SQLiteStorage, get_storage
+)
+from main import app as asgi_app
+
+# Ширина, высота, количество мин
+BOARDS = (
+    (9, 9, 10),
+    (16, 16, 40),
+    (30, 16, 99),
+    (30, 30, 90),
+    (30, 30, 270),
+    (100, 100, 1000),
+    (300, 300, 9000),
+)
+QUICK_BOARDS = BOARDS[:4]
+
+# Поля больше 30x30 в бенчмарке разрешаем без MAX_WIDTH и MAX_HEIGHT в env
+app.schemas.MAX_WIDTH = app.schemas.MAX_HEIGHT = max(
+    max(w, h) for w, h, _ in BOARDS
+)
+
+
+def summary(name: str, params: dict, latencies: list[float],
+            elapsed: float) -> dict:
+    """
+    Сводка замера: latencies в секундах на операцию.
+    """
+    ordered = sorted(latencies)
+
+    def percentile(p: float) -> float:
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000
+
+    return {
+        'name': name,
+        'params': params,
+        'iterations': len(latencies),
+        'throughput': len(latencies) / elapsed if elapsed else 0.0,
+        'mean_ms': statistics.fmean(latencies) * 1000,
+        'p50_ms': percentile(0.50),
+        'p95_ms': percentile(0.95),
+        'p99_ms': percentile(0.99),
+    }
+
+
+async def measure(name: str, params: dict, iterations: int,
+                  setup: Callable[[], object],
+                  run: Callable[[object], Awaitable | None]) -> dict:
+    latencies = []
+    total = 0.0
+    for _ in range(iterations):
+        state = setup()
+        if asyncio.iscoroutine(state):
+            state = await state
+        start = time.perf_counter()
+        result = run(state)
+        if asyncio.iscoroutine(result):
+            await result
+        latency = time.perf_counter() - start
+        latencies.append(latency)
+        total += latency
+    return summary(name, params, latencies, total)
+
+
+def new_game(width: int, height: int, mines: int, seed: int) -> GameService:
+    return GameService(
+        width=width, height=height, mines_count=mines, seed=seed
+    )
+
+
+async def played_game(storage: GameStorage, width: int, height: int,
+                      mines: int, seed: int) -> GameService:
+    """
+    Записанная в хранилище игра после первого хода в центр.
+    """
+    game = new_game(width, height, mines, seed)
+    await game.create_new_game(storage)
+    await game.user_opens_cells(width // 2, height // 2, storage)
+    return game
+
+
+async def micro_benchmarks(storage: GameStorage, boards,
+                           iterations: int) -> list[dict]:
+    results = []
+    seeds = iter(range(10 ** 9))
+    for width, height, mines in boards:
+        params = {'width': width, 'height': height, 'mines_count': mines}
+        runs = max(3, iterations * 900 // (width * height))
+
+        results.append(await measure(
+            'create_data_field', params, runs,
+            lambda: new_game(width, height, mines, next(seeds)),
+            lambda game: game._create_data_field(width // 2, height // 2)
+        ))
+
+        def opening_setup():
+            game = new_game(width, height, mines, next(seeds))
+            game._create_data_field(width // 2, height // 2)
+            return game
+
+        results.append(await measure(
+            'open_cells', params, runs, opening_setup,
+            lambda game: game._GameService__open_cells(
+                width // 2, height // 2
+            )
+        ))
+
+        async def lose_setup():
+            game = await played_game(
+                storage, width, height, mines, next(seeds)
+            )
+            mine = game.data_field.cells.index(ord(MINE))
+            return game, divmod(mine, height)
+
+        results.append(await measure(
+            'user_opens_cells_lose', params, runs, lose_setup,
+            lambda state: state[0].user_opens_cells(*state[1], storage)
+        ))
+
+        async def win_setup():
+            """
+            Игра, где закрыта одна безопасная ячейка. Если область нулей
+            открыла все поле раньше, берем следующее зерно.
+            """
+            while True:
+                game = await played_game(
+                    storage, width, height, mines, next(seeds)
+                )
+                goal = width * height - mines - 1
+                for i, cell in enumerate(game.data_field.cells):
+                    if game.completed or game.count_open_cells == goal:
+                        break
+                    x, y = divmod(i, height)
+                    if cell != ord(MINE) and game.field[x, y] == CLOSED:
+                        game.open_cell(x, y)
+                if not game.completed:
+                    await game.save(storage)
+                    index = next(
+                        i for i, cell in enumerate(game.data_field.cells)
+                        if cell != ord(MINE)
+                        and game.field.cells[i] == ord(CLOSED)
+                    )
+                    return game, divmod(index, height)
+
+        results.append(await measure(
+            'user_opens_cells_win', params, runs, win_setup,
+            lambda state: state[0].user_opens_cells(*state[1], storage)
+        ))
+    return results
+
+
+async def serialization_benchmarks(storage: GameStorage,
+                                   iterations: int) -> list[dict]:
+    """
+    Загрузка игры из документа и ответ с полем 30x30 по обоим путям.
+    """
+    results = []
+    params = {'width': 30, 'height': 30, 'mines_count': 90}
+    game = await played_game(storage, 30, 30, 90, 1)
+    document = await storage.load(game.game_id)
+    legacy = {k: v for k, v in document.items() if k != 'schema_version'}
+    runs = iterations * 20
+
+    for mode, source in (('validated', legacy), ('trusted', document)):
+        results.append(await measure(
+            'load_document', {**params, 'mode': mode}, runs,
+            lambda: dict(source), GameService.from_document
+        ))
+
+    field = create_response_field(
+        name='response', type_=GameService, mode='serialization'
+    )
+
+    async def generic(state: GameService):
+        content = await serialize_response(
+            field=field, response_content=state, exclude=RESPONSE_EXCLUDE,
+            is_coroutine=True
+        )
+        return JSONResponse(content).body
+
+    results.append(await measure(
+        'encode_response', {**params, 'mode': 'response_model'}, runs,
+        lambda: game, generic
+    ))
+    results.append(await measure(
+        'encode_response', {**params, 'mode': 'response_json'}, runs,
+        lambda: game, GameService.response_json
+    ))
+    return results
+
+
+async def load_test(storage: GameStorage, games: int, concurrency: int,
+                    moves: int) -> list[dict]:
+    """
+    Клиенты параллельно создают игры 16x16, затем делают ходы по
+    случайным закрытым ячейкам до конца игры или до moves ходов.
+    """
+    async def bench_storage():
+        return storage
+
+    asgi_app.dependency_overrides[get_storage] = bench_storage
+    new_latencies, turn_latencies = [], []
+    semaphore = asyncio.Semaphore(concurrency)
+    rng = np.random.default_rng(0)
+
+    async def new_game(client: AsyncClient) -> dict:
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.post('/api/new', json={
+                'width': 16, 'height': 16, 'mines_count': 40
+            })
+            new_latencies.append(time.perf_counter() - start)
+            return response.json()
+
+    async def play(client: AsyncClient, game: dict):
+        async with semaphore:
+            closed = [(x, y) for x in range(16) for y in range(16)]
+            rng.shuffle(closed)
+            field = game['field']
+            for x, y in closed[:moves]:
+                if field[x][y] != CLOSED:
+                    continue
+                start = time.perf_counter()
+                response = await client.post('/api/turn', json={
+                    'game_id': game['game_id'], 'row': int(x), 'col': int(y)
+                })
+                turn_latencies.append(time.perf_counter() - start)
+                result = response.json()
+                if response.status_code != 200 or result['completed']:
+                    break
+                field = result['field']
+
+    batch_latencies = []
+    try:
+        async with AsyncClient(app=asgi_app, base_url='http://bench') as ac:
+            # Создание и ходы - отдельные фазы, у каждой свое время
+            start = time.perf_counter()
+            created = await asyncio.gather(
+                *(new_game(ac) for _ in range(games))
+            )
+            new_elapsed = time.perf_counter() - start
+            start = time.perf_counter()
+            await asyncio.gather(*(play(ac, game) for game in created))
+            turn_elapsed = time.perf_counter() - start
+
+            # Те же games игр одним запросом /api/new/batch
+            batch_start = time.perf_counter()
+            for _ in range(5):
+                start = time.perf_counter()
+                response = await ac.post('/api/new/batch', json={
+                    'width': 16, 'height': 16, 'mines_count': 40,
+                    'count': games
+                })
+                assert len(response.json()['game_ids']) == games
+                batch_latencies.append(time.perf_counter() - start)
+            batch_elapsed = time.perf_counter() - batch_start
+    finally:
+        asgi_app.dependency_overrides.pop(get_storage, None)
+
+    params = {'games': games, 'concurrency': concurrency}
+    batch = summary(
+        'http_new_batch', {'games': games}, batch_latencies, batch_elapsed
+    )
+    batch['games_per_second'] = batch['throughput'] * games
+    return [
+        summary('http_new', params, new_latencies, new_elapsed),
+        summary('http_turn', params, turn_latencies, turn_elapsed),
+        batch,
+    ]
+
+
+def compare(results: list[dict], baseline_path: str,
+            threshold: float) -> list[str]:
+    """
+    Замеры, у которых p50 вырос относительно прошлого прогона.
+    """
+    with open(baseline_path, encoding='utf-8') as file:
+        baseline = {
+            (item['name'], json.dumps(item['params'], sort_keys=True)): item
+            for item in json.load(file)['results']
+        }
+    regressions = []
+    for item in results:
+        key = (item['name'], json.dumps(item['params'], sort_keys=True))
+        old = baseline.get(key)
+        if old and item['p50_ms'] > old['p50_ms'] * (1 + threshold):
+            regressions.append(
+                f"{item['name']} {item['params']}: "
+                f"p50 {old['p50_ms']:.3f} -> {item['p50_ms']:.3f} ms"
+            )
+    return regressions
+
+
+async def run(args) -> dict:
+    boards = QUICK_BOARDS if args.quick else BOARDS
+    if args.backend == 'sqlite':
+        storage = SQLiteStorage(
+            os.path.join(tempfile.mkdtemp(), 'bench.sqlite3')
+        )
+    else:
+        storage = MemoryStorage()
+    await storage.setup()
+    try:
+        results = await micro_benchmarks(storage, boards, args.iterations)
+        results += await serialization_benchmarks(storage, args.iterations)
+        results += await load_test(
+            storage, args.games, args.concurrency, args.moves
+        )
+    finally:
+        await storage.close()
+    return {
+        'meta': {
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'backend': args.backend,
+            'quick': args.quick,
+        },
+        'results': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--output', default='bench_output.json')
+    parser.add_argument('--compare', help='JSON прошлого прогона')
+    parser.add_argument('--threshold', type=float, default=0.2)
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--games', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--moves', type=int, default=30)
+    parser.add_argument('--backend', choices=('memory', 'sqlite'),
+                        default='memory')
+    parser.add_argument('--quick', action='store_true',
+                        help='только поля до 30x30')
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump(report, file, ensure_ascii=False, indent=2)
+    for item in report['results']:
+        print(f"{item['name']:<24} {json.dumps(item['params']):<50} "
+              f"{item['throughput']:>10.1f}/s p50={item['p50_ms']:.3f}ms "
+              f"p95={item['p95_ms']:.3f}ms p99={item['p99_ms']:.3f}ms")
+
+    if args.compare:
+        regressions = compare(report['results'], args.compare, args.threshold)
+        for line in regressions:
+            print('REGRESSION', line)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
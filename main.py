@@ -1,18 +1,55 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from starlette.responses import JSONResponse
+from starlette.responses import JSONResponse, Response
 
+from app.config import GAME_CACHE_MODE, GAME_TTL
+from app.metrics import (
+    CONTENT_TYPE, ERRORS, MetricsMiddleware, error_type, render, route_path
+)
 from app.router import router_minesweeper
+from app.no_guess import board_pool
+from app.profiling import ProfilingMiddleware, enabled as profiling_enabled
+from app.schemas import game_cache
+from app.solver import shutdown_pool
+from app.storage import close_storage, expire_idle_games, get_storage
 from app.utils import MinesWeeperHTTPException
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    # Одно хранилище (и один пул соединений с Mongo) на весь процесс
+    storage = await get_storage()
+    await storage.setup()
+    # Mongo удаляет брошенные игры TTL индексом, остальные - задачей
+    expiry = None
+    if GAME_TTL and not storage.expires_itself:
+        expiry = asyncio.create_task(expire_idle_games(storage))
+    if GAME_CACHE_MODE == 'write-behind':
+        game_cache.start()
+    yield
+    await board_pool.close()
+    if expiry is not None:
+        expiry.cancel()
+    # Перед закрытием хранилища пишем в него все игры из кеша
+    await game_cache.close()
+    await close_storage()
+    shutdown_pool()
+
+
+app = FastAPI(lifespan=lifespan)
 
 
 @app.exception_handler(MinesWeeperHTTPException)
 async def http_exception_handler(
         request: Request, exc: MinesWeeperHTTPException
 ):
+    ERRORS.inc(
+        route_path(request.scope), error_type(exc.detail),
+        str(exc.status_code)
+    )
     return JSONResponse(
         status_code=exc.status_code,
         content={"error": exc.detail},
@@ -27,4 +64,15 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Профилирование только по настройке, без нее запросы идут мимо
+if profiling_enabled():
+    app.add_middleware(ProfilingMiddleware)
+
+app.add_middleware(MetricsMiddleware)
+
 app.include_router(router_minesweeper)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return Response(content=render(), media_type=CONTENT_TYPE)